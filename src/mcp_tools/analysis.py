@@ -1,33 +1,624 @@
-import sumolib
-import pandas as pd
+import logging
 import os
+import time
+from typing import Optional, Tuple
 
-def analyze_fcd(fcd_file: str) -> str:
+import numpy as np
+
+from utils.edgedata import EdgeDataSummary, summarize_edgedata
+from utils.fcd import FCDSpeedSummary, detect_fcd_format, summarize_fcd_speeds
+from utils.fcd_cube import DEFAULT_BIN_SECONDS, EdgeTimeCube, build_grid_heatmap, load_edge_time_cube
+from utils.fcd_index import RecordCollector, load_fcd_index, query_records
+from utils.fcd_store import load_fcd_store, open_fcd_store, summarize_store_speeds, visit_store_rows
+from utils.kpi import TRIP_METRICS, SummaryStats, compare_trips, read_summary, read_tripinfo, summarize_trips
+from utils.output import truncate_text
+from utils.output_profiles import OutputFiles, OutputProfile
+from utils.tail import follow_output
+
+logger = logging.getLogger(__name__)
+
+
+def _format_statistics(summary: FCDSpeedSummary) -> str:
+    """Render speed statistics in the same layout as `pandas.DataFrame.describe()`."""
+    stats = summary.speed
+    rows = [
+        ("count", float(stats.count)),
+        ("mean", stats.mean),
+        ("std", stats.std),
+        ("min", stats.min),
+        ("25%", summary.sketch.quantile(0.25)),
+        ("50%", summary.sketch.quantile(0.5)),
+        ("75%", summary.sketch.quantile(0.75)),
+        ("max", stats.max),
+    ]
+    lines = [f"{'':<5}{'speed':>15}"]
+    for label, value in rows:
+        if value is None:
+            value = float("nan")
+        # Sketch quantiles are approximate; never report them outside the exact range.
+        if label.endswith("%"):
+            value = min(max(value, stats.min), stats.max)
+        lines.append(f"{label:<5}{value:>15.6f}")
+    return "\n".join(lines)
+
+
+def analyze_fcd(fcd_file: str, use_store: bool = True, workers: Optional[int] = None) -> str:
     """
     Analyze FCD (Floating Car Data) output XML to compute basic statistics.
+
+    With `use_store` (default), the file is converted once into a columnar store
+    next to it (see `utils.fcd_store`) and repeat calls are answered from the
+    memory-mapped columns. Otherwise the file is streamed with an event-based
+    parser; in both cases memory use stays constant regardless of the file size.
+
+    Large files are parsed by `workers` processes over `<timestep>` byte ranges
+    (default: `SUMO_MCP_FCD_WORKERS`, or one per CPU); files below
+    `SUMO_MCP_FCD_PARALLEL_MIN_BYTES` are always parsed serially.
     """
     if not os.path.exists(fcd_file):
         return f"Error: File {fcd_file} not found."
 
     try:
-        speeds = []
-        vehicle_counts = 0
-        
-        # sumolib.output.parse returns a generator
-        for timestep in sumolib.output.parse(fcd_file, 'timestep'):
-            if timestep.vehicle:
-                for vehicle in timestep.vehicle:
-                    speeds.append(float(vehicle.speed))
-                    vehicle_counts += 1
-        
-        if not speeds:
+        started = time.perf_counter()
+        source = "streamed XML"
+        summary = None
+        bytes_read = 0
+
+        if use_store:
+            try:
+                store = open_fcd_store(fcd_file)
+                source = "columnar store (cached)"
+                if store is None:
+                    store = load_fcd_store(fcd_file, rebuild=True, workers=workers)
+                    source = f"columnar store (built at {store.path})"
+                summary = summarize_store_speeds(store)
+                bytes_read = int(store.meta.get("bytes", 0))
+            except OSError as exc:
+                logger.warning("FCD store unavailable for %s, streaming instead: %s", fcd_file, exc)
+                summary = None
+                source = "streamed XML"
+
+        if summary is None:
+            summary, bytes_read = summarize_fcd_speeds(fcd_file, workers=workers)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+
+        vehicle_counts = summary.speed.count
+        if vehicle_counts == 0:
             return "No vehicle data found in FCD output."
-            
-        avg_speed = sum(speeds) / len(speeds)
-        
-        df = pd.DataFrame({'speed': speeds})
-        desc = df.describe().to_string()
-        
-        return f"Analysis Result:\nTotal Data Points: {vehicle_counts}\nAverage Speed: {avg_speed:.2f} m/s\n\nStatistics:\n{desc}"
+
+        desc = _format_statistics(summary)
+        throughput = (
+            f"{source}, {bytes_read / 1e6:.2f} MB of FCD in {elapsed:.3f}s "
+            f"({vehicle_counts / elapsed:,.0f} rows/s, {bytes_read / 1e6 / elapsed:.2f} MB/s)"
+        )
+        accuracy = summary.sketch.relative_accuracy * 100
+
+        return (
+            f"Analysis Result:\nTotal Data Points: {vehicle_counts}\n"
+            f"Timesteps: {summary.timesteps}\n"
+            f"Average Speed: {summary.speed.mean:.2f} m/s\n\n"
+            f"Statistics:\n{desc}\n"
+            f"(quantiles are approximate, within {accuracy:.1f}% relative error)\n\n"
+            f"Throughput: {throughput}"
+        )
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def _format_edgedata(summary: EdgeDataSummary, top_k: int, min_vehicle_seconds: float) -> str:
+    totals = summary.totals()
+    vehicle_seconds = float(totals[:, 0].sum())
+    mean_speed = float(totals[:, 1].sum()) / vehicle_seconds
+
+    ids = np.array(list(summary.edges.keys()), dtype=object)
+    eligible = (totals[:, 0] >= min_vehicle_seconds) & np.array([not e.startswith(":") for e in ids])
+    edge_speed = totals[:, 1] / totals[:, 0]
+    order = np.flatnonzero(eligible)[np.argsort(edge_speed[eligible], kind="stable")][:max(0, top_k)]
+    lines = [f"{'edge':<20}{'speed':>10}{'veh_s':>12}{'waiting_s':>12}{'timeloss_s':>12}"]
+    for i in order:
+        lines.append(
+            f"{ids[i]:<20}{edge_speed[i]:>10.2f}{totals[i, 0]:>12.0f}{totals[i, 2]:>12.0f}{totals[i, 3]:>12.0f}"
+        )
+
+    return (
+        f"Edge Data Analysis:\nIntervals: {summary.intervals}\nEdges with traffic: {len(summary.edges)}\n"
+        f"Average Speed: {mean_speed:.2f} m/s (vehicle-time weighted)\n"
+        f"Vehicle-seconds: {vehicle_seconds:,.0f}\n"
+        f"Total waiting time: {totals[:, 2].sum():,.0f} s\n"
+        f"Total time loss: {totals[:, 3].sum():,.0f} s\n"
+        f"Edge entries: {summary.entered:,.0f}\n\n"
+        f"Slowest edges (>= {min_vehicle_seconds:g} vehicle-seconds):\n" + "\n".join(lines)
+    )
+
+
+def analyze_edgedata(edgedata_file: str, top_k: int = 5, min_vehicle_seconds: float = 60.0) -> str:
+    """
+    Summarize SUMO edgeData (meandata) output: network speed and delay plus the slowest edges.
+
+    This is the analysis for runs without FCD (`aggregate` output profile). Speeds are
+    weighted by `sampledSeconds`, i.e. they are vehicle-time averages like the FCD mean.
+    The file is streamed, so interval count and size do not matter.
+    """
+    if not os.path.exists(edgedata_file):
+        return f"Error: File {edgedata_file} not found."
+
+    try:
+        summary = summarize_edgedata(edgedata_file)
+        if not summary.edges:
+            return "No edge data found in edgeData output."
+        return _format_edgedata(summary, top_k, min_vehicle_seconds)
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def follow_analysis(
+    output_file: str,
+    kind: Optional[str] = None,
+    reset: bool = False,
+    top_k: int = 5,
+    min_vehicle_seconds: float = 60.0,
+) -> str:
+    """
+    Incrementally analyze an FCD or edgeData file that a running simulation is still writing.
+
+    Each call parses only the bytes appended since the previous call for the same file
+    (see `utils.tail`) and returns the statistics over everything parsed so far.
+    """
+    if not os.path.exists(output_file):
+        return f"Error: File {output_file} not found."
+
+    try:
+        started = time.perf_counter()
+        follower, new_bytes, restarted = follow_output(output_file, kind=kind, reset=reset)
+        elapsed = time.perf_counter() - started
+        header = (
+            f"Tail-follow of {output_file} ({follower.kind}), poll #{follower.polls}: "
+            f"parsed {new_bytes / 1e3:.1f} KB new data in {elapsed:.3f}s, "
+            f"offset {follower.offset / 1e6:.2f} MB"
+        )
+        if restarted:
+            header += "\nFile was truncated or replaced; aggregates restarted from the beginning."
+
+        summary = follower.summary
+        if isinstance(summary, FCDSpeedSummary):
+            if summary.speed.count == 0:
+                return f"{header}\nNo vehicle data yet."
+            accuracy = summary.sketch.relative_accuracy * 100
+            return (
+                f"{header}\n"
+                f"Total Data Points: {summary.speed.count}\n"
+                f"Timesteps: {summary.timesteps} (t=[{summary.first_time:g}, {summary.last_time:g}])\n"
+                f"Average Speed: {summary.speed.mean:.2f} m/s\n\n"
+                f"Statistics:\n{_format_statistics(summary)}\n"
+                f"(quantiles are approximate, within {accuracy:.1f}% relative error)"
+            )
+
+        if not summary.edges:
+            return f"{header}\nNo edge data yet."
+        return (
+            f"{header}\nData up to t={summary.last_end:g}\n"
+            f"{_format_edgedata(summary, top_k, min_vehicle_seconds)}"
+        )
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def _format_summary_stats(stats: SummaryStats) -> str:
+    return (
+        f"Inserted: {stats.inserted}, Arrived: {stats.arrived}, "
+        f"Throughput: {stats.throughput_per_hour:.1f} veh/h, Teleports: {stats.teleports}, "
+        f"Collisions: {stats.collisions}, Max running: {stats.max_running}, Max halting: {stats.max_halting}"
+    )
+
+
+def analyze_trip_kpis(tripinfo_file: str, summary_file: Optional[str] = None, n_resamples: int = 1000) -> str:
+    """
+    Trip KPIs of one run from tripinfo (and optionally summary) output.
+
+    Reports mean, 95% bootstrap CI and total of travel time (duration), waiting time,
+    time loss, insertion delay and route length, plus throughput and teleports.
+    """
+    for path in (tripinfo_file, summary_file):
+        if path and not os.path.exists(path):
+            return f"Error: File {path} not found."
+    if n_resamples < 1:
+        return f"Error: n_resamples must be >= 1, got {n_resamples}"
+
+    try:
+        trips = read_tripinfo(tripinfo_file)
+        if trips.count == 0:
+            return "No trips found in tripinfo output."
+        lines = [f"{'metric':<14}{'mean':>12}{'95% CI':>24}{'total':>14}"]
+        for m in summarize_trips(trips, n_resamples):
+            ci = f"[{m.ci[0]:.2f}, {m.ci[1]:.2f}]"
+            lines.append(f"{m.name:<14}{m.mean:>12.2f}{ci:>24}{m.total:>14.0f}")
+        result = f"Trip KPIs: {trips.count} trips ({trips.vaporized} vaporized)\n" + "\n".join(lines)
+        if summary_file:
+            result += "\n" + _format_summary_stats(read_summary(summary_file))
+        return result
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def compare_trip_kpis(
+    baseline_tripinfo: str,
+    optimized_tripinfo: str,
+    baseline_summary: Optional[str] = None,
+    optimized_summary: Optional[str] = None,
+    n_resamples: int = 1000,
+) -> str:
+    """
+    Compare two runs on trip KPIs.
+
+    Vehicles are joined by id (vectorized); deltas are optimized - baseline, so negative
+    values are improvements for time metrics. The paired 95% bootstrap CI is over the
+    per-vehicle differences of vehicles that completed both runs.
+    """
+    for path in (baseline_tripinfo, optimized_tripinfo, baseline_summary, optimized_summary):
+        if path and not os.path.exists(path):
+            return f"Error: File {path} not found."
+    if n_resamples < 1:
+        return f"Error: n_resamples must be >= 1, got {n_resamples}"
+
+    try:
+        baseline = read_tripinfo(baseline_tripinfo)
+        optimized = read_tripinfo(optimized_tripinfo)
+        paired = compare_trips(baseline, optimized, n_resamples)
+
+        lines = [
+            f"{'metric':<14}{'baseline':>11}{'optimized':>11}{'delta':>10}{'delta%':>9}{'paired delta (95% CI)':>32}"
+        ]
+        for name, diff in zip(TRIP_METRICS, paired.metrics):
+            base = float(np.nanmean(baseline.metrics[name])) if baseline.count else float("nan")
+            opt = float(np.nanmean(optimized.metrics[name])) if optimized.count else float("nan")
+            delta = opt - base
+            pct = f"{delta / base * 100:+.1f}%" if base else "n/a"
+            ci = f"{diff.mean:+.2f} [{diff.ci[0]:+.2f}, {diff.ci[1]:+.2f}]"
+            lines.append(f"{name:<14}{base:>11.2f}{opt:>11.2f}{delta:>+10.2f}{pct:>9}{ci:>32}")
+
+        result = (
+            f"Trip KPI comparison (optimized - baseline)\n"
+            f"Trips: baseline {baseline.count}, optimized {optimized.count}, matched {paired.matched} "
+            f"(baseline only {paired.baseline_only}, optimized only {paired.optimized_only})\n"
+            f"Vaporized: baseline {baseline.vaporized}, optimized {optimized.vaporized}\n\n" + "\n".join(lines)
+        )
+        if baseline_summary and optimized_summary:
+            result += (
+                f"\n\nBaseline:  {_format_summary_stats(read_summary(baseline_summary))}"
+                f"\nOptimized: {_format_summary_stats(read_summary(optimized_summary))}"
+            )
+        return result
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def analyze_run_outputs(profile: OutputProfile, files: OutputFiles) -> str:
+    """Analyze whichever outputs `profile` enabled for one workflow run."""
+    header = f"Output profile: {profile.describe()}"
+    if files.fcd:
+        if not os.path.exists(files.fcd):
+            return f"{header}\nError: FCD file {files.fcd} was not generated."
+        return f"{header}\n{analyze_fcd(files.fcd)}"
+    if files.edgedata:
+        produced = ", ".join(os.path.basename(p) for p in (files.summary, files.tripinfo) if p and os.path.exists(p))
+        return f"{header}\n{analyze_edgedata(files.edgedata)}\nOther outputs: {produced or 'none'}"
+    return f"{header}\nNo analyzable outputs configured."
+
+
+def _format_records(collector: RecordCollector, include_id: bool) -> str:
+    header = "time,id,x,y,speed,lane" if include_id else "time,x,y,speed,lane"
+    lines = [header]
+    for t, attrs in collector.records:
+        fields = [f"{t:g}"]
+        if include_id:
+            fields.append(attrs.get("id", ""))
+        fields.extend(attrs.get(k, "") for k in ("x", "y", "speed", "lane"))
+        lines.append(",".join(fields))
+    if collector.matched > len(collector.records):
+        lines.append(f"... ({collector.matched - len(collector.records)} more records not shown; raise 'limit')")
+    return "\n".join(lines)
+
+
+def _format_read_cost(bytes_read: Optional[int], fcd_file: str, elapsed: float) -> str:
+    if bytes_read is None:
+        return f"Answered from the columnar store in {elapsed:.3f}s"
+    total = os.path.getsize(fcd_file)
+    share = bytes_read / total * 100 if total else 0.0
+    return f"Read {bytes_read / 1e3:.1f} KB of {total / 1e6:.2f} MB FCD ({share:.2f}%) in {elapsed:.3f}s"
+
+
+def fcd_trajectory(fcd_file: str, vehicle_id: str, limit: int = 500, workers: Optional[int] = None) -> str:
+    """
+    Return the trajectory of one vehicle, reading only the timesteps in which it appears.
+
+    Plain XML uses the sidecar byte-offset index (`utils.fcd_index`); compressed or
+    tabular FCD is answered from the columnar store. Both are built on first use.
+    """
+    if not os.path.exists(fcd_file):
+        return f"Error: File {fcd_file} not found."
+
+    try:
+        started = time.perf_counter()
+        if detect_fcd_format(fcd_file) == "xml":
+            index = load_fcd_index(fcd_file, workers=workers)
+            runs = index.vehicle_runs(vehicle_id)
+            collector, bytes_read = query_records(fcd_file, runs, vehicle_id=vehicle_id, limit=limit, index=index)
+            segments = f", {len(runs)} segment(s)"
+        else:
+            collector = RecordCollector(vehicle_id, limit)
+            visit_store_rows(load_fcd_store(fcd_file, workers=workers), collector, vehicle_id=vehicle_id)
+            bytes_read = None
+            segments = ""
+        if collector.matched == 0:
+            return f"Vehicle '{vehicle_id}' not found in {fcd_file}."
+        elapsed = time.perf_counter() - started
+
+        return truncate_text(
+            f"Trajectory of vehicle '{vehicle_id}': {collector.matched} points, "
+            f"t=[{collector.first_time:g}, {collector.last_time:g}]{segments}\n"
+            f"Speed: mean {collector.speed.mean:.2f} m/s, min {collector.speed.min:.2f}, "
+            f"max {collector.speed.max:.2f}\n"
+            f"{_format_read_cost(bytes_read, fcd_file, elapsed)}\n\n"
+            f"{_format_records(collector, include_id=False)}"
+        )
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def fcd_window(fcd_file: str, t0: float, t1: float, limit: int = 200, workers: Optional[int] = None) -> str:
+    """
+    Summarize (and list up to `limit` records of) all vehicles within simulation time [t0, t1].
+
+    Plain XML uses the sidecar byte-offset index (`utils.fcd_index`); compressed or
+    tabular FCD is answered from the columnar store. Both are built on first use.
+    """
+    if not os.path.exists(fcd_file):
+        return f"Error: File {fcd_file} not found."
+    if t1 < t0:
+        return "Error: t1 must be >= t0"
+
+    try:
+        started = time.perf_counter()
+        if detect_fcd_format(fcd_file) == "xml":
+            index = load_fcd_index(fcd_file, workers=workers)
+            lo, hi = index.steps_between(t0, t1)
+            if hi <= lo:
+                return f"No timesteps within [{t0:g}, {t1:g}] in {fcd_file}."
+            collector, bytes_read = query_records(fcd_file, [(lo, hi)], limit=limit, index=index)
+        else:
+            collector = RecordCollector(None, limit)
+            visit_store_rows(load_fcd_store(fcd_file, workers=workers), collector, t0=t0, t1=t1)
+            bytes_read = None
+        elapsed = time.perf_counter() - started
+        speed = collector.speed
+        speed_line = (
+            f"Speed: mean {speed.mean:.2f} m/s, std {speed.std:.2f}, min {speed.min:.2f}, max {speed.max:.2f}"
+            if speed.count
+            else "Speed: no vehicle records"
+        )
+
+        return truncate_text(
+            f"Window [{t0:g}, {t1:g}]: {collector.timesteps} timesteps, {collector.matched} records, "
+            f"{len(collector.vehicle_ids)} vehicles\n"
+            f"{speed_line}\n"
+            f"{_format_read_cost(bytes_read, fcd_file, elapsed)}\n\n"
+            f"{_format_records(collector, include_id=True)}"
+        )
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+_CONGESTION_METRICS = ("speed", "vehicle_seconds", "density")
+
+
+def _edge_mask(cube: EdgeTimeCube, include_internal: bool) -> np.ndarray:
+    mask = np.array([bool(e) for e in cube.edges], dtype=bool)
+    if not include_internal:
+        mask &= ~np.char.startswith(cube.edges.astype(str), ":")
+    return mask
+
+
+def fcd_congestion(
+    fcd_file: str,
+    top_k: int = 10,
+    bin_seconds: float = DEFAULT_BIN_SECONDS,
+    t0: Optional[float] = None,
+    t1: Optional[float] = None,
+    metric: str = "speed",
+    min_vehicle_seconds: float = 60.0,
+    net_file: Optional[str] = None,
+    include_internal: bool = False,
+    workers: Optional[int] = None,
+) -> str:
+    """
+    Rank the most congested edges from the cached edge x time cube.
+
+    metric:
+    - speed: lowest mean speed (edges with at least `min_vehicle_seconds`)
+    - vehicle_seconds: highest occupancy
+    - density: highest mean vehicles/km (requires `net_file` for edge lengths)
+    """
+    if not os.path.exists(fcd_file):
+        return f"Error: File {fcd_file} not found."
+    if metric not in _CONGESTION_METRICS:
+        return f"Error: metric must be one of {list(_CONGESTION_METRICS)}, got {metric!r}"
+    if metric == "density" and not net_file:
+        return "Error: metric 'density' requires net_file (for edge lengths)"
+
+    try:
+        cube = load_edge_time_cube(fcd_file, bin_seconds, net_file=net_file, workers=workers)
+        bins = cube.bins_between(t0, t1)
+        veh_s, mean_speed = cube.edge_totals(bins)
+        n_bins = max(1, bins.stop - bins.start)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            density = veh_s / (n_bins * cube.bin_seconds) / (cube.edge_length / 1000.0)
+
+        mask = _edge_mask(cube, include_internal) & (veh_s > 0)
+        if metric == "speed":
+            mask &= veh_s >= min_vehicle_seconds
+            score = np.where(mask, mean_speed, np.inf)
+            order = np.argsort(score, kind="stable")
+        else:
+            values = veh_s if metric == "vehicle_seconds" else density
+            # Edges without a usable length have no density and must not fill the top-k.
+            mask &= np.isfinite(values)
+            score = np.where(mask, values, -np.inf)
+            order = np.argsort(-score, kind="stable")
+        order = order[: min(top_k, int(mask.sum()))]
+        if order.size == 0:
+            return "No edges match the selection (try lowering min_vehicle_seconds or widening the window)."
+
+        t_lo = cube.t_begin + bins.start * cube.bin_seconds
+        t_hi = cube.t_begin + bins.stop * cube.bin_seconds
+        lines = [
+            f"Top {order.size} congested edges by {metric}, t=[{t_lo:g}, {t_hi:g}) "
+            f"({cube.n_bins} bins of {cube.bin_seconds:g}s, step {cube.step_length:g}s)",
+            "edge,mean_speed_mps,vehicle_seconds,density_veh_per_km",
+        ]
+        for i in order:
+            lines.append(f"{cube.edges[i]},{mean_speed[i]:.2f},{veh_s[i]:.0f},{density[i]:.2f}")
+        return truncate_text("\n".join(lines))
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def fcd_time_profile(
+    fcd_file: str,
+    bin_seconds: float = DEFAULT_BIN_SECONDS,
+    edge_id: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> str:
+    """Return the per-time-bin mean speed and vehicle count, network-wide or for one edge."""
+    if not os.path.exists(fcd_file):
+        return f"Error: File {fcd_file} not found."
+
+    try:
+        cube = load_edge_time_cube(fcd_file, bin_seconds, workers=workers)
+        if edge_id is not None:
+            matches = np.nonzero(cube.edges == edge_id)[0]
+            if matches.size == 0:
+                return f"Edge '{edge_id}' not found in {fcd_file}."
+            rows = matches[:1]
+        else:
+            rows = np.nonzero(_edge_mask(cube, include_internal=True))[0]
+
+        count = cube.count[rows].sum(axis=0)
+        speed_sum = cube.speed_sum[rows].sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_speed = np.where(count > 0, speed_sum / count, np.nan)
+        vehicles = count * cube.step_length / cube.bin_seconds
+
+        scope = f"edge '{edge_id}'" if edge_id is not None else "network"
+        lines = [
+            f"Time profile ({scope}), {cube.n_bins} bins of {cube.bin_seconds:g}s",
+            "bin_start,mean_speed_mps,mean_vehicles,vehicle_seconds",
+        ]
+        for start, speed, veh, c in zip(cube.bin_starts(), mean_speed, vehicles, count):
+            lines.append(f"{start:g},{speed:.2f},{veh:.2f},{c * cube.step_length:.0f}")
+        return truncate_text("\n".join(lines))
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def fcd_compare(
+    baseline_fcd: str,
+    optimized_fcd: str,
+    bin_seconds: float = DEFAULT_BIN_SECONDS,
+    top_k: int = 10,
+    min_vehicle_seconds: float = 60.0,
+    workers: Optional[int] = None,
+) -> str:
+    """Diff two runs edge-by-edge and bin-by-bin (optimized minus baseline) using their cubes."""
+    for path in (baseline_fcd, optimized_fcd):
+        if not os.path.exists(path):
+            return f"Error: File {path} not found."
+
+    try:
+        base = load_edge_time_cube(baseline_fcd, bin_seconds, workers=workers)
+        opt = load_edge_time_cube(optimized_fcd, bin_seconds, workers=workers)
+
+        # Align edges by id (union) with vectorized index lookups.
+        edges = np.union1d(base.edges.astype(str), opt.edges.astype(str))
+        edges = edges[(edges != "") & ~np.char.startswith(edges, ":")]
+
+        def _aligned(cube: EdgeTimeCube) -> Tuple[np.ndarray, np.ndarray]:
+            veh_s, mean = cube.edge_totals()
+            names = cube.edges.astype(str)
+            order = np.argsort(names)
+            pos = np.searchsorted(names, edges, sorter=order)
+            pos = np.clip(pos, 0, max(0, names.size - 1))
+            idx = order[pos] if names.size else pos
+            found = names[idx] == edges if names.size else np.zeros(edges.size, dtype=bool)
+            return np.where(found, veh_s[idx], 0.0), np.where(found, mean[idx], np.nan)
+
+        base_veh_s, base_speed = _aligned(base)
+        opt_veh_s, opt_speed = _aligned(opt)
+        delta = opt_speed - base_speed
+        valid = (base_veh_s >= min_vehicle_seconds) & (opt_veh_s >= min_vehicle_seconds) & ~np.isnan(delta)
+
+        def _network(cube: EdgeTimeCube) -> np.ndarray:
+            count = cube.count.sum(axis=0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, cube.speed_sum.sum(axis=0) / count, np.nan)
+
+        base_profile, opt_profile = _network(base), _network(opt)
+        n = min(base_profile.size, opt_profile.size)
+        base_total = base.speed_sum.sum() / max(1, base.count.sum())
+        opt_total = opt.speed_sum.sum() / max(1, opt.count.sum())
+
+        lines = [
+            f"Baseline vs optimized ({bin_seconds:g}s bins)",
+            f"Network mean speed: {base_total:.2f} -> {opt_total:.2f} m/s ({opt_total - base_total:+.2f})",
+            f"Vehicle-seconds: {base.count.sum() * base.step_length:.0f} -> {opt.count.sum() * opt.step_length:.0f}",
+            "",
+            "bin_start,baseline_speed,optimized_speed,delta",
+        ]
+        for start, b, o in zip(base.bin_starts()[:n], base_profile[:n], opt_profile[:n]):
+            lines.append(f"{start:g},{b:.2f},{o:.2f},{o - b:+.2f}")
+
+        valid_idx = np.nonzero(valid)[0]
+        ranked = valid_idx[np.argsort(delta[valid_idx], kind="stable")]
+        k = min(top_k, ranked.size)
+        for title, picks in (("Largest improvements", ranked[::-1][:k]), ("Largest regressions", ranked[:k])):
+            lines.append("")
+            lines.append(f"{title} (edge,baseline_speed,optimized_speed,delta):")
+            for i in picks:
+                lines.append(f"{edges[i]},{base_speed[i]:.2f},{opt_speed[i]:.2f},{delta[i]:+.2f}")
+        return truncate_text("\n".join(lines))
+    except Exception as e:
+        return f"Analysis error: {str(e)}"
+
+
+def fcd_heatmap(
+    fcd_file: str,
+    cell_size: float = 100.0,
+    top_k: int = 20,
+    t0: Optional[float] = None,
+    t1: Optional[float] = None,
+    workers: Optional[int] = None,
+) -> str:
+    """Aggregate records onto an x/y grid and list the busiest cells with their mean speed."""
+    if not os.path.exists(fcd_file):
+        return f"Error: File {fcd_file} not found."
+
+    try:
+        store = load_fcd_store(fcd_file, workers=workers)
+        cells, count, speed_sum, nx, ny, x0, y0 = build_grid_heatmap(store, cell_size, t0, t1)
+        if cells.size == 0:
+            return "No vehicle data found in FCD output."
+
+        order = np.argsort(-count, kind="stable")[:top_k]
+        lines = [
+            f"Grid heatmap: {nx}x{ny} cells of {cell_size:g}m, origin ({x0:.1f}, {y0:.1f}), "
+            f"{cells.size} non-empty cells",
+            "cell_x,cell_y,x_min,y_min,records,mean_speed_mps",
+        ]
+        for i in order:
+            iy, ix = divmod(int(cells[i]), nx)
+            lines.append(
+                f"{ix},{iy},{x0 + ix * cell_size:.1f},{y0 + iy * cell_size:.1f},"
+                f"{count[i]},{speed_sum[i] / count[i]:.2f}"
+            )
+        return truncate_text("\n".join(lines))
     except Exception as e:
         return f"Analysis error: {str(e)}"
@@ -5,6 +5,8 @@ from importlib.util import find_spec
 from pathlib import Path
 from typing import Any, Callable, List, Optional, Tuple
 
+from utils.cancellation import report_progress
+from utils.controllers import Q_TABLE_FILE, save_q_tables
 from utils.traci import ensure_traci_start_stdout_suppressed
 
 # NOTE:
@@ -376,11 +378,22 @@ def run_rl_training(
                         decision_steps += 1
 
                     info_log.append(f"Episode {ep}/{episodes}: Total Reward = {ep_total_reward:.2f}")
+                    report_progress(info_log[-1])
 
                 # sumo-rl only auto-saves metrics for the previous episode on reset().
                 # Save the last episode explicitly.
                 env.save_csv(env.out_csv_name, env.episode)
 
+                # Reusable by utils.controllers.QTableSignalController on a live session.
+                q_table_path = save_q_tables(
+                    os.path.join(out_dir_abs, Q_TABLE_FILE),
+                    {ts_id: agent.q_table for ts_id, agent in agents.items()},
+                    delta_time=getattr(env, "delta_time", 5),
+                    yellow_time=getattr(env, "yellow_time", 2),
+                    min_green=getattr(env, "min_green", 5),
+                )
+                info_log.append(f"Q-tables saved to {q_table_path}")
+
                 return "\n".join(info_log)
             finally:
                 if env is not None:
@@ -1,27 +1,64 @@
+import math
 import os
 import logging
 import subprocess
+import time
+import uuid
+import numpy as np
 import traci
+import traci.constants as tc
+from typing import Any, Dict, Iterable, Optional, Union
 
+from utils.cancellation import raise_if_cancelled
+from utils.checkpoint import DEFAULT_CHECKPOINT_KEEP
+from utils.connection import DEFAULT_TRACI_TIMEOUT_S, connection_manager
+from utils.online_kpi import OnlineKPICollector, parse_kpis
+from utils.stats import RunningStats
+from utils.stepping import DEFAULT_INTERVAL_S, IntervalAggregator, StopConditions
 from utils.sumo import build_sumo_diagnostics, find_sumo_binary
 from utils.timeout import run_with_adaptive_timeout
-from utils.traci import traci_close_best_effort
+from utils.traci import TRACI_BACKENDS, acquire_backend, release_libsumo, require_libsumo, traci_close_best_effort
 
 logger = logging.getLogger(__name__)
 
-def run_simple_simulation(config_path: str, steps: int = 100) -> str:
+def run_simple_simulation(
+    config_path: str,
+    steps: int = 100,
+    kpis: Optional[Union[str, Iterable[str]]] = None,
+    backend: Optional[str] = None,
+    until_time: Optional[float] = None,
+    stop_when_empty: bool = True,
+    max_wall_s: Optional[float] = None,
+) -> str:
     """
     Run a SUMO simulation using the given configuration file.
     
     Args:
         config_path: Path to the .sumocfg file.
-        steps: Number of simulation steps to run.
+        steps: Maximum number of simulation steps to run.
+        kpis: Online KPIs to collect through TraCI subscriptions while stepping
+            ("speed", "halting", "edges", "arrivals"; default all, "" or [] for none).
+            No output files are written for them; see `utils.online_kpi`.
+        backend: "traci" (socket) or "libsumo" (in-process, no IPC per call); defaults to
+            SUMO_MCP_TRACI_BACKEND. libsumo falls back to TraCI when it is unavailable or busy.
+        until_time: Stop once the simulation time reaches this value.
+        stop_when_empty: Stop early once no vehicles are running or waiting to be inserted.
+        max_wall_s: Wall-clock budget in seconds.
         
     Returns:
         A summary string of the simulation execution.
     """
     if not os.path.exists(config_path):
         return f"Error: Config file not found at {config_path}"
+    try:
+        selected_kpis = parse_kpis(kpis)
+        conditions = StopConditions(
+            until_time=until_time, max_steps=steps, no_vehicles=stop_when_empty, max_wall_s=max_wall_s
+        )
+    except ValueError as e:
+        return f"Error: {e}"
+    if backend and backend.strip().lower() not in TRACI_BACKENDS:
+        return f"Error: Unknown backend '{backend}'. Available: {', '.join(TRACI_BACKENDS)}"
 
     sumo_binary = find_sumo_binary("sumo")
     if not sumo_binary:
@@ -34,40 +71,83 @@ def run_simple_simulation(config_path: str, steps: int = 100) -> str:
         )
     
     # Start simulation
-    # We use a random label to allow parallel runs if needed (though traci global lock is an issue)
-    # Ideally use libsumo if available for speed, but traci is safer for now.
+    # A private TraCI label keeps this run off the global default connection, so it can run
+    # next to (and never disturbs) the sessions of `utils.connection.connection_manager`.
     cmd = [sumo_binary, "-c", config_path, "--no-step-log", "true", "--random"]
+    labels: list[str] = []
     
+    def _step(conn: Any) -> tuple[RunningStats, Optional[OnlineKPICollector], str]:
+        collector = OnlineKPICollector(selected_kpis) if selected_kpis else None
+        if collector is not None:
+            collector.subscribe(conn)
+
+        vehicle_counts = RunningStats()
+        # Simulation time is derived from the step length instead of one more request per step.
+        begin, delta_t = conn.simulation.getTime(), conn.simulation.getDeltaT()
+        wall_start = time.perf_counter()
+        vehicles: Optional[int] = None
+        while True:
+            raise_if_cancelled()
+            min_expected = conn.simulation.getMinExpectedNumber() if conditions.needs_min_expected else None
+            reason = conditions.reached(
+                begin + vehicle_counts.count * delta_t,
+                vehicle_counts.count,
+                vehicles,
+                min_expected,
+                time.perf_counter() - wall_start,
+            )
+            if reason is not None:
+                return vehicle_counts, collector, reason
+            conn.simulationStep()
+            vehicles = conn.vehicle.getIDCount()
+            vehicle_counts.add(vehicles)
+            if collector is not None:
+                collector.collect(conn)
+
     try:
         def _run() -> str:
             # IMPORTANT: MCP uses stdout for JSON-RPC over stdio.
             # SUMO can write progress/log output to stdout which would corrupt the protocol stream,
             # causing clients to hang or show "undefined" responses.
-            traci.start(cmd, stdout=subprocess.DEVNULL)
+            active, fallback = acquire_backend(backend)
+            if active == "libsumo":
+                conn = require_libsumo()
+                try:
+                    conn.start(cmd)
+                    vehicle_counts, collector, reason = _step(conn)
+                finally:
+                    try:
+                        conn.close()
+                    finally:
+                        release_libsumo()
+            else:
+                label = f"sumo-mcp:run:{uuid.uuid4().hex[:8]}"
+                labels.append(label)
+                traci.start(cmd, label=label, stdout=subprocess.DEVNULL, doSwitch=False)
+                conn = traci.getConnection(label)
+                vehicle_counts, collector, reason = _step(conn)
+                conn.close()
 
-            vehicle_counts = []
-            for _ in range(steps):
-                traci.simulationStep()
-                vehicle_counts.append(traci.vehicle.getIDCount())
+            avg_vehicles = vehicle_counts.mean if vehicle_counts.count else 0
+            max_vehicles = int(vehicle_counts.max) if vehicle_counts.count else 0
 
-            traci.close()
-
-            avg_vehicles = sum(vehicle_counts) / len(vehicle_counts) if vehicle_counts else 0
-            max_vehicles = max(vehicle_counts) if vehicle_counts else 0
-
-            return (
+            result = (
                 "Simulation finished successfully.\n"
-                f"Steps run: {steps}\n"
+                f"Steps run: {vehicle_counts.count} (stopped: {reason})\n"
                 f"Average vehicles: {avg_vehicles:.2f}\n"
-                f"Max vehicles: {max_vehicles}"
+                f"Max vehicles: {max_vehicles}\n"
+                f"Backend: {active}" + (f" ({fallback})" if fallback else "")
             )
+            if collector is not None:
+                result += "\n\n" + collector.format()
+            return result
 
         return run_with_adaptive_timeout(_run, operation="simulation", params={"steps": steps})
                 
     except Exception as e:
-        closed = traci_close_best_effort()
-        if not closed:
-            logger.debug("traci.close timed out during cleanup for %s", config_path)
+        for label in labels:
+            if not traci_close_best_effort(label=label):
+                logger.debug("traci.close timed out during cleanup for %s", config_path)
         return "\n".join(
             [
                 f"Simulation error: {type(e).__name__}: {e}",
@@ -77,3 +157,213 @@ def run_simple_simulation(config_path: str, steps: int = 100) -> str:
                 f"- SUMO_HOME: {os.environ.get('SUMO_HOME', 'Not Set')}",
             ]
         )
+
+
+# Steps run per worker request; the session queue stays responsive between batches.
+_RUN_UNTIL_BATCH_WALL_S = 0.5
+_RUN_UNTIL_SIM_VARS = (
+    tc.VAR_TIME,
+    tc.VAR_MIN_EXPECTED_VEHICLES,
+    tc.VAR_DEPARTED_VEHICLES_NUMBER,
+    tc.VAR_ARRIVED_VEHICLES_NUMBER,
+)
+
+
+def run_until(
+    conditions: StopConditions,
+    interval_s: float = DEFAULT_INTERVAL_S,
+    session_id: Optional[str] = None,
+    timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+) -> str:
+    """
+    Advance a live session server-side until a stop condition holds.
+
+    Steps run in batches on the session worker; vehicle speeds and simulation counters come
+    from the session's subscriptions, so a step costs no request besides `simulationStep`.
+    `timeout_s` applies to each batch.
+
+    Returns:
+        A summary line plus per-interval statistics.
+    """
+    session = connection_manager.get_session(session_id)
+    aggregator = IntervalAggregator(interval_s)
+    wall_start = time.perf_counter()
+    steps = 0
+    start = math.nan
+    stop_reason: Optional[str] = None
+
+    def _batch(conn: Any) -> None:
+        nonlocal steps, start, stop_reason
+        subscription = session.vehicle_states
+        subscription.ensure(conn, ["speed"], sim_variables=_RUN_UNTIL_SIM_VARS)
+        if math.isnan(start):
+            start = subscription.time(conn)
+        deadline = time.perf_counter() + _RUN_UNTIL_BATCH_WALL_S
+        stepped = False
+        try:
+            while True:
+                speeds = np.fromiter(
+                    (row["speed"] for row in subscription.read(conn, ["speed"]).values()), dtype=np.float64
+                )
+                reason = conditions.reached(
+                    subscription.time(conn),
+                    steps,
+                    int(speeds.size),
+                    subscription.simulation_value(conn, tc.VAR_MIN_EXPECTED_VEHICLES),
+                    time.perf_counter() - wall_start,
+                )
+                if reason is not None:
+                    stop_reason = reason
+                    return
+                if stepped and time.perf_counter() >= deadline:
+                    return
+                conn.simulationStep()
+                stepped = True
+                steps += 1
+                session.steps += 1
+                session.observe_step(conn)
+                speeds = np.fromiter(
+                    (row["speed"] for row in subscription.read(conn, ["speed"]).values()), dtype=np.float64
+                )
+                aggregator.add(
+                    subscription.time(conn),
+                    int(speeds.size),
+                    speeds,
+                    int(subscription.simulation_value(conn, tc.VAR_DEPARTED_VEHICLES_NUMBER, 0)),
+                    int(subscription.simulation_value(conn, tc.VAR_ARRIVED_VEHICLES_NUMBER, 0)),
+                )
+        finally:
+            if stepped:
+                session.snapshot.invalidate(subscription.time(conn))
+
+    while stop_reason is None:
+        raise_if_cancelled()
+        connection_manager.traci_call(_batch, "run_until", timeout_s=timeout_s, session_id=session.session_id)
+
+    end = connection_manager.traci_call(
+        lambda conn: session.vehicle_states.time(conn), "simulation time", session_id=session.session_id
+    )
+    wall = time.perf_counter() - wall_start
+    rate = steps / wall if wall > 0 else 0.0
+    lines = [
+        f"Ran {steps} steps (t={start:g} -> {end:g}) in {wall:.2f}s wall "
+        f"({rate:.0f} steps/s); stopped: {stop_reason}.",
+        aggregator.format(),
+    ]
+    controllers = session.controllers.describe()
+    if controllers:
+        lines.append("Controllers:")
+        lines.extend(f"- {line}" for line in controllers)
+    return "\n".join(lines)
+
+
+def add_controller(
+    name: str,
+    class_path: str,
+    every: int = 1,
+    options: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
+    timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+) -> str:
+    """Instantiate a controller class and attach it to a session's stepping loop."""
+    session = connection_manager.get_session(session_id)
+    connection_manager.traci_call(
+        lambda conn: session.controllers.add(conn, session, name, class_path, every, dict(options or {})),
+        "controller setup",
+        timeout_s=timeout_s,
+        session_id=session.session_id,
+    )
+    return f"Controller '{name}' ({class_path}) runs every {every} step(s) on session '{session.session_id}'."
+
+
+def remove_controller(
+    name: str, session_id: Optional[str] = None, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S
+) -> str:
+    session = connection_manager.get_session(session_id)
+    handle = connection_manager.traci_call(
+        lambda conn: session.controllers.remove(conn, session, name),
+        "controller close",
+        timeout_s=timeout_s,
+        session_id=session.session_id,
+    )
+    return f"Removed controller {handle.describe()}"
+
+
+def save_snapshot(name: str, session_id: Optional[str] = None, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> str:
+    """Save the current state of a session under `name` (see `utils.checkpoint`)."""
+    session = connection_manager.get_session(session_id)
+    state = connection_manager.traci_call(
+        lambda conn: session.states.snapshot(conn, name, conn.simulation.getTime(), session.steps),
+        "simulation.saveState",
+        timeout_s=timeout_s,
+        session_id=session.session_id,
+    )
+    return f"Saved snapshot {state.describe()}"
+
+
+def restore_snapshot(
+    name_or_path: str, session_id: Optional[str] = None, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S
+) -> str:
+    """Reload a session from one of its snapshots or from a state file."""
+    session = connection_manager.get_session(session_id)
+    path = session.states.resolve(name_or_path)
+    removed = connection_manager.traci_call(
+        lambda conn: session.load_state(conn, path), "load state", timeout_s=timeout_s, session_id=session.session_id
+    )
+    now = connection_manager.traci_call(
+        lambda conn: session.vehicle_states.time(conn), "simulation time", session_id=session.session_id
+    )
+    result = f"Session '{session.session_id}' restored to t={now:g} from {path}."
+    if removed:
+        result += f" Removed controllers (add them again to keep them running): {', '.join(removed)}."
+    return result
+
+
+def fork_session(
+    new_session_id: str,
+    snapshot: Optional[str] = None,
+    session_id: Optional[str] = None,
+    backend: Optional[str] = None,
+    timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+) -> str:
+    """
+    Open `new_session_id` as a copy of a session's state; the source keeps running unchanged.
+
+    Without `snapshot`, the current state is saved first as snapshot "fork-<new_session_id>".
+    """
+    source = connection_manager.get_session(session_id)
+    if source.sumo_args is None:
+        raise RuntimeError(f"Session '{source.session_id}' is attached to an external SUMO and cannot be forked.")
+    if snapshot is None:
+        snapshot = f"fork-{new_session_id}"
+        save_snapshot(snapshot, source.session_id, timeout_s=timeout_s)
+    path = source.states.resolve(snapshot)
+    sid = connection_manager.connect(
+        source.config_file, session_id=new_session_id, backend=backend, state_file=path, timeout_s=timeout_s
+    )
+    forked = connection_manager.get_session(sid)
+    note = f"; {forked.backend_note}" if forked.backend_note else ""
+    return f"Forked session '{sid}' from '{source.session_id}' at {path} (backend {forked.backend}{note})."
+
+
+def set_checkpointing(
+    every_s: Optional[float],
+    keep: int = DEFAULT_CHECKPOINT_KEEP,
+    session_id: Optional[str] = None,
+    timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+) -> str:
+    """Save a checkpoint every `every_s` simulated seconds while the session steps; None or 0 turns it off."""
+    session = connection_manager.get_session(session_id)
+    if not every_s:
+        session.states.disable_checkpoints()
+        return f"Checkpointing disabled on session '{session.session_id}'."
+
+    def _enable(conn: Any) -> None:
+        session.vehicle_states.ensure(conn, (), sim_variables=(tc.VAR_TIME,))
+        session.states.enable_checkpoints(float(every_s), int(keep), session.vehicle_states.time(conn))
+
+    connection_manager.traci_call(_enable, "enable checkpoints", timeout_s=timeout_s, session_id=session.session_id)
+    return (
+        f"Session '{session.session_id}' saves a checkpoint every {float(every_s):g}s of simulation time "
+        f"(keeping {int(keep)}) in {session.states.directory}."
+    )
@@ -1,52 +1,222 @@
-import traci
-from typing import List, Tuple
+import bisect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from utils.connection import connection_manager
+from utils.subscriptions import parse_state_variables
 
-def get_vehicles() -> List[str]:
+def _vehicle_variable(vehicle_id: str, variable: str, getter: Callable[[Any], Any], session_id: Optional[str]) -> Any:
+    """Read one vehicle variable through the step snapshot cache, preferring subscription results."""
+    session = connection_manager.get_session(session_id)
+
+    def _read(conn: Any) -> Any:
+        subscription = session.vehicle_states
+        if variable in subscription.variables:
+            row = subscription.read(conn, [variable], [vehicle_id]).get(vehicle_id)
+            if row is not None:
+                return row[variable]
+        return getter(conn)
+
+    return connection_manager.cached_call(
+        ("vehicle", vehicle_id, variable), _read, f"vehicle.{variable}", session_id=session.session_id
+    )
+
+def get_vehicles(session_id: Optional[str] = None) -> List[str]:
     """Get the list of all active vehicle IDs."""
-    if not connection_manager.is_connected():
+    if not connection_manager.is_connected(session_id):
         return []
-    return list(traci.vehicle.getIDList())
+    return list(connection_manager.cached_call(
+        ("vehicles",), lambda conn: tuple(conn.vehicle.getIDList()), "vehicle.getIDList", session_id=session_id
+    ))
 
-def get_vehicle_speed(vehicle_id: str) -> float:
+def get_vehicle_speed(vehicle_id: str, session_id: Optional[str] = None) -> float:
     """Get the speed of a specific vehicle (m/s)."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    return float(traci.vehicle.getSpeed(vehicle_id))
+    return float(_vehicle_variable(vehicle_id, "speed", lambda conn: conn.vehicle.getSpeed(vehicle_id), session_id))
 
-def get_vehicle_position(vehicle_id: str) -> Tuple[float, float]:
+def get_vehicle_position(vehicle_id: str, session_id: Optional[str] = None) -> Tuple[float, float]:
     """Get the (x, y) position of a specific vehicle."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    x, y = traci.vehicle.getPosition(vehicle_id)
+    x, y = _vehicle_variable(vehicle_id, "position", lambda conn: conn.vehicle.getPosition(vehicle_id), session_id)
     return float(x), float(y)
 
-def get_vehicle_acceleration(vehicle_id: str) -> float:
+def get_vehicle_acceleration(vehicle_id: str, session_id: Optional[str] = None) -> float:
     """Get the acceleration of a specific vehicle (m/s^2)."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    return float(traci.vehicle.getAcceleration(vehicle_id))
+    return float(_vehicle_variable(
+        vehicle_id, "acceleration", lambda conn: conn.vehicle.getAcceleration(vehicle_id), session_id
+    ))
 
-def get_vehicle_lane(vehicle_id: str) -> str:
+def get_vehicle_lane(vehicle_id: str, session_id: Optional[str] = None) -> str:
     """Get the lane ID of a specific vehicle."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    return str(traci.vehicle.getLaneID(vehicle_id))
+    return str(_vehicle_variable(vehicle_id, "lane", lambda conn: conn.vehicle.getLaneID(vehicle_id), session_id))
 
-def get_vehicle_route(vehicle_id: str) -> List[str]:
+def get_vehicle_route(vehicle_id: str, session_id: Optional[str] = None) -> List[str]:
     """Get the route (list of edge IDs) of a specific vehicle."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    return [str(edge) for edge in traci.vehicle.getRoute(vehicle_id)]
+    route = _vehicle_variable(vehicle_id, "route", lambda conn: tuple(conn.vehicle.getRoute(vehicle_id)), session_id)
+    return [str(edge) for edge in route]
+
 
-def get_simulation_info() -> dict[str, float | int]:
+def get_simulation_info(session_id: Optional[str] = None) -> dict[str, float | int]:
     """Get general simulation statistics."""
-    if not connection_manager.is_connected():
-        raise RuntimeError("Not connected to SUMO.")
-    return {
-        "time": float(traci.simulation.getTime()),
-        "loaded_vehicles": int(traci.simulation.getLoadedNumber()),
-        "departed_vehicles": int(traci.simulation.getDepartedNumber()),
-        "arrived_vehicles": int(traci.simulation.getArrivedNumber()),
-        "min_expected_vehicles": int(traci.simulation.getMinExpectedNumber()),
-    }
+    def _info(conn: Any) -> dict[str, float | int]:
+        return {
+            "time": float(conn.simulation.getTime()),
+            "loaded_vehicles": int(conn.simulation.getLoadedNumber()),
+            "departed_vehicles": int(conn.simulation.getDepartedNumber()),
+            "arrived_vehicles": int(conn.simulation.getArrivedNumber()),
+            "min_expected_vehicles": int(conn.simulation.getMinExpectedNumber()),
+        }
+    return dict(connection_manager.cached_call(("simulation",), _info, "simulation info", session_id=session_id))
+
+
+def get_vehicle_states(
+    variables: Optional[Iterable[str] | str] = None,
+    vehicle_ids: Optional[Iterable[str]] = None,
+    session_id: Optional[str] = None,
+) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    """
+    Get several variables of all (or the given) vehicles at once.
+
+    Served from subscriptions kept on the session across steps; returns (time, {id: {variable: value}}).
+    """
+    names = parse_state_variables(variables)
+    ids = None if vehicle_ids is None else list(vehicle_ids)
+    session = connection_manager.get_session(session_id)
+
+    def _read(conn: Any) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+        subscription = session.vehicle_states
+        subscription.ensure(conn, names)
+        return subscription.time(conn), subscription.read(conn, names, ids)
+
+    return connection_manager.traci_call(_read, "vehicle states", session_id=session.session_id)
+
+
+def format_vehicle_states(time: float, states: Dict[str, Dict[str, Any]], variables: List[str]) -> str:
+    """Render vehicle states as a header plus one comma-separated row per vehicle."""
+    def _cell(value: Any) -> str:
+        if isinstance(value, tuple):
+            return " ".join(f"{v:.2f}" for v in value)
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        return str(value)
+
+    lines = [f"Vehicle states at t={time:g} ({len(states)} vehicles):", ",".join(["id", *variables])]
+    lines.extend(",".join([vid, *(_cell(row[name]) for name in variables)]) for vid, row in states.items())
+    return "\n".join(lines)
+
+
+def get_vehicle_count(session_id: Optional[str] = None) -> int:
+    """Get the number of active vehicles."""
+    return int(connection_manager.cached_call(
+        ("vehicle_count",), lambda conn: conn.vehicle.getIDCount(), "vehicle.getIDCount", session_id=session_id
+    ))
+
+
+def get_vehicle_page(
+    limit: int, cursor: Optional[str] = None, session_id: Optional[str] = None
+) -> Tuple[List[str], int, Optional[str]]:
+    """
+    Get up to `limit` active vehicle IDs in sorted order after `cursor`.
+
+    Returns (ids, total, next_cursor); next_cursor is None on the last page. Vehicles that
+    depart between pages sort anywhere and may be skipped by a walk that is already past them.
+    """
+    if limit <= 0:
+        raise ValueError(f"limit must be > 0, got {limit}")
+    ids = connection_manager.cached_call(
+        ("vehicles_sorted",), lambda conn: tuple(sorted(conn.vehicle.getIDList())), "vehicle.getIDList",
+        session_id=session_id,
+    )
+    start = bisect.bisect_right(ids, cursor) if cursor else 0
+    page = list(ids[start:start + limit])
+    next_cursor = page[-1] if page and start + limit < len(ids) else None
+    return page, len(ids), next_cursor
+
+
+def get_vehicle_delta(session_id: Optional[str] = None) -> Tuple[float, float, List[str], List[str], bool]:
+    """
+    Get the vehicles that departed and arrived since this session's previous delta query.
+
+    The first query returns the current fleet as "departed" and starts tracking.
+    Returns (since, now, departed, arrived, baseline).
+    """
+    session = connection_manager.get_session(session_id)
+
+    def _delta(conn: Any) -> Tuple[float, float, List[str], List[str], bool]:
+        tracker = session.vehicle_delta
+        if not tracker.active:
+            departed = tracker.start(conn, session.vehicle_states)
+            return tracker.since, tracker.since, departed, [], True
+        now = session.vehicle_states.time(conn)
+        since, departed, arrived = tracker.drain(now)
+        return since, now, departed, arrived, False
+
+    return connection_manager.traci_call(_delta, "vehicle delta", session_id=session.session_id)
+
+
+# name -> (required args, optional args with defaults, call(conn, vehicle_id, args))
+VEHICLE_COMMANDS: Dict[str, Tuple[Tuple[str, ...], Dict[str, Any], Callable[[Any, str, Dict[str, Any]], None]]] = {
+    "set_speed": (("speed",), {}, lambda conn, vid, a: conn.vehicle.setSpeed(vid, float(a["speed"]))),
+    "change_target": (("edge",), {}, lambda conn, vid, a: conn.vehicle.changeTarget(vid, str(a["edge"]))),
+    "reroute": ((), {}, lambda conn, vid, a: conn.vehicle.rerouteTraveltime(vid)),
+    "change_lane": (
+        ("lane_index",),
+        {"duration": 5.0},
+        lambda conn, vid, a: conn.vehicle.changeLane(vid, int(a["lane_index"]), float(a["duration"])),
+    ),
+    "slow_down": (
+        ("speed",),
+        {"duration": 5.0},
+        lambda conn, vid, a: conn.vehicle.slowDown(vid, float(a["speed"]), float(a["duration"])),
+    ),
+}
+
+
+def _expand_command(index: int, command: Dict[str, Any]) -> List[Tuple[int, str, str, Dict[str, Any], Optional[str]]]:
+    """Validate one command dict; returns (index, vehicle_id, name, args, error) per targeted vehicle."""
+    name = str(command.get("command", command.get("action", "")))
+    ids = command.get("vehicle_ids", command.get("vehicle_id"))
+    if isinstance(ids, str):
+        ids = [ids]
+    if not ids:
+        return [(index, "?", name, {}, "vehicle_id or vehicle_ids required")]
+    spec = VEHICLE_COMMANDS.get(name)
+    if spec is None:
+        unknown = f"unknown command '{name}' (available: {', '.join(VEHICLE_COMMANDS)})"
+        return [(index, str(vid), name, {}, unknown) for vid in ids]
+    required, optional, _ = spec
+    missing = [arg for arg in required if command.get(arg) is None]
+    args = {**optional, **{k: v for k, v in command.items() if k in required or k in optional}}
+    error = f"missing {', '.join(missing)}" if missing else None
+    return [(index, str(vid), name, args, error) for vid in ids]
+
+
+def run_vehicle_commands(
+    commands: List[Dict[str, Any]], session_id: Optional[str] = None
+) -> List[Tuple[int, str, str, bool, str]]:
+    """
+    Apply a batch of vehicle commands in one pass on the session worker.
+
+    Each command is {'command': name, 'vehicle_id' | 'vehicle_ids': ..., **args} with names from
+    VEHICLE_COMMANDS. A failing command does not stop the batch.
+
+    Returns:
+        (command index, vehicle_id, command, ok, message) per targeted vehicle.
+    """
+    planned = [item for i, command in enumerate(commands) for item in _expand_command(i, command)]
+    session = connection_manager.get_session(session_id)
+
+    def _apply(conn: Any) -> List[Tuple[int, str, str, bool, str]]:
+        results: List[Tuple[int, str, str, bool, str]] = []
+        try:
+            for index, vid, name, args, error in planned:
+                if error is not None:
+                    results.append((index, vid, name, False, error))
+                    continue
+                try:
+                    VEHICLE_COMMANDS[name][2](conn, vid, args)
+                    results.append((index, vid, name, True, "ok"))
+                except Exception as e:
+                    results.append((index, vid, name, False, f"{type(e).__name__}: {e}"))
+        finally:
+            # Routes and targets change immediately; cached reads of this step are stale.
+            session.snapshot.invalidate(session.snapshot.time)
+        return results
+
+    return connection_manager.traci_call(_apply, "vehicle commands", session_id=session.session_id)
@@ -1,23 +1,44 @@
+import functools
+import inspect
 import logging
+import os
 import subprocess
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Literal, Optional, Sequence, Set, Tuple, TypeVar, Union, cast
 
+import anyio
 from mcp.server.fastmcp import FastMCP
+from mcp.server.lowlevel.server import request_ctx
 
-from utils.traci import ensure_traci_start_stdout_suppressed
-from mcp_tools.simulation import run_simple_simulation
+from utils.traci import DEFAULT_TRACI_BACKEND, ensure_traci_start_stdout_suppressed, libsumo_status
+from mcp_tools.simulation import (
+    add_controller, fork_session, remove_controller, restore_snapshot, run_simple_simulation, run_until,
+    save_snapshot, set_checkpointing
+)
 from mcp_tools.network import netconvert, netgenerate, osm_get
 from mcp_tools.route import random_trips, duarouter, od2trips
 from mcp_tools.signal import tls_cycle_adaptation, tls_coordinator
-from mcp_tools.analysis import analyze_fcd
+from mcp_tools.analysis import (
+    analyze_fcd, analyze_trip_kpis, compare_trip_kpis, fcd_compare, fcd_congestion, fcd_heatmap,
+    fcd_time_profile, fcd_trajectory, fcd_window, follow_analysis
+)
 from mcp_tools.vehicle import (
     get_vehicles, get_vehicle_speed, get_vehicle_position, 
     get_vehicle_acceleration, get_vehicle_lane, get_vehicle_route,
-    get_simulation_info
+    get_simulation_info, get_vehicle_states, format_vehicle_states,
+    get_vehicle_count, get_vehicle_page, get_vehicle_delta, run_vehicle_commands
 )
 from mcp_tools.rl import find_sumo_rl_scenario_files, list_rl_scenarios, run_rl_training
-from utils.connection import connection_manager
+from utils.cancellation import blocking_tool
+from utils.checkpoint import DEFAULT_CHECKPOINT_KEEP, latest_checkpoint
+from utils.connection import SimulationSession, client_scope, connection_manager, current_client
+from utils.fcd_cube import DEFAULT_BIN_SECONDS
+from utils.jobs import JOB_STATES, get_job_manager
+from utils.output import truncate_text
+from utils.singleflight import call_key, get_single_flight
+from utils.stepping import DEFAULT_INTERVAL_S, StopConditions
+from utils.subscriptions import parse_state_variables
 from utils.sumo import find_sumo_binary, find_sumo_home, find_sumo_tools_dir
+from utils.worker_pool import WORKER_PROCESSES, WorkerPoolError, get_worker_pool, start_worker_pool
 from workflows.sim_gen import sim_gen_workflow
 from workflows.signal_opt import signal_opt_workflow
 from workflows.rl_train import rl_train_workflow
@@ -29,11 +50,206 @@ logger = logging.getLogger(__name__)
 # Ensure TraCI never writes to stdout by default (MCP stdio safety).
 ensure_traci_start_stdout_suppressed()
 
+T = TypeVar("T")
+
+# Transport: "stdio" (one client, the default), or "streamable-http" / "sse" for one long-lived
+# server shared by many clients. HTTP listens on SUMO_MCP_HTTP_HOST:SUMO_MCP_HTTP_PORT/mcp.
+TRANSPORT = cast(Literal["stdio", "sse", "streamable-http"], os.environ.get("SUMO_MCP_TRANSPORT", "stdio"))
+HTTP_HOST = os.environ.get("SUMO_MCP_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.environ.get("SUMO_MCP_HTTP_PORT", "8000"))
+# HTTP only: close simulation sessions left unused this long (0 keeps them until disconnect).
+SESSION_IDLE_S = float(os.environ.get("SUMO_MCP_SESSION_IDLE_S", "1800"))
+
 # Initialize MCP Server (official SDK)
-server = FastMCP("SUMO-MCP-Server")
+server = FastMCP("SUMO-MCP-Server", host=HTTP_HOST, port=HTTP_PORT)
+
+
+def _client_id() -> Optional[str]:
+    """MCP session id of the HTTP client behind the current request; None for stdio."""
+    try:
+        request = request_ctx.get().request
+    except LookupError:
+        return None
+    if request is None:
+        return None
+    client: Optional[str] = request.headers.get("mcp-session-id") or request.query_params.get("session_id")
+    return client
+
+
+def client_scoped(func: Callable[..., T]) -> Callable[..., T]:
+    """Run a tool body with simulation session ids resolved for the calling client."""
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with client_scope(_client_id()):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+# Tool bodies block (SUMO subprocesses, TraCI, file analysis), so each call runs in a worker
+# thread and the event loop keeps answering other requests; a cancelled request kills its
+# subprocesses and drops its queued TraCI calls (see utils.cancellation). Tools that can run
+# for minutes share a bounded pool so they cannot take every thread from quick queries.
+HEAVY_TOOL_THREADS = int(os.environ.get("SUMO_MCP_HEAVY_TOOL_THREADS", "4"))
+_heavy_runner = blocking_tool(anyio.CapacityLimiter(HEAVY_TOOL_THREADS))
+_quick_runner = blocking_tool()
+
+
+def heavy_tool(func: Callable[..., T]) -> Callable[..., Any]:
+    return _heavy_runner(client_scoped(func))
+
+
+def quick_tool(func: Callable[..., T]) -> Callable[..., Any]:
+    return _quick_runner(client_scoped(func))
+
+
+# With SUMO_MCP_WORKER_PROCESSES > 0, tool bodies run in worker processes (see utils.worker_pool).
+# A route function maps the call arguments to (route, session id), or None to stay in this process.
+Route = Optional[Tuple[str, Optional[str]]]
+
+
+def _route_any(args: Dict[str, Any]) -> Route:
+    return "any", None
+
+
+def _route_foreground(args: Dict[str, Any]) -> Route:
+    # background=true only queues a job here; the job itself goes through the pool.
+    return None if (args.get("params") or {}).get("background") else ("any", None)
+
+
+def _route_session(args: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    session_id = (args.get("params") or {}).get("session_id")
+    return "session", str(session_id) if session_id else None
+
+
+def _route_control(args: Dict[str, Any]) -> Route:
+    route, session_id = _route_session(args)
+    action = args.get("action")
+    if action == "connect":
+        return "open", session_id
+    if _about_all_sessions(action, session_id):
+        # Merged here from every worker's report (see _on_every_worker).
+        return None
+    return route, session_id
+
+
+def _about_all_sessions(action: Any, session_id: Optional[str]) -> bool:
+    return (
+        action == "list"
+        or (action == "stats" and session_id in (None, "all"))
+        or (action == "disconnect" and session_id == "all")
+    )
+
+
+def _on_every_worker(func: Callable[..., T], *args: Any) -> List[T]:
+    """`func(*args)` in every worker process of the pool, or in this process when none runs."""
+    pool = get_worker_pool()
+    if pool is None:
+        return [func(*args)]
+    result: List[T] = pool.call((func.__module__, func.__name__), args, route="all")
+    return result
+
+
+def _session_report(action: str, timeout_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """This process's part of a `control_simulation` call about all sessions of the client."""
+    sessions = connection_manager.list_sessions()
+    report: Dict[str, Any] = {"in_use": len(connection_manager.list_sessions(all_clients=True))}
+    if action == "disconnect":
+        connection_manager.disconnect_all(**timeout_kwargs)
+    elif action == "list":
+        report["describe"] = [s.describe() for s in sessions]
+    elif action == "stats":
+        report["stats"] = [_session_stats(s) for s in sessions]
+    return report
+
+
+def _session_stats(session: SimulationSession) -> Dict[str, Any]:
+    return {"session_id": session.session_id, "worker": session.worker.snapshot(), "cache": session.snapshot.describe()}
+
+
+def _format_session_stats(entry: Dict[str, Any]) -> List[str]:
+    st = entry["worker"]
+    return [
+        f"- {entry['session_id']}: queue {st['depth']} (max {st['max_depth']}), "
+        f"running {st['running'] or '-'}, {st['completed']} ok / {st['failed']} failed, "
+        f"{st['timeouts']} timeouts, {st['cancelled']} cancelled; "
+        f"wait {st['wait_mean_ms']:.2f} ms mean / {st['wait_max_ms']:.2f} max, "
+        f"run {st['run_mean_ms']:.2f} ms mean / {st['run_max_ms']:.2f} max",
+        f"  snapshot cache: {entry['cache']}",
+    ]
+
+
+def _route_analysis(args: Dict[str, Any]) -> Route:
+    # follow/tail keep a per-file read offset in the process that parses it, so they stay here;
+    # other actions go to one worker per file, which then holds that file's offset index.
+    if args.get("action") in ("follow", "tail"):
+        return None
+    return "pinned", os.path.realpath(str(args.get("fcd_file")))
+
+
+_offloaded_bodies: Set[Callable[..., Any]] = set()
+
+
+def offloaded(route: Callable[[Dict[str, Any]], Route]) -> Callable[[Callable[..., T]], Callable[..., Any]]:
+    """Send the tool body to the worker pool, when one runs, on the worker `route` picks."""
+
+    def decorator(func: Callable[..., T]) -> Callable[..., Any]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            pool = get_worker_pool()
+            decision = route(signature.bind(*args, **kwargs).arguments) if pool is not None else None
+            if pool is None or decision is None:
+                return func(*args, **kwargs)
+            try:
+                return pool.call((func.__module__, func.__name__), args, kwargs, *decision)
+            except WorkerPoolError as e:
+                return f"Error: {e}"
+
+        _offloaded_bodies.add(wrapper)
+        return wrapper
+
+    return decorator
+
+
+def coalesced(
+    tool: str, inputs: Sequence[str] = (), skip: Optional[Callable[[Dict[str, Any]], bool]] = None
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Share one execution among identical concurrent calls of `tool` (see utils.singleflight).
+
+    `inputs` names the arguments read as files ("net_file", "params.osm_file").
+    """
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if skip is not None and skip(bound.arguments):
+                return func(*args, **kwargs)
+            return get_single_flight().run(
+                tool, call_key(tool, bound.arguments, inputs), functools.partial(func, *args, **kwargs)
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def _stateful_analysis(args: Dict[str, Any]) -> bool:
+    # follow/tail advance a per-file read offset, so every call must run.
+    return args.get("action") in ("follow", "tail")
+
 
 # --- 1. Network Management ---
 @server.tool(description="Manage SUMO network (generate, convert, or download OSM).")
+@heavy_tool
+@coalesced("manage_network", inputs=("params.osm_file",))
+@offloaded(_route_any)
 def manage_network(action: str, output_file: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     actions:
@@ -143,6 +359,9 @@ def manage_network(action: str, output_file: str, params: Optional[Dict[str, Any
 
 # --- 2. Demand Management ---
 @server.tool(description="Manage traffic demand (random trips, OD matrix, routing).")
+@heavy_tool
+@coalesced("manage_demand", inputs=("net_file", "params.od_file", "params.route_files"))
+@offloaded(_route_any)
 def manage_demand(action: str, net_file: str, output_file: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     actions:
@@ -180,13 +399,46 @@ def manage_demand(action: str, net_file: str, output_file: str, params: Optional
     return f"Unknown action: {action}"
 
 # --- 3. Simulation Control ---
-@server.tool(description="Control SUMO simulation (connect, step, disconnect).")
+@server.tool(description="Control SUMO simulation sessions (connect, step, disconnect, list).")
+@quick_tool
+@offloaded(_route_control)
 def control_simulation(action: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     actions:
-    - connect: params={'config_file': str, 'gui': bool}
-    - step: params={'step': float}
-    - disconnect: no params
+    - connect: params={'config_file': str, 'gui': bool, 'port': int, 'host': str, 'session_id': str,
+                       'backend': 'traci'|'libsumo', 'state_file': str, 'resume_from': str}
+      state_file starts from a saved state; resume_from=<session id> starts from that session's
+      newest checkpoint (e.g. after it timed out). Both need config_file.
+    - step: params={'step': float, 'session_id': str}
+    - run_until: params={'until_time': float, 'steps': int, 'no_vehicles': bool, 'vehicles_at_least': int,
+                         'vehicles_at_most': int, 'max_wall_s': float, 'interval_s': float, 'session_id': str}
+      Advances server-side until the first condition holds; returns per-interval statistics.
+    - disconnect: params={'session_id': str ('all' closes every session)}
+    - list: no params
+    - vehicle_commands: params={'commands': [{'command': 'set_speed'|'change_target'|'reroute'|
+                                'change_lane'|'slow_down', 'vehicle_id' | 'vehicle_ids': ..., **args}],
+                                'session_id': str}
+      args: set_speed {speed}, change_target {edge}, reroute {}, change_lane {lane_index, duration=5},
+      slow_down {speed, duration=5}. The batch runs in one worker pass with per-command results.
+    - controller_add: params={'name': str, 'class_path': 'module:Class' | '/path/file.py:Class',
+                              'every': int, 'options': dict, 'session_id': str}
+      Runs controller.step(ctx) every N steps inside step/run_until on the server. Built-in:
+      'utils.controllers:QTableSignalController' with options={'q_table_file': <run_rl_training q_tables.json>}.
+    - controller_remove: params={'name': str, 'session_id': str}
+    - controllers: params={'session_id': str} lists controllers with per-controller timing
+    - snapshot: params={'name': str, 'session_id': str} saves the simulation state (simulation.saveState)
+    - restore: params={'name': snapshot name | state file path, 'session_id': str} reloads that state
+    - fork: params={'new_session_id': str, 'name': snapshot (default: current state), 'backend': str,
+                    'session_id': str} opens a new session from a state of this one
+    - checkpoint: params={'every_s': float (0 disables), 'keep': int, 'session_id': str}
+      periodic state checkpoints in simulation time, for resume_from
+    - states: params={'session_id': str} lists snapshots and checkpoints
+    - stats: params={'session_id': str (optional; all sessions when omitted)}
+      TraCI worker queue/latency and per-step snapshot cache hit/miss counters.
+    - cancel: params={'session_id': str} cancels requests still queued on the session
+
+    Several sessions can be open at once (up to SUMO_MCP_MAX_SESSIONS). Without
+    session_id, calls use the "default" session, or the only open one.
     """
     params = params or {}
     
@@ -198,32 +450,146 @@ def control_simulation(action: str, params: Optional[Dict[str, Any]] = None) ->
                 timeout_s = float(timeout_s_raw)
             except (TypeError, ValueError):
                 return f"Error: timeout_s must be a number, got {timeout_s_raw!r}"
+        timeout_kwargs = {} if timeout_s is None else {"timeout_s": timeout_s}
+        session_id = params.get("session_id")
+        session_id = str(session_id) if session_id else None
 
         if action == "connect":
             config_file = params.get("config_file")
             gui = params.get("gui", False)
-            port = params.get("port", 8813)
+            port = params.get("port")
             host = params.get("host", "localhost")
-            if timeout_s is None:
-                connection_manager.connect(config_file, gui, port, host)
-            else:
-                connection_manager.connect(config_file, gui, port, host, timeout_s=timeout_s)
-            return "Successfully connected to SUMO."
+            state_file = params.get("state_file")
+            resume_from = params.get("resume_from")
+            if resume_from and not state_file:
+                state_file = latest_checkpoint(str(resume_from), current_client())
+                if state_file is None:
+                    return f"Error: No checkpoint found for session '{resume_from}'"
+            sid = connection_manager.connect(
+                config_file, gui, int(port) if port is not None else None, host, session_id=session_id,
+                backend=params.get("backend"), state_file=state_file, **timeout_kwargs,
+            )
+            session = connection_manager.get_session(sid)
+            note = f"; {session.backend_note}" if session.backend_note else ""
+            origin = f" from state {state_file}" if state_file else ""
+            return f"Successfully connected to SUMO (session '{sid}', backend {session.backend}{note}){origin}."
             
         elif action == "step":
             step = params.get("step", 0)
-            if timeout_s is None:
-                connection_manager.simulation_step(step)
-            else:
-                connection_manager.simulation_step(step, timeout_s=timeout_s)
+            connection_manager.simulation_step(step, session_id=session_id, **timeout_kwargs)
             return "Simulation advanced."
+
+        elif action == "run_until":
+            conditions = StopConditions.from_params(params)
+            interval_s = float(params.get("interval_s", DEFAULT_INTERVAL_S))
+            return run_until(conditions, interval_s, session_id=session_id, **timeout_kwargs)
             
         elif action == "disconnect":
-            if timeout_s is None:
-                connection_manager.disconnect()
-            else:
-                connection_manager.disconnect(timeout_s=timeout_s)
+            if session_id == "all":
+                _on_every_worker(_session_report, action, timeout_kwargs)
+                return "Successfully disconnected all sessions from SUMO."
+            connection_manager.disconnect(session_id=session_id, **timeout_kwargs)
             return "Successfully disconnected from SUMO."
+
+        elif action == "list":
+            reports = _on_every_worker(_session_report, action, timeout_kwargs)
+            described = [line for r in reports for line in r["describe"]]
+            if not described:
+                return f"No open sessions (max {connection_manager.max_sessions})."
+            in_use = sum(r["in_use"] for r in reports)
+            lines = [f"Open sessions ({len(described)} yours, {in_use}/{connection_manager.max_sessions} in use):"]
+            lines.extend(f"- {line}" for line in described)
+            return "\n".join(lines)
+
+        elif action == "vehicle_commands":
+            commands = params.get("commands")
+            if isinstance(commands, dict):
+                commands = [commands]
+            if not isinstance(commands, list) or not commands:
+                return "Error: commands must be a non-empty list of command objects"
+            results = run_vehicle_commands(commands, session_id)
+            failed = [r for r in results if not r[3]]
+            lines = [f"Vehicle commands: {len(results) - len(failed)} ok, {len(failed)} failed."]
+            # Large batches list the failures only.
+            shown = results if len(results) <= 200 else failed
+            lines.extend(f"[{i}] {name} {vid}: {message}" for i, vid, name, _, message in shown)
+            return "\n".join(lines)
+
+        elif action == "controller_add":
+            name = params.get("name")
+            class_path = params.get("class_path", params.get("controller"))
+            if not name or not class_path:
+                return "Error: name and class_path required"
+            options = params.get("options") or {}
+            if not isinstance(options, dict):
+                return "Error: options must be an object"
+            return add_controller(
+                str(name), str(class_path), int(params.get("every", 1)), options, session_id, **timeout_kwargs
+            )
+
+        elif action == "controller_remove":
+            name = params.get("name")
+            if not name:
+                return "Error: name required"
+            return remove_controller(str(name), session_id, **timeout_kwargs)
+
+        elif action == "controllers":
+            session = connection_manager.get_session(session_id)
+            lines = session.controllers.describe()
+            if not lines:
+                return f"No controllers on session '{session.session_id}'."
+            return "\n".join([f"Controllers on session '{session.session_id}':", *(f"- {line}" for line in lines)])
+
+        elif action == "snapshot":
+            name = params.get("name")
+            if not name:
+                return "Error: name required"
+            return save_snapshot(str(name), session_id, **timeout_kwargs)
+
+        elif action == "restore":
+            name = params.get("name", params.get("state_file"))
+            if not name:
+                return "Error: name (snapshot name or state file path) required"
+            return restore_snapshot(str(name), session_id, **timeout_kwargs)
+
+        elif action == "fork":
+            new_session_id = params.get("new_session_id")
+            if not new_session_id:
+                return "Error: new_session_id required"
+            name = params.get("name", params.get("state_file"))
+            return fork_session(
+                str(new_session_id), str(name) if name else None, session_id, params.get("backend"), **timeout_kwargs
+            )
+
+        elif action == "checkpoint":
+            every_s = params.get("every_s")
+            keep = int(params.get("keep", DEFAULT_CHECKPOINT_KEEP))
+            return set_checkpointing(float(every_s) if every_s else None, keep, session_id, **timeout_kwargs)
+
+        elif action == "states":
+            session = connection_manager.get_session(session_id)
+            lines = session.states.describe()
+            if not lines:
+                return f"No saved states on session '{session.session_id}'."
+            return "\n".join([f"Saved states of session '{session.session_id}':", *(f"- {line}" for line in lines)])
+
+        elif action == "stats":
+            if _about_all_sessions(action, session_id):
+                reports = _on_every_worker(_session_report, action, timeout_kwargs)
+                entries = [entry for r in reports for entry in r["stats"]]
+            else:
+                entries = [_session_stats(connection_manager.get_session(session_id))]
+            if not entries:
+                return "No open sessions."
+            lines = ["TraCI worker stats:"]
+            for entry in entries:
+                lines.extend(_format_session_stats(entry))
+            return "\n".join(lines)
+
+        elif action == "cancel":
+            session = connection_manager.get_session(session_id)
+            cancelled = session.cancel_pending()
+            return f"Cancelled {cancelled} queued request(s) on session '{session.session_id}'."
             
     except Exception as e:
         return f"Error in control_simulation ({action}): {type(e).__name__}: {e}"
@@ -232,35 +598,79 @@ def control_simulation(action: str, params: Optional[Dict[str, Any]] = None) ->
 
 # --- 4. Query State ---
 @server.tool(description="Query simulation state (vehicles, speed, position). Requires active connection.")
+@quick_tool
+@offloaded(_route_session)
 def query_simulation_state(target: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     targets:
-    - vehicle_list: no params
+    - vehicle_list: params={'mode': 'full'|'count'|'page'|'delta', 'limit': int, 'cursor': str}
+      full (default) lists every id; count returns the number only; page returns `limit`
+      (default 1000) sorted ids after `cursor` plus the next cursor; delta returns the ids
+      departed/arrived since the session's previous delta query (the first one is the baseline).
     - vehicle_variable: params={'vehicle_id': str, 'variable': 'speed'|'position'|'lane'|'acceleration'|'route'}
+    - simulation: no params
+    - vehicle_states: params={'variables': list[str] | str, 'vehicle_ids': list[str] | str}
+      Several variables of all (or the listed) vehicles in one call, from subscriptions
+      kept across steps. variables: speed, position, lane, acceleration, route_index (default),
+      edge, angle.
+
+    All targets accept params={'session_id': str} to pick a simulation session.
     """
     params = params or {}
+    session_id = params.get("session_id")
+    session_id = str(session_id) if session_id else None
     
     try:
         if target == "vehicle_list" or target == "vehicles":
-            vehs = get_vehicles()
-            return f"Active vehicles: {vehs}"
+            mode = str(params.get("mode") or ("page" if "limit" in params or "cursor" in params else "full"))
+            if mode == "full":
+                vehs = get_vehicles(session_id)
+                return f"Active vehicles: {vehs}"
+            if mode == "count":
+                return f"Active vehicle count: {get_vehicle_count(session_id)}"
+            if mode == "page":
+                limit = int(params.get("limit", 1000))
+                cursor = params.get("cursor")
+                page, total, next_cursor = get_vehicle_page(limit, str(cursor) if cursor else None, session_id)
+                return "\n".join([
+                    f"Active vehicles ({len(page)} of {total}): {page}",
+                    f"next_cursor: {next_cursor}" if next_cursor is not None else "next_cursor: none (last page)",
+                ])
+            if mode == "delta":
+                since, now, departed, arrived, baseline = get_vehicle_delta(session_id)
+                if baseline:
+                    return f"Delta baseline at t={now:g} ({len(departed)} active): {departed}"
+                return "\n".join([
+                    f"Delta t={since:g} -> {now:g}: +{len(departed)} departed, -{len(arrived)} arrived",
+                    f"Departed: {departed}",
+                    f"Arrived: {arrived}",
+                ])
+            return f"Error: Unknown vehicle_list mode '{mode}'. Available: full, count, page, delta"
             
         elif target == "vehicle_variable":
             v_id = params.get("vehicle_id")
             var = params.get("variable")
             if not v_id or not var: return "Error: vehicle_id and variable required"
             
-            if var == "speed": return f"Speed: {get_vehicle_speed(v_id)}"
-            if var == "position": return f"Position: {get_vehicle_position(v_id)}"
-            if var == "acceleration": return f"Acceleration: {get_vehicle_acceleration(v_id)}"
-            if var == "lane": return f"Lane: {get_vehicle_lane(v_id)}"
-            if var == "route": return f"Route: {get_vehicle_route(v_id)}"
+            if var == "speed": return f"Speed: {get_vehicle_speed(v_id, session_id)}"
+            if var == "position": return f"Position: {get_vehicle_position(v_id, session_id)}"
+            if var == "acceleration": return f"Acceleration: {get_vehicle_acceleration(v_id, session_id)}"
+            if var == "lane": return f"Lane: {get_vehicle_lane(v_id, session_id)}"
+            if var == "route": return f"Route: {get_vehicle_route(v_id, session_id)}"
             
             return f"Unknown variable: {var}"
         
         elif target == "simulation":
-            info = get_simulation_info()
+            info = get_simulation_info(session_id)
             return f"Simulation Info: {info}"
+
+        elif target == "vehicle_states":
+            variables = parse_state_variables(params.get("variables"))
+            vehicle_ids = params.get("vehicle_ids")
+            if isinstance(vehicle_ids, str):
+                vehicle_ids = [v.strip() for v in vehicle_ids.split(",") if v.strip()]
+            t, states = get_vehicle_states(variables, vehicle_ids, session_id)
+            return format_vehicle_states(t, states, variables)
             
     except Exception as e:
         return f"Error querying state: {type(e).__name__}: {e}"
@@ -269,6 +679,9 @@ def query_simulation_state(target: str, params: Optional[Dict[str, Any]] = None)
 
 # --- 5. Optimize Signals ---
 @server.tool(description="Optimize traffic signals.")
+@heavy_tool
+@coalesced("optimize_traffic_signals", inputs=("net_file", "route_file"))
+@offloaded(_route_any)
 def optimize_traffic_signals(method: str, net_file: str, route_file: str, output_file: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     methods:
@@ -294,6 +707,10 @@ def optimize_traffic_signals(method: str, net_file: str, route_file: str, output
   - grid_number (int): Grid size NxN. Default=3. Aliases: grid_size, size
   - sim_seconds (int): Simulation duration in seconds. Default=100. Aliases: steps, duration, end_time
   - output_dir (str): Output directory. Default="output"
+  - output_format (str): FCD format xml|xml.gz|csv|csv.gz|parquet. Default="xml". Aliases: fcd_format
+  - output_profile (str): full|sampled|aggregate. Default="full". Aliases: profile
+    sampled: fcd_period (s, default 10), fcd_edges (list), fcd_vehicles (list), fcd_probability (0-1)
+    aggregate: no FCD; edgeData (aggregation_period s, default 300), summary and tripinfo outputs
   Example: run_workflow("sim_gen_eval", {"grid_number": 3, "sim_seconds": 1000})
 
 **signal_opt** - Optimize traffic signals for existing network.
@@ -303,6 +720,12 @@ def optimize_traffic_signals(method: str, net_file: str, route_file: str, output
   - sim_seconds (int): Simulation duration. Default=3600. Aliases: steps, duration
   - use_coordinator (bool): Use tlsCoordinator instead of tlsCycleAdaptation. Default=false
   - output_dir (str): Output directory. Default="output"
+  - output_format (str): FCD format xml|xml.gz|csv|csv.gz|parquet. Default="xml". Aliases: fcd_format
+  - output_profile (str): full|sampled|aggregate. Default="full". Aliases: profile
+    sampled: fcd_period (s, default 10), fcd_edges (list), fcd_vehicles (list), fcd_probability (0-1)
+    aggregate: no FCD; edgeData (aggregation_period s, default 300), summary and tripinfo outputs
+  - use_kpi (bool): Compare runs on tripinfo/summary KPIs (travel time, waiting time, time loss,
+    throughput, teleports) with bootstrap CIs. Default=true. Aliases: kpi
 
 **rl_train** - Train RL agent for traffic signal control.
   params:
@@ -310,13 +733,24 @@ def optimize_traffic_signals(method: str, net_file: str, route_file: str, output
   - episodes (int): Number of training episodes. Default=5. Aliases: num_episodes
   - steps (int): Steps per episode. Default=1000. Aliases: steps_per_episode
   - output_dir (str): Output directory. Default="output"
+
+Any workflow accepts background=true: it is queued as a job and the job id is returned at once
+(see manage_jobs).
 """
 )
+@heavy_tool
+@offloaded(_route_foreground)
 def run_workflow(workflow_name: str, params: Dict[str, Any]) -> str:
     """Execute a high-level workflow."""
+    if params.get("background"):
+        return _submit_background(
+            "run_workflow",
+            {"workflow_name": workflow_name, "params": _foreground(params)},
+            "rl_training" if workflow_name == "rl_train" else None,
+        )
 
     # Helper to get param with aliases
-    def get_param(keys: list, default=None):
+    def get_param(keys: List[str], default: Any = None) -> Any:
         for k in keys:
             if k in params:
                 return params[k]
@@ -326,8 +760,12 @@ def run_workflow(workflow_name: str, params: Dict[str, Any]) -> str:
         grid_number = get_param(["grid_number", "grid_size", "size"], 3)
         sim_seconds = get_param(["sim_seconds", "steps", "duration", "end_time"], 100)
         output_dir = get_param(["output_dir"], "output")
+        output_format = get_param(["output_format", "fcd_format"], "xml")
+        output_profile = get_param(["output_profile", "profile"], "full")
 
-        return sim_gen_workflow(output_dir, int(grid_number), int(sim_seconds))
+        return sim_gen_workflow(
+            output_dir, int(grid_number), int(sim_seconds), str(output_format), str(output_profile), params
+        )
 
     elif workflow_name in ("signal_opt", "signal_opt_workflow"):
         net_file = get_param(["net_file"], "")
@@ -338,9 +776,22 @@ def run_workflow(workflow_name: str, params: Dict[str, Any]) -> str:
 
         sim_seconds = get_param(["sim_seconds", "steps", "duration"], 3600)
         use_coordinator = get_param(["use_coordinator"], False)
+        use_kpi = get_param(["use_kpi", "kpi"], True)
         output_dir = get_param(["output_dir"], "output")
+        output_format = get_param(["output_format", "fcd_format"], "xml")
+        output_profile = get_param(["output_profile", "profile"], "full")
 
-        return signal_opt_workflow(net_file, route_file, output_dir, int(sim_seconds), bool(use_coordinator))
+        return signal_opt_workflow(
+            net_file,
+            route_file,
+            output_dir,
+            int(sim_seconds),
+            bool(use_coordinator),
+            str(output_format),
+            str(output_profile),
+            params,
+            bool(use_kpi),
+        )
 
     elif workflow_name == "rl_train":
         scenario_name = get_param(["scenario_name", "scenario"], "")
@@ -354,13 +805,18 @@ def run_workflow(workflow_name: str, params: Dict[str, Any]) -> str:
 
 # --- 7. RL Task Management ---
 @server.tool(description="Manage RL tasks (list scenarios, custom training).")
+@heavy_tool
+@offloaded(_route_foreground)
 def manage_rl_task(action: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     actions:
     - list_scenarios: no params
-    - train_custom: params={'net_file', 'route_file', 'out_dir', 'episodes', 'steps', 'algorithm', 'reward_type'}
+    - train_custom: params={'net_file', 'route_file', 'out_dir', 'episodes', 'steps', 'algorithm', 'reward_type',
+                            'background': bool (queue as a job, see manage_jobs)}
     """
     params = params or {}
+    if action == "train_custom" and params.get("background"):
+        return _submit_background("manage_rl_task", {"action": action, "params": _foreground(params)}, "rl_training")
     
     if action == "list_scenarios":
         return str(list_rl_scenarios())
@@ -418,8 +874,10 @@ def manage_rl_task(action: str, params: Optional[Dict[str, Any]] = None) -> str:
 
 # --- Legacy/Misc ---
 @server.tool(name="get_sumo_info", description="Get the version and path of the installed SUMO.")
+@quick_tool
 def get_sumo_info() -> str:
     try:
+        pool = get_worker_pool()
         sumo_binary = find_sumo_binary("sumo")
         if not sumo_binary:
             return (
@@ -444,34 +902,303 @@ def get_sumo_info() -> str:
                 f"SUMO Version: {version_output}",
                 f"SUMO_HOME: {sumo_home or 'Not Set'}",
                 f"SUMO Tools Dir: {tools_dir or 'Not Found'}",
+                f"TraCI Backend (default): {DEFAULT_TRACI_BACKEND}",
+                f"libsumo: {libsumo_status()}",
             ]
+            + [f"Session {s.session_id}: backend {s.backend}" for s in connection_manager.list_sessions()]
+            + (pool.describe() if pool is not None else [])
+            + [f"Coalescing {line}" for line in get_single_flight().describe()]
         )
     except Exception as e:
         return f"Error checking SUMO: {str(e)}"
 
-@server.tool(name="run_simple_simulation", description="Run a SUMO simulation using a config file.")
-def run_simple_simulation_tool(config_path: str, steps: int = 100) -> str:
-    return run_simple_simulation(config_path, steps)
+@server.tool(
+    name="run_simple_simulation",
+    description="Run a SUMO simulation using a config file. Collects online KPIs via TraCI subscriptions "
+    "(kpis: speed, halting, edges, arrivals; default all, empty to disable) without writing output files. "
+    "backend='libsumo' runs SUMO in-process (falls back to 'traci' when unavailable). "
+    "Stops after `steps`, at `until_time`, when no vehicles are left (stop_when_empty) or after max_wall_s.",
+)
+@heavy_tool
+@coalesced("run_simple_simulation", inputs=("config_path",))
+@offloaded(_route_any)
+def run_simple_simulation_tool(
+    config_path: str,
+    steps: int = 100,
+    kpis: Optional[Union[str, List[str]]] = None,
+    backend: Optional[str] = None,
+    until_time: Optional[float] = None,
+    stop_when_empty: bool = True,
+    max_wall_s: Optional[float] = None,
+) -> str:
+    return run_simple_simulation(
+        config_path,
+        steps,
+        kpis,
+        backend=backend,
+        until_time=until_time,
+        stop_when_empty=stop_when_empty,
+        max_wall_s=max_wall_s,
+    )
+
+@server.tool(
+    description="Analyze FCD output (statistics, trajectories, time windows, congestion cube queries) "
+    "or trip KPIs from tripinfo/summary output."
+)
+@heavy_tool
+@coalesced(
+    "run_analysis",
+    inputs=(
+        "fcd_file",
+        "params.net_file",
+        "params.optimized_fcd",
+        "params.other_fcd",
+        "params.summary_file",
+        "params.optimized_tripinfo",
+        "params.optimized_summary",
+    ),
+    skip=_stateful_analysis,
+)
+@offloaded(_route_analysis)
+def run_analysis(fcd_file: str, action: str = "summary", params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    actions:
+    - summary: params={'use_store': bool (default True), 'workers': int}
+    - trajectory: params={'vehicle_id': str, 'limit': int (default 500)}
+    - window: params={'t0': float, 't1': float, 'limit': int (default 200)}
+    - congestion: params={'top_k': int, 'bin_seconds': float, 't0': float, 't1': float,
+                          'metric': 'speed'|'vehicle_seconds'|'density', 'min_vehicle_seconds': float,
+                          'net_file': str (needed for density), 'include_internal': bool}
+    - time_profile: params={'bin_seconds': float, 'edge_id': str}
+    - compare: fcd_file is the baseline. params={'optimized_fcd': str, 'bin_seconds': float, 'top_k': int}
+    - heatmap: params={'cell_size': float (m, default 100), 'top_k': int, 't0': float, 't1': float}
+    - kpi: fcd_file is a tripinfo output. params={'summary_file': str, 'optimized_tripinfo': str,
+                                                  'optimized_summary': str, 'n_resamples': int (default 1000)}
+      With optimized_tripinfo, compares both runs per vehicle (fcd_file is the baseline).
+    - follow (alias tail): incremental stats of an FCD or edgeData file a running simulation is still writing;
+      each call parses only newly appended bytes. params={'kind': 'fcd'|'edgedata' (auto), 'reset': bool,
+      'top_k': int, 'min_vehicle_seconds': float}
+
+    `workers` (all actions) sets the number of parse processes for large files; 1 forces serial.
+    trajectory/window seek through a sidecar byte-offset index built next to the FCD file on first use.
+    congestion/time_profile/compare use an edge x time cube cached next to the FCD file.
+    """
+    params = params or {}
+
+    def _number(name: str, default: Any, cast: Any) -> Any:
+        raw = params.get(name, default)
+        if raw is None:
+            return None
+        try:
+            return cast(raw)
+        except (TypeError, ValueError):
+            raise ValueError(f"Error: {name} must be a number, got {raw!r}")
+
+    try:
+        workers = _number("workers", None, int)
+
+        if action == "summary":
+            return analyze_fcd(fcd_file, use_store=bool(params.get("use_store", True)), workers=workers)
+
+        elif action == "trajectory":
+            vehicle_id = params.get("vehicle_id")
+            if not vehicle_id:
+                return "Error: vehicle_id required for trajectory action"
+            return fcd_trajectory(fcd_file, str(vehicle_id), limit=_number("limit", 500, int), workers=workers)
+
+        elif action == "window":
+            t0 = _number("t0", params.get("begin"), float)
+            t1 = _number("t1", params.get("end"), float)
+            if t0 is None or t1 is None:
+                return "Error: t0 and t1 required for window action"
+            return fcd_window(fcd_file, t0, t1, limit=_number("limit", 200, int), workers=workers)
+
+        elif action == "congestion" or action == "top_congested":
+            return fcd_congestion(
+                fcd_file,
+                top_k=_number("top_k", 10, int),
+                bin_seconds=_number("bin_seconds", DEFAULT_BIN_SECONDS, float),
+                t0=_number("t0", None, float),
+                t1=_number("t1", None, float),
+                metric=str(params.get("metric", "speed")),
+                min_vehicle_seconds=_number("min_vehicle_seconds", 60.0, float),
+                net_file=params.get("net_file"),
+                include_internal=bool(params.get("include_internal", False)),
+                workers=workers,
+            )
+
+        elif action == "time_profile":
+            edge_id = params.get("edge_id")
+            return fcd_time_profile(
+                fcd_file,
+                bin_seconds=_number("bin_seconds", DEFAULT_BIN_SECONDS, float),
+                edge_id=str(edge_id) if edge_id else None,
+                workers=workers,
+            )
+
+        elif action == "compare":
+            optimized_fcd = params.get("optimized_fcd") or params.get("other_fcd")
+            if not optimized_fcd:
+                return "Error: optimized_fcd required for compare action"
+            return fcd_compare(
+                fcd_file,
+                str(optimized_fcd),
+                bin_seconds=_number("bin_seconds", DEFAULT_BIN_SECONDS, float),
+                top_k=_number("top_k", 10, int),
+                min_vehicle_seconds=_number("min_vehicle_seconds", 60.0, float),
+                workers=workers,
+            )
+
+        elif action == "heatmap":
+            return fcd_heatmap(
+                fcd_file,
+                cell_size=_number("cell_size", 100.0, float),
+                top_k=_number("top_k", 20, int),
+                t0=_number("t0", None, float),
+                t1=_number("t1", None, float),
+                workers=workers,
+            )
+
+        elif action == "kpi":
+            n_resamples = _number("n_resamples", 1000, int)
+            optimized_tripinfo = params.get("optimized_tripinfo")
+            if optimized_tripinfo:
+                return compare_trip_kpis(
+                    fcd_file,
+                    str(optimized_tripinfo),
+                    params.get("summary_file"),
+                    params.get("optimized_summary"),
+                    n_resamples=n_resamples,
+                )
+            return analyze_trip_kpis(fcd_file, params.get("summary_file"), n_resamples=n_resamples)
+
+        elif action in ("follow", "tail"):
+            kind = params.get("kind")
+            return follow_analysis(
+                fcd_file,
+                kind=str(kind) if kind else None,
+                reset=bool(params.get("reset", False)),
+                top_k=_number("top_k", 5, int),
+                min_vehicle_seconds=_number("min_vehicle_seconds", 60.0, float),
+            )
+    except ValueError as e:
+        return str(e)
+
+    return f"Unknown action: {action}"
+
+
+# --- Background Jobs ---
+# Tools that can run as background jobs, with the utils.timeout operation for heartbeat settings.
+_JOB_TOOLS = {
+    "run_workflow": None,
+    "manage_rl_task": "rl_training",
+    "run_simple_simulation": None,
+    "run_analysis": None,
+    "optimize_traffic_signals": None,
+    "manage_network": None,
+    "manage_demand": None,
+}
+
+
+def _foreground(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in params.items() if k != "background"}
+
+
+def _submit_background(tool: str, args: Dict[str, Any], operation: Optional[str] = None) -> str:
+    # The registered tools are coroutine wrappers; jobs run the blocking body (via the worker pool, if any).
+    registered = server._tool_manager.get_tool(tool)
+    if registered is None:
+        return f"Error: unknown tool {tool}"
+    func = inspect.unwrap(registered.fn, stop=_offloaded_bodies.__contains__)
+    try:
+        inspect.signature(func).bind(**args)
+    except TypeError as e:
+        return f"Error: invalid arguments for {tool}: {e}"
+    job = get_job_manager().submit(tool, args, func, operation)
+    return (
+        f"Submitted job {job.job_id} ({tool}). Poll with manage_jobs('status', {{'job_id': '{job.job_id}'}}); "
+        f"files in {job.directory}."
+    )
+
+
+@server.tool(description="Background jobs: submit long tool calls and poll, list, cancel or fetch their results.")
+@quick_tool
+def manage_jobs(action: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    actions:
+    - submit: params={'tool': 'run_workflow'|'manage_rl_task'|'run_simple_simulation'|'run_analysis'|
+                      'optimize_traffic_signals'|'manage_network'|'manage_demand', 'args': dict (tool arguments)}
+      Returns a job id at once; run_workflow and manage_rl_task(train_custom) also take params.background=true.
+    - status: params={'job_id': str}
+    - list: params={'status': 'queued'|'running'|'finished'|'failed'|'cancelled'|'interrupted' (optional)}
+    - cancel: params={'job_id': str} drops a queued job or stops a running one (subprocesses are killed)
+    - result: params={'job_id': str, 'max_chars': int}
+    - log: params={'job_id': str, 'lines': int (default 50)}
+
+    Jobs run SUMO_MCP_JOB_WORKERS at a time; records, logs and results persist in SUMO_MCP_JOB_DIR.
+    """
+    params = params or {}
+    manager = get_job_manager()
+
+    try:
+        if action == "submit":
+            tool = params.get("tool")
+            args = params.get("args") or {}
+            if tool not in _JOB_TOOLS:
+                return f"Error: tool must be one of {', '.join(_JOB_TOOLS)}, got {tool!r}"
+            if not isinstance(args, dict):
+                return "Error: args must be an object"
+            return _submit_background(str(tool), args, _JOB_TOOLS[tool])
+
+        elif action == "list":
+            status = params.get("status")
+            if status and status not in JOB_STATES:
+                return f"Error: status must be one of {', '.join(JOB_STATES)}"
+            jobs = manager.list(status)
+            if not jobs:
+                return "No jobs."
+            lines = [f"Jobs ({len(jobs)}, {manager.max_workers} run at a time):"]
+            lines.extend(f"- {job.describe()}" for job in jobs)
+            return "\n".join(lines)
+
+        job_id = params.get("job_id")
+        if not job_id:
+            return "Error: job_id required"
+        job_id = str(job_id)
+
+        if action in ("status", "poll"):
+            return manager.get(job_id).describe()
+
+        elif action == "cancel":
+            job = manager.cancel(job_id)
+            return job.describe()
+
+        elif action in ("result", "fetch"):
+            job = manager.get(job_id)
+            result = manager.result(job_id)
+            if result is None:
+                return f"No result yet: {job.describe()}"
+            max_chars = int(params.get("max_chars", 0) or 0)
+            return truncate_text(result, max_chars) if max_chars > 0 else truncate_text(result)
+
+        elif action == "log":
+            return manager.log_tail(job_id, int(params.get("lines", 50))) or f"No log for job {job_id}."
+
+    except KeyError as e:
+        return f"Error: {e.args[0]}"
+    except Exception as e:
+        return f"Error in manage_jobs ({action}): {type(e).__name__}: {e}"
+
+    return f"Unknown action: {action}"
 
-@server.tool(description="Analyze FCD output.")
-def run_analysis(fcd_file: str) -> str:
-    return analyze_fcd(fcd_file)
 
 if __name__ == "__main__":
-    # NOTE:
-    # MCP stdio transport relies on AnyIO/asyncio to process thread callbacks.
-    # In some environments, a lack of scheduled timers can cause the event loop to
-    # block indefinitely while waiting for stdio worker-thread results. A small
-    # periodic sleep keeps the loop responsive without emitting any stdout output.
-    import anyio
-
-    async def _wakeup_task() -> None:
-        while True:
-            await anyio.sleep(0.1)
-
-    async def _run_stdio_with_wakeup() -> None:
-        async with anyio.create_task_group() as tg:
-            tg.start_soon(_wakeup_task)
-            await server.run_stdio_async()
-
-    anyio.run(_run_stdio_with_wakeup)
+    idle_s = SESSION_IDLE_S if TRANSPORT != "stdio" else 0.0
+    pool = start_worker_pool(WORKER_PROCESSES, session_idle_s=idle_s)
+    if pool is None and idle_s > 0:
+        connection_manager.start_idle_reaper(idle_s)
+    try:
+        server.run(transport=TRANSPORT)
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,148 @@
+"""
+Cooperative cancellation of blocking tool work run off the event loop.
+
+`run_blocking` runs a synchronous tool body in a worker thread so the MCP
+event loop keeps serving other requests. When the client cancels the request,
+the await is abandoned at once and the `CancelToken` of that call fires:
+
+- SUMO tool subprocesses started through `utils.timeout` are killed;
+- queued requests of a TraCI session worker are cancelled;
+- stepping loops and RL training stop at their next check.
+
+Blocking code finds the token of the call it runs for through a context
+variable, so helpers deep in the call stack need no extra parameter. The same
+token carries an optional progress callback: background jobs (`utils.jobs`)
+set it, and `report_progress` is a no-op everywhere else.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import threading
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+import anyio
+import anyio.to_thread
+
+T = TypeVar("T")
+
+
+class OperationCancelled(Exception):
+    """The request this work runs for was cancelled by the client."""
+
+
+class CancelToken:
+    """Set once when the owning request is cancelled; runs the registered callbacks then."""
+
+    def __init__(self, progress: Optional[Callable[[Optional[str]], None]] = None) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], object]] = []
+        self.progress = progress
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def register(self, callback: Callable[[], object]) -> Callable[[], None]:
+        """Run `callback` on cancellation (at once if already cancelled); returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return functools.partial(self._unregister, callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback: Callable[[], object]) -> None:
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("sumo_mcp_cancel", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    """Token of the request the calling code runs for; None outside `run_blocking`."""
+    return _current.get()
+
+
+def raise_if_cancelled() -> None:
+    token = _current.get()
+    if token is not None and token.cancelled:
+        raise OperationCancelled("Request cancelled by the client.")
+
+
+def on_cancel(callback: Callable[[], object]) -> Callable[[], None]:
+    """Register `callback` with the current token; no-op (returning a no-op) outside `run_blocking`."""
+    token = _current.get()
+    if token is None:
+        return lambda: None
+    return token.register(callback)
+
+
+def report_progress(message: Optional[str] = None) -> None:
+    """Heartbeat (plus an optional progress message) for the job the calling code runs for."""
+    token = _current.get()
+    if token is not None and token.progress is not None:
+        token.progress(message)
+
+
+def run_with_token(token: CancelToken, func: Callable[..., T], *args: Any) -> T:
+    """Run `func(*args)` in a copy of the current context in which `token` is the current token."""
+
+    def _run() -> T:
+        _current.set(token)
+        return func(*args)
+
+    return contextvars.copy_context().run(_run)
+
+
+def bind_context(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap `func` to run in a copy of the caller's context, so threads it starts see the token."""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+async def run_blocking(
+    func: Callable[..., T], *args: Any, limiter: Optional[anyio.CapacityLimiter] = None
+) -> T:
+    """Run `func(*args)` in a worker thread; cancelling the awaiting task fires its `CancelToken`."""
+    token = CancelToken()
+    try:
+        return await anyio.to_thread.run_sync(
+            functools.partial(run_with_token, token, func, *args), abandon_on_cancel=True, limiter=limiter
+        )
+    except anyio.get_cancelled_exc_class():
+        token.cancel()
+        raise
+
+
+def blocking_tool(
+    limiter: Optional[anyio.CapacityLimiter] = None,
+) -> Callable[[Callable[..., T]], Callable[..., Awaitable[T]]]:
+    """Turn a synchronous tool function into a coroutine function that runs it via `run_blocking`."""
+
+    def decorator(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            return await run_blocking(functools.partial(func, *args, **kwargs), limiter=limiter)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,165 @@
+"""
+Saved simulation states of live sessions: named snapshots and periodic checkpoints.
+
+`simulation.saveState` writes the complete simulation state (vehicles, signal
+states, detectors and, since sessions run with `--save-state.rng`, the random
+number generators) to a file. A state is brought back by (re)starting SUMO
+with `--load-state`: unlike `simulation.loadState` on a running simulation,
+this skips the route-file vehicles that departed before the saved time
+instead of inserting them again. Restoring, forking a new session from a
+snapshot and resuming a closed session after a timeout all work that way.
+
+Files live in `<SUMO_MCP_STATE_DIR>/[<client>/]<session id>/`, so checkpoints
+of a session that timed out stay available to a later `connect`; sessions of
+HTTP clients get a per-client subdirectory (see `utils.connection`).
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+STATE_DIR = os.environ.get("SUMO_MCP_STATE_DIR") or os.path.join(tempfile.gettempdir(), "sumo-mcp-state")
+STATE_SUFFIX = ".xml.gz"
+DEFAULT_CHECKPOINT_KEEP = 3
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+_CHECKPOINT_RE = re.compile(r"^checkpoint-(?P<time>[0-9.]+)" + re.escape(STATE_SUFFIX) + "$")
+
+
+def _check_name(name: str, what: str) -> str:
+    if not _NAME_RE.match(name):
+        raise ValueError(f"{what} may only contain letters, digits, '_', '.' and '-', got '{name}'")
+    return name
+
+
+def _safe_path_part(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+
+def session_state_dir(session_id: str, client: Optional[str] = None) -> str:
+    if client:
+        return os.path.join(STATE_DIR, _safe_path_part(client), _safe_path_part(session_id))
+    return os.path.join(STATE_DIR, _safe_path_part(session_id))
+
+
+def latest_checkpoint(session_id: str, client: Optional[str] = None) -> Optional[str]:
+    """Path of the newest (highest simulation time) checkpoint written for `session_id`, if any."""
+    best: Optional[str] = None
+    best_time = -1.0
+    for path in glob.glob(os.path.join(session_state_dir(session_id, client), "checkpoint-*" + STATE_SUFFIX)):
+        match = _CHECKPOINT_RE.match(os.path.basename(path))
+        if match and float(match.group("time")) > best_time:
+            best, best_time = path, float(match.group("time"))
+    return best
+
+
+@dataclass
+class StateFile:
+    """One saved state."""
+
+    name: str
+    path: str
+    time: float          # simulation time [s]
+    steps: int           # session steps at save time
+    created_at: float
+
+    def describe(self) -> str:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return f"{self.name}: t={self.time:g}, step {self.steps}, {size / 1024.0:.1f} KiB, {self.path}"
+
+
+class SessionStates:
+    """Snapshots and checkpoints of one session; saves run on the session worker."""
+
+    def __init__(self, session_id: str, client: Optional[str] = None) -> None:
+        self.directory = session_state_dir(session_id, client)
+        self.snapshots: Dict[str, StateFile] = {}
+        self.checkpoints: List[StateFile] = []
+        self.checkpoint_every_s: Optional[float] = None
+        self.checkpoint_keep = DEFAULT_CHECKPOINT_KEEP
+        self._next_checkpoint = 0.0
+
+    def _save(self, conn: Any, name: str, path: str, now: float, steps: int) -> StateFile:
+        os.makedirs(self.directory, exist_ok=True)
+        conn.simulation.saveState(path)
+        return StateFile(name, path, now, steps, time.time())
+
+    def snapshot(self, conn: Any, name: str, now: float, steps: int) -> StateFile:
+        """Save the current state under `name` (replacing an older snapshot of that name)."""
+        path = os.path.join(self.directory, f"snapshot-{_check_name(name, 'Snapshot name')}{STATE_SUFFIX}")
+        state = self._save(conn, name, path, now, steps)
+        self.snapshots[name] = state
+        return state
+
+    def resolve(self, name_or_path: str) -> str:
+        """A snapshot name of this session, or the path of a state file."""
+        state = self.snapshots.get(name_or_path)
+        if state is not None:
+            return state.path
+        if os.path.exists(name_or_path):
+            return os.path.abspath(name_or_path)
+        known = ", ".join(self.snapshots) or "none"
+        raise FileNotFoundError(f"No snapshot or state file '{name_or_path}' (snapshots: {known})")
+
+    def enable_checkpoints(self, every_s: float, keep: int, now: float) -> None:
+        if every_s <= 0:
+            raise ValueError(f"every_s must be > 0, got {every_s}")
+        if keep < 1:
+            raise ValueError(f"keep must be >= 1, got {keep}")
+        if self.checkpoint_every_s is None and not self.checkpoints:
+            # Checkpoints left by an earlier session with this id would shadow ours on resume.
+            for path in glob.glob(os.path.join(self.directory, "checkpoint-*" + STATE_SUFFIX)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.checkpoint_every_s = every_s
+        self.checkpoint_keep = keep
+        self._next_checkpoint = now + every_s
+
+    def disable_checkpoints(self) -> None:
+        self.checkpoint_every_s = None
+
+    def maybe_checkpoint(self, conn: Any, now: float, steps: int) -> Optional[StateFile]:
+        """Write a checkpoint when one is due at simulation time `now`; keeps the newest `checkpoint_keep`."""
+        if self.checkpoint_every_s is None or now < self._next_checkpoint - 1e-9:
+            return None
+        self._next_checkpoint = now + self.checkpoint_every_s
+        path = os.path.join(self.directory, f"checkpoint-{now:.2f}{STATE_SUFFIX}")
+        state = self._save(conn, os.path.basename(path), path, now, steps)
+        self.checkpoints.append(state)
+        while len(self.checkpoints) > self.checkpoint_keep:
+            old = self.checkpoints.pop(0)
+            try:
+                os.remove(old.path)
+            except OSError:
+                pass
+        return state
+
+    def restart_schedule(self, now: float) -> None:
+        """Re-anchor the checkpoint schedule after the simulation time jumped (restore)."""
+        # Checkpoints past `now` belong to the abandoned branch and must not win a resume.
+        for old in [state for state in self.checkpoints if state.time > now]:
+            self.checkpoints.remove(old)
+            try:
+                os.remove(old.path)
+            except OSError:
+                pass
+        if self.checkpoint_every_s is not None:
+            self._next_checkpoint = now + self.checkpoint_every_s
+
+    def describe(self) -> List[str]:
+        lines = [f"snapshot {state.describe()}" for state in self.snapshots.values()]
+        if self.checkpoint_every_s is not None:
+            lines.append(
+                f"checkpoints every {self.checkpoint_every_s:g}s sim time, keeping {self.checkpoint_keep}, "
+                f"next at t={self._next_checkpoint:g}"
+            )
+        lines.extend(f"checkpoint {state.describe()}" for state in self.checkpoints)
+        return lines
@@ -1,75 +1,349 @@
+import contextlib
 import logging
+import math
 import os
+import socket
 import subprocess
 import threading
-from typing import Callable, Optional, TypeVar
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple, TypeVar, cast
 
 import traci
+import traci.constants as tc
 
+from utils.cancellation import on_cancel
 from utils.sumo import find_sumo_binary
+from utils.checkpoint import SessionStates
+from utils.controllers import ControllerSet
+from utils.snapshot import StepSnapshotCache
+from utils.subscriptions import VehicleDeltaTracker, VehicleStateSubscription
+from utils.traci import acquire_backend, release_libsumo, require_libsumo
+from utils.traci_worker import TraCIWorker
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_TRACI_TIMEOUT_S = float(os.environ.get("SUMO_MCP_TRACI_TIMEOUT_S", "10"))
+# Maximum number of simultaneously open simulation sessions.
+MAX_SESSIONS = int(os.environ.get("SUMO_MCP_MAX_SESSIONS", "4"))
+DEFAULT_SESSION_ID = "default"
 
 T = TypeVar("T")
 
+# MCP client the calling code acts for; None for the single stdio client. Session ids are
+# resolved within this scope, so clients of a shared HTTP server cannot see or touch each
+# other's sessions even when both use the same session id.
+_client: ContextVar[Optional[str]] = ContextVar("sumo_mcp_client", default=None)
+_SessionKey = Tuple[Optional[str], str]
 
-def _run_with_timeout(func: Callable[[], T], timeout_s: float, description: str) -> T:
-    result: dict[str, T] = {}
-    error: dict[str, Exception] = {}
-    done = threading.Event()
 
-    def _worker() -> None:
+def current_client() -> Optional[str]:
+    return _client.get()
+
+
+@contextlib.contextmanager
+def client_scope(client: Optional[str]) -> Iterator[None]:
+    """Resolve session ids for `client` inside the block."""
+    token = _client.set(client)
+    try:
+        yield
+    finally:
+        _client.reset(token)
+
+
+def _abort_connection(conn: Any) -> None:
+    """Unblock a TraCI call stuck on the socket: shut the socket down and kill a SUMO we started."""
+    sock = getattr(conn, "_socket", None)
+    if sock is not None:
         try:
-            result["value"] = func()
-        except Exception as exc:
-            error["error"] = exc
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    process = getattr(conn, "_process", None)
+    if process is not None and process.poll() is None:
+        process.kill()
+
+
+def _close_label(label: str) -> None:
+    """Close the TraCI connection registered under `label`, if any."""
+    try:
+        traci.getConnection(label).close()
+    except Exception as e:
+        logger.debug("Closing stale connection %s failed: %s", label, e)
+
+
+def _close_libsumo() -> None:
+    """Close a (possibly half-started) libsumo simulation and free the in-process slot."""
+    try:
+        require_libsumo().close()
+    except Exception as e:
+        logger.debug("Closing libsumo failed: %s", e)
+    finally:
+        release_libsumo()
+
+
+class SimulationSession:
+    """
+    One live SUMO instance driven over its own labeled TraCI connection, or in-process through libsumo.
+
+    All requests run on the session's `TraCIWorker`, in submission order. `conn` is a
+    `traci.Connection` or the `libsumo` module, which expose the same domain API.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        label: str,
+        conn: Any,
+        config_file: Optional[str],
+        worker: TraCIWorker,
+        backend: str = "traci",
+        backend_note: Optional[str] = None,
+        sumo_args: Optional[List[str]] = None,
+        client: Optional[str] = None,
+    ) -> None:
+        self.session_id = session_id
+        self.client = client
+        self.label = label
+        self.conn = conn
+        self.config_file = config_file
+        self.worker = worker
+        self.backend = backend
+        self.backend_note = backend_note
+        # SUMO arguments (without the binary) the simulation was started with; None when attached.
+        self.sumo_args = sumo_args
+        # Persistent subscriptions; only touched from the worker thread.
+        self.vehicle_states = VehicleStateSubscription()
+        self.vehicle_delta = VehicleDeltaTracker()
+        self.controllers = ControllerSet()
+        self.snapshot = StepSnapshotCache()
+        self.states = SessionStates(session_id, client)
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.steps = 0
+        self._connected = True
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def call(self, func: Callable[[Any], T], description: str, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> T:
+        """
+        Run `func(conn)` on the session worker.
+
+        A request that times out while queued is cancelled and the session stays open; one that
+        times out while running closes the session, since the connection state is then unknown.
+        """
+        if not self._connected:
+            raise RuntimeError(f"Session '{self.session_id}' is not connected.")
+
+        self.last_used = time.time()
+        future = self.worker.submit(lambda: func(self.conn), description)
+        # A cancelled client request drops its call if it has not started yet.
+        unregister = on_cancel(future.cancel)
+        try:
+            return self.worker.wait(future, description, timeout_s)
+        except TimeoutError:
+            if not future.cancelled():
+                self._connected = False
+                self._shutdown(timeout_s, abort=True)
+            raise
         finally:
-            done.set()
+            unregister()
+
+    def cached(
+        self,
+        key: Hashable,
+        func: Callable[[Any], T],
+        description: str,
+        timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+    ) -> T:
+        """Answer from the step snapshot cache, or run `func(conn)` and cache its result for this step."""
+        found, cached = self.snapshot.lookup(key)
+        if found:
+            return cast(T, cached)
+
+        def _load(conn: Any) -> T:
+            # Re-checked on the worker: a request queued just before ours may have filled it.
+            found, cached = self.snapshot.peek(key)
+            if found:
+                return cast(T, cached)
+            value = func(conn)
+            self.snapshot.store(key, value)
+            return value
+
+        return self.call(_load, description, timeout_s=timeout_s)
+
+    def step(self, step: float = 0, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> None:
+        def _step(conn: Any) -> None:
+            conn.simulationStep(step)
+            self.steps += 1
+            self.observe_step(conn)
+            # Invalidated on the worker, so no cached read can straddle the step.
+            t = self.vehicle_states.time(conn)
+            self.snapshot.invalidate(None if math.isnan(t) else t)
+
+        self.call(_step, description="traci.simulationStep", timeout_s=timeout_s)
+
+    def observe_step(self, conn: Any) -> None:
+        """Per-step bookkeeping after every simulationStep of this session (worker thread only)."""
+        self.vehicle_delta.observe(conn, self.vehicle_states)
+        self.controllers.on_step(conn, self)
+        if self.states.checkpoint_every_s is not None:
+            self.states.maybe_checkpoint(conn, self.vehicle_states.time(conn), self.steps)
+
+    def load_state(self, conn: Any, path: str) -> List[str]:
+        """
+        Reload the simulation from the state file `path` (worker thread only).
+
+        SUMO restarts with the session's arguments plus `--load-state`, which drops every
+        subscription, so the subscription trackers start over and the controllers, whose
+        setup is bound to the old simulation, are removed. Returns the removed controller names.
+        """
+        if self.sumo_args is None:
+            raise RuntimeError(
+                f"Session '{self.session_id}' is attached to an external SUMO and cannot reload a state."
+            )
+        conn.load(self.sumo_args + ["--load-state", path])
+        removed = list(self.controllers.handles)
+        self.vehicle_states = VehicleStateSubscription()
+        self.vehicle_delta = VehicleDeltaTracker()
+        self.controllers = ControllerSet()
+        self.vehicle_states.ensure(conn, (), sim_variables=(tc.VAR_TIME,))
+        now = self.vehicle_states.time(conn)
+        self.states.restart_schedule(now)
+        self.snapshot.invalidate(now)
+        return removed
 
-    thread = threading.Thread(target=_worker, daemon=True, name=f"sumo-mcp:{description}")
-    thread.start()
+    def cancel_pending(self) -> int:
+        return self.worker.cancel_pending()
+
+    def close(self, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> None:
+        if not self._connected:
+            return
+        self._connected = False
+        self._shutdown(timeout_s, abort=False)
 
-    if not done.wait(timeout_s):
-        raise TimeoutError(f"TimeoutError: {description} timed out after {timeout_s:.1f}s")
+    def _shutdown(self, timeout_s: float, abort: bool) -> None:
+        """
+        Close the connection on the worker (after aborting the socket when `abort`), then stop it.
 
-    if "error" in error:
-        raise error["error"]
+        An in-process libsumo call cannot be interrupted; its close simply runs once the call returns.
+        """
+        self.worker.cancel_pending()
+        if abort:
+            _abort_connection(self.conn)
+        try:
+            self.worker.call(self.conn.close, "traci.close", timeout_s)
+        except Exception as e:
+            logger.debug("Closing session %s failed: %s", self.session_id, e)
+            _abort_connection(self.conn)
+            # The worker runs this once the stuck call returns, so the connection is always released.
+            if self.backend == "libsumo":
+                self.worker.submit(self.conn.close, "libsumo.close")
+            else:
+                self.worker.submit(lambda: _close_label(self.label), "traci.close")
+        if self.backend == "libsumo":
+            self.worker.submit(release_libsumo, "libsumo.release")
+        self.worker.stop(cancel_pending=False)
 
-    return result["value"]
+    def describe(self) -> str:
+        age = time.time() - self.created_at
+        source = self.config_file or "attached"
+        state = "connected" if self._connected else "closed"
+        stats = self.worker.stats
+        latency = f"{stats.run.mean * 1000.0:.2f} ms mean" if stats.run.count else "n/a"
+        return (
+            f"{self.session_id}: {state}, {self.backend}, {source}, {self.steps} steps, up {age:.0f}s, "
+            f"queue {self.worker.depth}, {stats.completed + stats.failed} calls ({latency})"
+        )
 
 
 class SUMOConnection:
     """
-    Singleton class to manage the connection to the SUMO server via TraCI.
+    Singleton pool of concurrent SUMO sessions keyed by session id.
+
+    Every session owns a separately labeled TraCI connection, so sessions are created,
+    stepped, queried and closed independently. Calls that omit the session id go to
+    the "default" session, or to the only session when exactly one is open. Sessions
+    belong to the MCP client that opened them (`client_scope`); the session limit is
+    shared by all clients.
     """
     _instance: Optional['SUMOConnection'] = None
-    _connected: bool
-    
+    _sessions: Dict[_SessionKey, SimulationSession]
+    _pending: Set[_SessionKey]
+    _pool_lock: threading.Lock
+    max_sessions: int
+
     def __new__(cls) -> "SUMOConnection":
         if cls._instance is None:
             cls._instance = super(SUMOConnection, cls).__new__(cls)
-            cls._instance._connected = False
+            cls._instance._sessions = {}
+            cls._instance._pending = set()
+            cls._instance._pool_lock = threading.Lock()
+            cls._instance.max_sessions = MAX_SESSIONS
         return cls._instance
 
     def connect(
         self,
         config_file: Optional[str] = None,
         gui: bool = False,
-        port: int = 8813,
+        port: Optional[int] = None,
         host: str = "localhost",
         timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
-    ) -> None:
+        session_id: Optional[str] = None,
+        backend: Optional[str] = None,
+        state_file: Optional[str] = None,
+    ) -> str:
         """
-        Start SUMO and connect, or connect to an existing instance.
-        If config_file is provided, starts a new instance.
+        Start SUMO and connect, or connect to an existing instance, as session `session_id`.
+        If config_file is provided, starts a new instance (on a free port unless `port` is given).
         If config_file is None, attempts to connect to existing server at host:port.
+
+        backend="libsumo" runs the simulation inside this process without socket round trips.
+        It falls back to TraCI for the GUI, for attaching, when libsumo is missing, or when
+        another session already holds libsumo (one in-process simulation per process).
+
+        `state_file` starts the simulation from a state saved by `simulation.saveState`
+        (a snapshot or checkpoint, see `utils.checkpoint`); it requires `config_file`.
+
+        Returns:
+            The session id.
         """
-        if self._connected:
-            logger.info("Already connected to SUMO.")
-            return
+        session_id = session_id or DEFAULT_SESSION_ID
+        client = current_client()
+        key = (client, session_id)
+        with self._pool_lock:
+            existing = self._sessions.get(key)
+            if existing is not None and existing.is_connected():
+                logger.info("Session %s already connected to SUMO.", session_id)
+                return session_id
+            if key in self._pending:
+                raise RuntimeError(f"Session '{session_id}' is already being connected.")
+            in_use = sum(1 for s in self._sessions.values() if s.is_connected()) + len(self._pending)
+            if in_use >= self.max_sessions:
+                raise RuntimeError(
+                    f"Session limit reached ({self.max_sessions}); disconnect a session or raise SUMO_MCP_MAX_SESSIONS."
+                )
+            # Reserve the id so concurrent connects can neither exceed the limit nor reuse it.
+            if state_file and not config_file:
+                raise ValueError("state_file requires config_file.")
+            self._sessions.pop(key, None)
+            self._pending.add(key)
+
+        try:
+            backend, backend_note = acquire_backend(backend, gui=gui, attach=not config_file)
+        except ValueError:
+            with self._pool_lock:
+                self._pending.discard(key)
+            raise
+        if backend_note:
+            logger.info("Session %s uses TraCI: %s", session_id, backend_note)
 
+        label = f"sumo-mcp:{session_id}:{uuid.uuid4().hex[:8]}"
+        # The worker that opens the connection stays with the session for all later requests.
+        worker = TraCIWorker(session_id)
+        sumo_args: Optional[List[str]] = None
         try:
             if config_file:
                 binary_name = "sumo-gui" if gui else "sumo"
@@ -80,66 +354,189 @@ class SUMOConnection:
                         "Please ensure SUMO is installed and either the binary is in PATH or SUMO_HOME is set."
                     )
                 # Add --no-step-log to prevent stdout pollution which breaks JSON-RPC
-                cmd = [binary, "-c", config_file, "--no-step-log", "true"]
-                logger.info(f"Starting SUMO with command: {cmd}")
-                _run_with_timeout(
-                    lambda: traci.start(cmd, port=port, stdout=subprocess.DEVNULL),
-                    timeout_s=timeout_s,
-                    description="traci.start",
-                )
+                # --save-state.rng makes runs forked from a saved state reproducible.
+                sumo_args = ["-c", config_file, "--no-step-log", "true", "--save-state.rng", "true"]
+                cmd = [binary, *sumo_args]
+                if state_file:
+                    cmd += ["--load-state", state_file]
+                logger.info(f"Starting SUMO session {session_id} ({backend}) with command: {cmd}")
+
+                def _open() -> Any:
+                    if backend == "libsumo":
+                        libsumo = require_libsumo()
+                        libsumo.start(cmd)
+                        return libsumo
+                    traci.start(cmd, port=port, label=label, stdout=subprocess.DEVNULL, doSwitch=False)
+                    return traci.getConnection(label)
+
+                conn = worker.call(_open, f"{backend}.start", timeout_s)
             else:
-                logger.info(f"Connecting to existing SUMO at {host}:{port}")
-                _run_with_timeout(
-                    lambda: traci.init(host=host, port=port),
-                    timeout_s=timeout_s,
-                    description="traci.init",
-                )
-            
-            self._connected = True
-            logger.info("Successfully connected to SUMO.")
+                logger.info(f"Connecting session {session_id} to existing SUMO at {host}:{port or 8813}")
+
+                def _attach() -> Any:
+                    traci.init(host=host, port=port or 8813, label=label, doSwitch=False)
+                    return traci.getConnection(label)
+
+                conn = worker.call(_attach, "traci.init", timeout_s)
         except Exception as e:
-            logger.error(f"Failed to connect to SUMO: {e}")
-            self._connected = False
-            try:
-                _run_with_timeout(traci.close, timeout_s=timeout_s, description="traci.close")
-            except Exception:
-                pass
+            logger.error(f"Failed to connect session {session_id} to SUMO: {e}")
+            with self._pool_lock:
+                self._pending.discard(key)
+            # Queued behind a start/init that may still be running, so a late connection is closed too.
+            if backend == "libsumo":
+                worker.submit(_close_libsumo, "libsumo.close")
+            else:
+                worker.submit(lambda: _close_label(label), "traci.close")
+            worker.stop(cancel_pending=False)
             raise
 
-    def disconnect(self, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> None:
-        """Disconnect from SUMO server."""
-        if not self._connected:
+        with self._pool_lock:
+            self._pending.discard(key)
+            self._sessions[key] = SimulationSession(
+                session_id,
+                label,
+                conn,
+                config_file,
+                worker,
+                backend=backend,
+                backend_note=backend_note,
+                sumo_args=sumo_args,
+                client=client,
+            )
+        logger.info("Session %s connected to SUMO.", session_id)
+        return session_id
+
+    def get_session(self, session_id: Optional[str] = None) -> SimulationSession:
+        """Resolve `session_id` (or the implicit default session) to an open session of the current client."""
+        client = current_client()
+        with self._pool_lock:
+            open_sessions = {
+                sid: s for (owner, sid), s in self._sessions.items() if owner == client and s.is_connected()
+            }
+        if session_id is None:
+            if DEFAULT_SESSION_ID in open_sessions:
+                return open_sessions[DEFAULT_SESSION_ID]
+            if len(open_sessions) == 1:
+                return next(iter(open_sessions.values()))
+            if not open_sessions:
+                raise RuntimeError("Not connected to SUMO.")
+            raise RuntimeError(f"Multiple sessions open ({', '.join(sorted(open_sessions))}); pass session_id.")
+        session = open_sessions.get(session_id)
+        if session is None:
+            raise RuntimeError(f"No open session '{session_id}'.")
+        return session
+
+    def list_sessions(self, all_clients: bool = False) -> List[SimulationSession]:
+        """Open sessions of the current client (of every client with `all_clients`)."""
+        client = current_client()
+        with self._pool_lock:
+            return [
+                s for (owner, _), s in self._sessions.items()
+                if s.is_connected() and (all_clients or owner == client)
+            ]
+
+    def disconnect(self, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S, session_id: Optional[str] = None) -> None:
+        """Disconnect one session from SUMO (the implicit default session when `session_id` is None)."""
+        try:
+            session = self.get_session(session_id)
+        except RuntimeError:
             return
-        
+
         try:
-            _run_with_timeout(traci.close, timeout_s=timeout_s, description="traci.close")
-            logger.info("Disconnected from SUMO.")
+            session.close(timeout_s=timeout_s)
+            logger.info("Session %s disconnected from SUMO.", session.session_id)
         except Exception as e:
             logger.error(f"Error during disconnect: {e}")
         finally:
-            self._connected = False
+            self._forget(session)
 
-    def is_connected(self) -> bool:
-        return self._connected
+    def disconnect_all(self, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> None:
+        for session in self.list_sessions():
+            self.disconnect(timeout_s=timeout_s, session_id=session.session_id)
+
+    def is_connected(self, session_id: Optional[str] = None) -> bool:
+        try:
+            self.get_session(session_id)
+        except RuntimeError:
+            return False
+        return True
+
+    def _forget(self, session: SimulationSession) -> None:
+        key = (session.client, session.session_id)
+        with self._pool_lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+
+    def close_idle(self, max_idle_s: float, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> List[str]:
+        """Close sessions of any client unused for `max_idle_s`; returns their "client/session" names."""
+        now = time.time()
+        closed = []
+        for session in self.list_sessions(all_clients=True):
+            busy = session.worker.current is not None or session.worker.depth
+            if busy or now - session.last_used < max_idle_s:
+                continue
+            try:
+                session.close(timeout_s=timeout_s)
+            except Exception as e:
+                logger.error(f"Error closing idle session {session.session_id}: {e}")
+            finally:
+                self._forget(session)
+            closed.append(f"{session.client or '-'}/{session.session_id}")
+        return closed
+
+    def start_idle_reaper(self, max_idle_s: float) -> None:
+        """Close idle sessions from a daemon thread; clients of a shared server may leave without disconnecting."""
+
+        def _loop() -> None:
+            while True:
+                time.sleep(min(60.0, max_idle_s / 2))
+                for name in self.close_idle(max_idle_s):
+                    logger.info("Closed idle simulation session %s", name)
 
-    def traci_call(self, func: Callable[[], T], description: str, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> T:
-        """Run a TraCI call with a soft timeout and disconnect on timeout."""
-        if not self.is_connected():
-            raise RuntimeError("Not connected to SUMO.")
+        threading.Thread(target=_loop, daemon=True, name="sumo-mcp:idle").start()
 
+    def traci_call(
+        self,
+        func: Callable[[Any], T],
+        description: str,
+        timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+        session_id: Optional[str] = None,
+    ) -> T:
+        """Run `func(conn)` on a session's TraCI connection with a soft timeout; the session closes on timeout."""
+        session = self.get_session(session_id)
         try:
-            return _run_with_timeout(func, timeout_s=timeout_s, description=description)
+            return session.call(func, description, timeout_s=timeout_s)
         except TimeoutError:
-            self._connected = False
-            try:
-                _run_with_timeout(traci.close, timeout_s=timeout_s, description="traci.close")
-            except Exception:
-                pass
+            self._forget(session)
             raise
-    
-    def simulation_step(self, step: float = 0, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S) -> None:
-        """Advance the simulation."""
-        self.traci_call(lambda: traci.simulationStep(step), description="traci.simulationStep", timeout_s=timeout_s)
+
+    def cached_call(
+        self,
+        key: Hashable,
+        func: Callable[[Any], T],
+        description: str,
+        timeout_s: float = DEFAULT_TRACI_TIMEOUT_S,
+        session_id: Optional[str] = None,
+    ) -> T:
+        """Like `traci_call`, but served from the session's per-step snapshot cache when possible."""
+        session = self.get_session(session_id)
+        try:
+            return session.cached(key, func, description, timeout_s=timeout_s)
+        except TimeoutError:
+            self._forget(session)
+            raise
+
+    def simulation_step(
+        self, step: float = 0, timeout_s: float = DEFAULT_TRACI_TIMEOUT_S, session_id: Optional[str] = None
+    ) -> None:
+        """Advance the simulation of one session."""
+        session = self.get_session(session_id)
+        try:
+            session.step(step, timeout_s=timeout_s)
+        except TimeoutError:
+            self._forget(session)
+            raise
+
 
 # Global instance
 connection_manager = SUMOConnection()
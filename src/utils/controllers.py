@@ -0,0 +1,313 @@
+"""
+Server-side closed-loop controllers for live simulation sessions.
+
+A controller is any class with a `step(ctx)` method (and optional `setup(ctx)`
+and `close(ctx)`). It is loaded from "package.module:Class" or
+"/path/to/file.py:Class", instantiated with user options, and invoked by the
+session every `every` steps right after `simulationStep`, on the session
+worker. `ControllerContext` exposes the connection for actuation and the
+session subscriptions for observation, so a whole episode runs server-side
+in one `run_until` call instead of one MCP round trip per decision.
+
+`QTableSignalController` replays the greedy policy of the Q-tables that
+`run_rl_training` saves (`q_tables.json`).
+"""
+
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import traci.constants as tc
+
+from utils.stats import RunningStats
+
+Q_TABLE_FORMAT = "sumo-mcp-qtable/1"
+Q_TABLE_FILE = "q_tables.json"
+
+
+class ControllerContext:
+    """What a controller sees at each invocation."""
+
+    def __init__(self, conn: Any, session: Any) -> None:
+        self.conn = conn
+        self.session = session
+        self.session_id: str = session.session_id
+        self.time = math.nan
+        self.step = 0
+
+    def vehicle_states(
+        self, variables: Sequence[str], vehicle_ids: Optional[Sequence[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """Vehicle variables from the session subscription (subscribed on first use)."""
+        subscription = self.session.vehicle_states
+        subscription.ensure(self.conn, variables)
+        states: Dict[str, Dict[str, Any]] = subscription.read(self.conn, variables, vehicle_ids)
+        return states
+
+
+def load_controller_class(class_path: str) -> type:
+    """Resolve "package.module:Class", "package.module.Class" or "/path/file.py:Class"."""
+    if ":" in class_path:
+        module_path, _, class_name = class_path.rpartition(":")
+    else:
+        module_path, _, class_name = class_path.rpartition(".")
+    if not module_path or not class_name:
+        raise ValueError(f"Controller must be given as 'module:Class', got '{class_path}'")
+    if module_path.endswith(".py"):
+        if not os.path.exists(module_path):
+            raise FileNotFoundError(f"Controller file not found: {module_path}")
+        name = f"sumo_mcp_controller_{abs(hash(os.path.abspath(module_path)))}"
+        spec = importlib.util.spec_from_file_location(name, module_path)
+        if spec is None or spec.loader is None:
+            raise ImportError(f"Cannot load controller file {module_path}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_path)
+    cls: Optional[type] = getattr(module, class_name, None)
+    if cls is None:
+        raise AttributeError(f"{module_path} has no attribute '{class_name}'")
+    if not callable(getattr(cls, "step", None)):
+        raise TypeError(f"{class_path} has no step(ctx) method")
+    return cls
+
+
+class ControllerHandle:
+    """A registered controller instance with its schedule and timing."""
+
+    def __init__(self, name: str, class_path: str, instance: Any, every: int) -> None:
+        self.name = name
+        self.class_path = class_path
+        self.instance = instance
+        self.every = every
+        self.steps_seen = 0
+        self.timing = RunningStats()     # seconds per invocation
+        self.last_error: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return self.last_error is None
+
+    def describe(self) -> str:
+        calls = self.timing.count
+        if calls:
+            timing = (
+                f"{calls} calls, {self.timing.mean * 1000.0:.3f} ms mean, {self.timing.max * 1000.0:.3f} ms max, "
+                f"{self.timing.mean * calls:.3f}s total"
+            )
+        else:
+            timing = "0 calls"
+        state = "active" if self.active else f"disabled ({self.last_error})"
+        return f"{self.name}: {self.class_path} every {self.every} step(s), {timing}, {state}"
+
+
+class ControllerSet:
+    """Controllers of one session; used from the session worker only."""
+
+    def __init__(self) -> None:
+        self.handles: Dict[str, ControllerHandle] = {}
+
+    def add(self, conn: Any, session: Any, name: str, class_path: str, every: int, options: Dict[str, Any]) -> None:
+        if every < 1:
+            raise ValueError(f"every must be >= 1, got {every}")
+        if name in self.handles:
+            raise ValueError(f"Controller '{name}' is already registered; remove it first")
+        instance = load_controller_class(class_path)(**options)
+        # Controllers read the step time from the simulation subscription.
+        session.vehicle_states.ensure(conn, (), sim_variables=(tc.VAR_TIME,))
+        setup = getattr(instance, "setup", None)
+        if callable(setup):
+            setup(self._context(conn, session))
+        self.handles[name] = ControllerHandle(name, class_path, instance, every)
+
+    def remove(self, conn: Any, session: Any, name: str) -> ControllerHandle:
+        handle = self.handles.pop(name, None)
+        if handle is None:
+            raise KeyError(f"No controller '{name}'")
+        close = getattr(handle.instance, "close", None)
+        if callable(close):
+            close(self._context(conn, session))
+        return handle
+
+    def on_step(self, conn: Any, session: Any) -> None:
+        """Invoke the controllers that are due after a simulation step."""
+        if not self.handles:
+            return
+        ctx = None
+        for handle in self.handles.values():
+            if not handle.active:
+                continue
+            handle.steps_seen += 1
+            if handle.steps_seen % handle.every:
+                continue
+            if ctx is None:
+                ctx = self._context(conn, session)
+            started = time.perf_counter()
+            try:
+                handle.instance.step(ctx)
+            except Exception as e:
+                # A failing controller is switched off instead of aborting the run.
+                handle.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                handle.timing.add(time.perf_counter() - started)
+
+    @staticmethod
+    def _context(conn: Any, session: Any) -> ControllerContext:
+        ctx = ControllerContext(conn, session)
+        ctx.time = session.vehicle_states.time(conn)
+        ctx.step = session.steps
+        return ctx
+
+    def describe(self) -> List[str]:
+        return [handle.describe() for handle in self.handles.values()]
+
+
+def save_q_tables(path: str, tables: Dict[str, Dict[Tuple[Any, ...], Sequence[float]]], **meta: Any) -> str:
+    """Write per-traffic-light Q-tables ({tls_id: {state tuple: action values}}) as JSON."""
+    data = {
+        "format": Q_TABLE_FORMAT,
+        **meta,
+        "agents": {
+            ts_id: [[[int(x) for x in state], [float(v) for v in values]] for state, values in table.items()]
+            for ts_id, table in tables.items()
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return path
+
+
+def load_q_tables(path: str) -> Tuple[Dict[str, Dict[Tuple[int, ...], List[float]]], Dict[str, Any]]:
+    """Read a file written by `save_q_tables`; returns (tables, meta)."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != Q_TABLE_FORMAT:
+        raise ValueError(f"{path} is not a {Q_TABLE_FORMAT} file")
+    tables = {
+        ts_id: {tuple(int(x) for x in state): list(values) for state, values in rows}
+        for ts_id, rows in data.get("agents", {}).items()
+    }
+    meta = {k: v for k, v in data.items() if k not in ("format", "agents")}
+    return tables, meta
+
+
+# sumo-rl's default observation: gap used to turn lane length into vehicle capacity.
+_MIN_GAP = 2.5
+_LANE_VARS = (tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.LAST_STEP_LENGTH)
+
+
+class _Signal:
+    __slots__ = ("tls_id", "greens", "lanes", "lengths", "green", "last_change", "next_action", "yellow_until")
+
+    def __init__(self, tls_id: str, greens: List[str], lanes: List[str], lengths: List[float]) -> None:
+        self.tls_id = tls_id
+        self.greens = greens
+        self.lanes = lanes
+        self.lengths = lengths
+        self.green = 0
+        self.last_change = 0.0
+        self.next_action = 0.0
+        self.yellow_until: Optional[float] = None
+
+
+class QTableSignalController:
+    """
+    Greedy replay of `run_rl_training` Q-tables on the traffic lights of a live session.
+
+    The observation and its encoding follow sumo-rl's defaults (green phase index, min-green
+    flag, lane densities and queues in tenths); signal state is driven through
+    setRedYellowGreenState with a yellow transition between greens. States missing from a
+    table keep the current green. Lane values come from lane subscriptions.
+    """
+
+    def __init__(
+        self,
+        q_table_file: str,
+        delta_time: Optional[float] = None,
+        yellow_time: Optional[float] = None,
+        min_green: Optional[float] = None,
+        tls_ids: Optional[Sequence[str]] = None,
+    ) -> None:
+        self.tables, meta = load_q_tables(q_table_file)
+        self.delta_time = float(delta_time if delta_time is not None else meta.get("delta_time", 5))
+        self.yellow_time = float(yellow_time if yellow_time is not None else meta.get("yellow_time", 2))
+        self.min_green = float(min_green if min_green is not None else meta.get("min_green", 5))
+        self.tls_ids = list(tls_ids) if tls_ids else list(self.tables)
+        self.signals: List[_Signal] = []
+        self.decisions = 0
+        self.unknown_states = 0
+
+    def setup(self, ctx: ControllerContext) -> None:
+        conn = ctx.conn
+        known = set(conn.trafficlight.getIDList())
+        missing = [t for t in self.tls_ids if t not in known]
+        if missing:
+            raise ValueError(f"Traffic light(s) not in the network: {', '.join(missing)}")
+        for tls_id in self.tls_ids:
+            logic = conn.trafficlight.getAllProgramLogics(tls_id)[0]
+            greens = [p.state for p in logic.phases if "y" not in p.state and ("G" in p.state or "g" in p.state)]
+            if not greens:
+                raise ValueError(f"Traffic light {tls_id} has no green phase")
+            lanes = list(dict.fromkeys(conn.trafficlight.getControlledLanes(tls_id)))
+            lengths = [conn.lane.getLength(lane) for lane in lanes]
+            for lane in lanes:
+                conn.lane.subscribe(lane, _LANE_VARS)
+            signal = _Signal(tls_id, greens, lanes, lengths)
+            signal.last_change = ctx.time
+            signal.next_action = ctx.time + self.delta_time
+            conn.trafficlight.setRedYellowGreenState(tls_id, greens[0])
+            self.signals.append(signal)
+
+    def _observe(self, conn: Any, signal: _Signal, now: float) -> Tuple[int, ...]:
+        min_green = 0 if now - signal.last_change < self.min_green + self.yellow_time else 1
+        results = conn.lane.getAllSubscriptionResults()
+        density, queue = [], []
+        for lane, length in zip(signal.lanes, signal.lengths):
+            values = results.get(lane, {})
+            capacity = length / (_MIN_GAP + values.get(tc.LAST_STEP_LENGTH, 0.0))
+            if capacity <= 0:
+                density.append(0)
+                queue.append(0)
+                continue
+            density.append(min(int(min(1.0, values.get(tc.LAST_STEP_VEHICLE_NUMBER, 0) / capacity) * 10), 9))
+            queue.append(min(int(min(1.0, values.get(tc.LAST_STEP_VEHICLE_HALTING_NUMBER, 0) / capacity) * 10), 9))
+        return tuple([signal.green, min_green] + density + queue)
+
+    def step(self, ctx: ControllerContext) -> None:
+        conn, now = ctx.conn, ctx.time
+        for signal in self.signals:
+            if signal.yellow_until is not None and now >= signal.yellow_until:
+                conn.trafficlight.setRedYellowGreenState(signal.tls_id, signal.greens[signal.green])
+                signal.yellow_until = None
+            if now < signal.next_action:
+                continue
+            signal.next_action = now + self.delta_time
+            values = self.tables[signal.tls_id].get(self._observe(conn, signal, now))
+            self.decisions += 1
+            if values is None:
+                self.unknown_states += 1
+                continue
+            action = max(range(len(values)), key=values.__getitem__)
+            if action == signal.green or action >= len(signal.greens):
+                continue
+            if now - signal.last_change < self.yellow_time + self.min_green:
+                continue
+            current, target = signal.greens[signal.green], signal.greens[action]
+            yellow = "".join(
+                "y" if c in "Gg" and (i >= len(target) or target[i] in "rs") else c for i, c in enumerate(current)
+            )
+            conn.trafficlight.setRedYellowGreenState(signal.tls_id, yellow)
+            signal.green = action
+            signal.last_change = now
+            signal.yellow_until = now + self.yellow_time
+
+    def close(self, ctx: ControllerContext) -> None:
+        for signal in self.signals:
+            for lane in signal.lanes:
+                ctx.conn.lane.unsubscribe(lane)
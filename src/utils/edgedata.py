@@ -0,0 +1,60 @@
+"""
+Streaming aggregation of SUMO edgeData (meandata) output.
+
+`EdgeDataSummary` accumulates per-edge totals over all intervals from expat
+start-element events, so it can be fed a whole file or appended chunks of a
+file that is still being written.
+"""
+
+from __future__ import annotations
+
+import xml.parsers.expat
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class EdgeDataSummary:
+    """Per-edge totals over all edgeData intervals seen so far."""
+
+    def __init__(self) -> None:
+        self.intervals = 0
+        self.last_end: Optional[float] = None
+        self.entered = 0.0
+        # id -> [sampledSeconds, speed * sampledSeconds, waitingTime, timeLoss]
+        self.edges: Dict[str, List[float]] = {}
+
+    def start(self, name: str, attrs: Dict[str, str]) -> None:
+        """expat StartElementHandler."""
+        if name == "interval":
+            self.intervals += 1
+            self.last_end = float(attrs.get("end", "nan"))
+        elif name == "edge":
+            sampled = float(attrs.get("sampledSeconds", 0.0))
+            if sampled <= 0:
+                return
+            acc = self.edges.setdefault(attrs.get("id", ""), [0.0, 0.0, 0.0, 0.0])
+            acc[0] += sampled
+            acc[1] += float(attrs.get("speed", 0.0)) * sampled
+            acc[2] += float(attrs.get("waitingTime", 0.0))
+            acc[3] += float(attrs.get("timeLoss", 0.0))
+            self.entered += float(attrs.get("entered", 0.0)) + float(attrs.get("departed", 0.0))
+
+    def totals(self) -> np.ndarray:
+        """(E, 4) array in `edges` order."""
+        return np.array(list(self.edges.values()), dtype=np.float64).reshape(len(self.edges), 4)
+
+
+def make_edgedata_parser(summary: EdgeDataSummary) -> Any:
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = summary.start
+    return parser
+
+
+def summarize_edgedata(edgedata_file: str) -> EdgeDataSummary:
+    """Stream a complete edgeData file."""
+    summary = EdgeDataSummary()
+    parser = make_edgedata_parser(summary)
+    with open(edgedata_file, "rb") as f:
+        parser.ParseFile(f)
+    return summary
@@ -0,0 +1,403 @@
+"""
+Streaming readers for SUMO FCD (Floating Car Data) output.
+
+The readers are event based (expat) and never build an element tree, so memory
+use is independent of the file size. Parsed records are pushed into a *visitor*
+object that implements `on_timestep(time)` and `on_vehicle(time, attrs)`.
+
+Besides plain XML, gzip-compressed XML/CSV and Parquet output (as written by
+SUMO for `.xml.gz`, `.csv[.gz]` and `.parquet` file names) are detected from the
+file content and stream-decoded into the same visitor calls. Byte-range
+features (parallel parsing, the offset index) apply to plain XML only.
+"""
+
+from __future__ import annotations
+
+import codecs
+import csv
+import gzip
+import io
+import logging
+import multiprocessing
+import os
+import xml.parsers.expat
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple, TypeVar
+
+from utils.stats import QuantileSketch, RunningStats
+
+logger = logging.getLogger(__name__)
+
+FCD_READ_CHUNK_BYTES = int(os.environ.get("SUMO_MCP_FCD_CHUNK_BYTES", str(1 << 20)))
+# Files smaller than this are always parsed serially (process start-up would dominate).
+FCD_PARALLEL_MIN_BYTES = int(os.environ.get("SUMO_MCP_FCD_PARALLEL_MIN_BYTES", str(64 << 20)))
+# Default worker count for parallel parsing; 0 means "one per CPU".
+DEFAULT_FCD_WORKERS = int(os.environ.get("SUMO_MCP_FCD_WORKERS", "0"))
+# Ranges per worker, so that uneven timesteps still balance across the pool.
+_RANGES_PER_WORKER = 4
+
+_TIMESTEP_OPEN = b"<timestep"
+_TIMESTEP_CLOSE = b"</timestep>"
+_EXPORT_CLOSE = b"</fcd-export"
+
+R = TypeVar("R")
+
+# Output formats SUMO selects from the file name, and the suffix that requests each.
+FCD_OUTPUT_FORMATS: Dict[str, str] = {
+    "xml": ".xml",
+    "xml.gz": ".xml.gz",
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "parquet": ".parquet",
+}
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_PARQUET_MAGIC = b"PAR1"
+# Column-header prefixes SUMO uses for flattened FCD output (`--output.column-header tag`).
+_CSV_PREFIXES = ("timestep_", "vehicle_")
+
+
+class FCDVisitor(Protocol):
+    def on_timestep(self, time: float) -> None: ...
+
+    def on_vehicle(self, time: float, attrs: Dict[str, str]) -> None: ...
+
+
+class FCDSpeedSummary:
+    """Constant-memory speed statistics over all `<vehicle>` records of an FCD file."""
+
+    def __init__(self) -> None:
+        self.speed = RunningStats()
+        self.sketch = QuantileSketch()
+        self.timesteps = 0
+        self.first_time: Optional[float] = None
+        self.last_time: Optional[float] = None
+
+    def on_timestep(self, time: float) -> None:
+        self.timesteps += 1
+        if self.first_time is None:
+            self.first_time = time
+        self.last_time = time
+
+    def on_vehicle(self, time: float, attrs: Dict[str, str]) -> None:
+        raw = attrs.get("speed")
+        if raw is None:
+            return
+        value = float(raw)
+        self.speed.add(value)
+        self.sketch.add(value)
+
+    def merge(self, other: "FCDSpeedSummary") -> None:
+        self.speed.merge(other.speed)
+        self.sketch.merge(other.sketch)
+        self.timesteps += other.timesteps
+        if other.first_time is not None and (self.first_time is None or other.first_time < self.first_time):
+            self.first_time = other.first_time
+        if other.last_time is not None and (self.last_time is None or other.last_time > self.last_time):
+            self.last_time = other.last_time
+
+
+def make_fcd_parser(visitor: FCDVisitor) -> Any:
+    parser = xml.parsers.expat.ParserCreate()
+    current_time = 0.0
+
+    def _start(name: str, attrs: Dict[str, str]) -> None:
+        nonlocal current_time
+        if name == "vehicle":
+            visitor.on_vehicle(current_time, attrs)
+        elif name == "timestep":
+            current_time = float(attrs.get("time", 0.0))
+            visitor.on_timestep(current_time)
+
+    parser.StartElementHandler = _start
+    return parser
+
+
+def fcd_output_path(directory: str, stem: str, output_format: str = "xml") -> str:
+    """Return the FCD output path that makes SUMO write `output_format`."""
+    suffix = FCD_OUTPUT_FORMATS.get(output_format)
+    if suffix is None:
+        raise ValueError(f"Unknown FCD output format {output_format!r}; expected one of {list(FCD_OUTPUT_FORMATS)}")
+    return os.path.join(directory, stem + suffix)
+
+
+def detect_fcd_format(fcd_file: str) -> str:
+    """Detect the format of an FCD file from its content: one of `FCD_OUTPUT_FORMATS`."""
+    with open(fcd_file, "rb") as f:
+        magic = f.read(4)
+    if magic == _PARQUET_MAGIC:
+        return "parquet"
+
+    compressed = magic[:2] == _GZIP_MAGIC
+    opener = gzip.open if compressed else open
+    with opener(fcd_file, "rb") as f:
+        head = f.read(4096).lstrip(codecs.BOM_UTF8).lstrip()
+    kind = "xml" if head.startswith(b"<") else "csv"
+    return kind + ".gz" if compressed else kind
+
+
+def _feed_xml(stream: Any, visitor: FCDVisitor, chunk_size: int) -> int:
+    parser = make_fcd_parser(visitor)
+    bytes_read = 0
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        bytes_read += len(data)
+        parser.Parse(data, False)
+    parser.Parse(b"", True)
+    return bytes_read
+
+
+def _normalize_column(name: str) -> str:
+    name = name.strip()
+    for prefix in _CSV_PREFIXES:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def _feed_csv(stream: Any, visitor: FCDVisitor) -> None:
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    header_line = text.readline()
+    if not header_line:
+        return
+    delimiter = max(";,\t", key=header_line.count)
+    columns = [_normalize_column(c) for c in next(csv.reader([header_line], delimiter=delimiter))]
+    if "time" not in columns:
+        raise ValueError("CSV FCD output must have a time column (e.g. 'timestep_time')")
+    time_idx = columns.index("time")
+    id_idx = columns.index("id") if "id" in columns else -1
+
+    current_time: Optional[float] = None
+    for row in csv.reader(text, delimiter=delimiter):
+        if not row:
+            continue
+        t = float(row[time_idx])
+        if t != current_time:
+            current_time = t
+            visitor.on_timestep(t)
+        if id_idx >= 0 and id_idx < len(row) and row[id_idx]:
+            visitor.on_vehicle(t, {c: v for c, v in zip(columns, row) if v != ""})
+
+
+def _feed_parquet(fcd_file: str, visitor: FCDVisitor) -> None:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError("Reading Parquet FCD output requires `pyarrow` (pip install pyarrow).") from exc
+
+    pf = pq.ParquetFile(fcd_file)
+    names = pf.schema_arrow.names
+    columns = [_normalize_column(n) for n in names]
+    if "time" not in columns:
+        raise ValueError("Parquet FCD output must have a time column (e.g. 'timestep_time')")
+
+    current_time: Optional[float] = None
+    for batch in pf.iter_batches():
+        data = batch.to_pydict()
+        for values in zip(*(data[n] for n in names)):
+            row = dict(zip(columns, values))
+            t = float(row["time"])
+            if t != current_time:
+                current_time = t
+                visitor.on_timestep(t)
+            if row.get("id") is not None:
+                visitor.on_vehicle(t, {c: v for c, v in row.items() if v is not None})
+
+
+def scan_fcd(fcd_file: str, visitor: FCDVisitor, chunk_size: int = FCD_READ_CHUNK_BYTES) -> int:
+    """
+    Stream an FCD file (XML, gzip XML/CSV, CSV or Parquet) through `visitor`.
+
+    Returns:
+        The number of bytes read from disk.
+    """
+    fmt = detect_fcd_format(fcd_file)
+    if fmt == "xml":
+        with open(fcd_file, "rb") as f:
+            return _feed_xml(f, visitor, chunk_size)
+
+    if fmt == "parquet":
+        _feed_parquet(fcd_file, visitor)
+    else:
+        opener = gzip.open if fmt.endswith(".gz") else open
+        with opener(fcd_file, "rb") as f:
+            if fmt.startswith("xml"):
+                _feed_xml(f, visitor, chunk_size)
+            else:
+                _feed_csv(f, visitor)
+    return os.path.getsize(fcd_file)
+
+
+def scan_fcd_range(
+    fcd_file: str,
+    visitor: FCDVisitor,
+    start: int,
+    end: int,
+    chunk_size: int = FCD_READ_CHUNK_BYTES,
+) -> int:
+    """
+    Stream the byte range [start, end) of an FCD file through `visitor`.
+
+    The range must contain only complete `<timestep>` elements (see
+    `split_fcd_ranges`); it is wrapped in a synthetic root element for parsing.
+
+    Returns:
+        The number of bytes read.
+    """
+    parser = make_fcd_parser(visitor)
+    parser.Parse(b"<fcd-range>", False)
+
+    remaining = end - start
+    with open(fcd_file, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            parser.Parse(data, False)
+    parser.Parse(b"</fcd-range>", True)
+    return end - start - remaining
+
+
+def _find_timestep_start(f: Any, offset: int, limit: int, block_size: int = 1 << 16) -> int:
+    """Return the offset of the first `<timestep` start tag at or after `offset`, or -1."""
+    overlap = len(_TIMESTEP_OPEN)
+    pos = offset
+    while pos < limit:
+        f.seek(pos)
+        block: bytes = f.read(min(block_size, limit - pos) + overlap)
+        if not block:
+            return -1
+        idx = block.find(_TIMESTEP_OPEN)
+        while idx != -1:
+            following = block[idx + overlap:idx + overlap + 1]
+            if following and following in b" \t\r\n/>":
+                return pos + idx
+            idx = block.find(_TIMESTEP_OPEN, idx + 1)
+        pos += block_size
+    return -1
+
+
+def split_fcd_ranges(fcd_file: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Split an FCD file into at most `parts` byte ranges on `<timestep>` boundaries.
+
+    Returns an empty list if the file contains no timesteps.
+    """
+    size = os.path.getsize(fcd_file)
+    with open(fcd_file, "rb") as f:
+        head = f.read(min(size, 1 << 20))
+        root = head.find(b"<fcd-export")
+        if root == -1:
+            return []
+        first = _find_timestep_start(f, root, size)
+        if first == -1:
+            return []
+
+        tail_start = max(first, size - (1 << 20))
+        f.seek(tail_start)
+        tail = f.read()
+        # The last range runs up to </fcd-export>, so it keeps trailing empty `<timestep .../>`
+        # elements and ends where a serial parse ends; files still being written end at the
+        # last complete timestep instead.
+        export_close = tail.rfind(_EXPORT_CLOSE)
+        if export_close != -1:
+            end = tail_start + export_close
+        else:
+            last_close = tail.rfind(_TIMESTEP_CLOSE)
+            if last_close == -1:
+                return []
+            end = tail_start + last_close + len(_TIMESTEP_CLOSE)
+
+        boundaries = [first]
+        for i in range(1, max(1, parts)):
+            target = first + (end - first) * i // parts
+            if target <= boundaries[-1]:
+                continue
+            pos = _find_timestep_start(f, target, end)
+            if pos == -1:
+                break
+            if pos > boundaries[-1]:
+                boundaries.append(pos)
+        boundaries.append(end)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def resolve_fcd_workers(fcd_file: str, workers: Optional[int] = None) -> int:
+    """Return the worker count to use for `fcd_file` (1 means serial)."""
+    if workers is None:
+        workers = DEFAULT_FCD_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return 1
+    try:
+        if os.path.getsize(fcd_file) < FCD_PARALLEL_MIN_BYTES:
+            return 1
+        # Only plain XML can be split on byte boundaries.
+        if detect_fcd_format(fcd_file) != "xml":
+            return 1
+    except OSError:
+        return 1
+    return workers
+
+
+def map_fcd_ranges(
+    fcd_file: str,
+    func: Callable[..., R],
+    workers: int,
+    extra_args: Tuple[Any, ...] = (),
+) -> Optional[List[R]]:
+    """
+    Run `func(fcd_file, start, end, index, *extra_args)` for each timestep range in a process pool.
+
+    `func` must be a picklable module-level function. Results are returned in
+    file order, or None if the file cannot be split (callers then fall back
+    to the serial path).
+    """
+    ranges = split_fcd_ranges(fcd_file, workers * _RANGES_PER_WORKER)
+    if len(ranges) < 2:
+        return None
+
+    # Spawn, not fork: the server runs threads (e.g. the MCP stdin reader) whose locks a forked
+    # child would inherit held, hanging it before it runs any work.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as pool:
+        futures = [
+            pool.submit(func, fcd_file, start, end, index, *extra_args)
+            for index, (start, end) in enumerate(ranges)
+        ]
+        return [future.result() for future in futures]
+
+
+def _summarize_range(fcd_file: str, start: int, end: int, index: int) -> Tuple[FCDSpeedSummary, int]:
+    summary = FCDSpeedSummary()
+    bytes_read = scan_fcd_range(fcd_file, summary, start, end)
+    return summary, bytes_read
+
+
+def summarize_fcd_speeds(fcd_file: str, workers: Optional[int] = None) -> Tuple[FCDSpeedSummary, int]:
+    """
+    Compute the speed summary of an FCD file, in parallel when worthwhile.
+
+    Returns:
+        (summary, bytes_read)
+    """
+    resolved = resolve_fcd_workers(fcd_file, workers)
+    if resolved > 1:
+        partials = map_fcd_ranges(fcd_file, _summarize_range, resolved)
+        if partials is not None:
+            summary = FCDSpeedSummary()
+            bytes_read = 0
+            for partial, n_bytes in partials:
+                summary.merge(partial)
+                bytes_read += n_bytes
+            return summary, bytes_read
+        logger.debug("Could not split %s into timestep ranges; parsing serially", fcd_file)
+
+    summary = FCDSpeedSummary()
+    return summary, scan_fcd(fcd_file, summary)
@@ -0,0 +1,297 @@
+"""
+Edge x time-bin aggregate cube built from the columnar FCD store.
+
+The cube holds, per (edge, time bin), the number of FCD records and their
+speed sum. Mean speed, vehicle-seconds and density follow from these with
+vectorized array operations, so "where and when was it congested?" questions
+never touch the raw FCD again. Cubes are cached next to the FCD file as
+`<fcd_file>.cube-<bin>s.npz` and invalidated with the source (path/size/mtime).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import xml.parsers.expat
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.fcd_store import FCDStore, default_store_path, fcd_source_key, load_fcd_store
+
+logger = logging.getLogger(__name__)
+
+FCD_CUBE_VERSION = 2
+DEFAULT_BIN_SECONDS = 300.0
+_CHUNK_ROWS = 1 << 22
+# Dense edge x bin cells (an int64 count plus a float64 speed sum each, ~1 GiB at the limit).
+_MAX_CUBE_CELLS = 1 << 26
+# Grid extent in cells; the heatmap itself is sparse, this only refuses absurd resolutions.
+_MAX_GRID_CELLS = 1 << 32
+
+
+@dataclass
+class EdgeTimeCube:
+    """Dense edge x time-bin aggregates of one FCD file."""
+
+    edges: np.ndarray           # (E,) edge ids
+    t_begin: float              # start time of bin 0
+    bin_seconds: float
+    step_length: float          # simulation step length inferred from the FCD timesteps
+    count: np.ndarray           # (E, B) number of FCD records
+    speed_sum: np.ndarray       # (E, B) sum of record speeds
+    edge_length: np.ndarray     # (E,) metres, NaN when unknown
+
+    @property
+    def n_bins(self) -> int:
+        return int(self.count.shape[1])
+
+    def bin_starts(self) -> np.ndarray:
+        return self.t_begin + self.bin_seconds * np.arange(self.n_bins)
+
+    def vehicle_seconds(self) -> np.ndarray:
+        return self.count * self.step_length
+
+    def mean_speed(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.speed_sum / self.count, np.nan)
+
+    def density(self) -> np.ndarray:
+        """Average vehicles per km in each (edge, bin); NaN where the edge length is unknown."""
+        vehicles = self.vehicle_seconds() / self.bin_seconds
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return vehicles / (self.edge_length[:, None] / 1000.0)
+
+    def bins_between(self, t0: Optional[float], t1: Optional[float]) -> slice:
+        lo = 0 if t0 is None else max(0, int((t0 - self.t_begin) // self.bin_seconds))
+        hi = self.n_bins if t1 is None else min(self.n_bins, int((t1 - self.t_begin) // self.bin_seconds) + 1)
+        return slice(lo, max(lo, hi))
+
+    def edge_totals(self, bins: slice = slice(None)) -> Tuple[np.ndarray, np.ndarray]:
+        """Return per-edge (vehicle_seconds, mean_speed) over the selected bins."""
+        count = self.count[:, bins].sum(axis=1)
+        speed_sum = self.speed_sum[:, bins].sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, speed_sum / count, np.nan)
+        return count * self.step_length, mean
+
+
+def read_edge_lengths(net_file: str) -> Dict[str, float]:
+    """Read edge lengths (first lane length) from a SUMO `.net.xml` without building a net object."""
+    lengths: Dict[str, float] = {}
+    current: Optional[str] = None
+
+    def _start(name: str, attrs: Dict[str, str]) -> None:
+        nonlocal current
+        if name == "edge":
+            current = attrs.get("id")
+        elif name == "lane" and current is not None and current not in lengths:
+            try:
+                lengths[current] = float(attrs.get("length", "nan"))
+            except ValueError:
+                pass
+
+    def _end(name: str) -> None:
+        nonlocal current
+        if name == "edge":
+            current = None
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = _start
+    parser.EndElementHandler = _end
+    with open(net_file, "rb") as f:
+        parser.ParseFile(f)
+    return lengths
+
+
+def _infer_step_length(store: FCDStore) -> float:
+    times = store.column("time")
+    sample = np.unique(np.asarray(times[: min(store.rows, _CHUNK_ROWS)]))
+    if sample.size < 2:
+        return 1.0
+    return float(np.median(np.diff(sample)))
+
+
+def build_edge_time_cube(
+    store: FCDStore,
+    bin_seconds: float = DEFAULT_BIN_SECONDS,
+    edge_lengths: Optional[Dict[str, float]] = None,
+) -> EdgeTimeCube:
+    """Aggregate the store into an edge x time-bin cube (chunked bincount over the columns).
+
+    Records without a finite speed are left out of both the counts and the speed sums.
+    """
+    if bin_seconds <= 0:
+        raise ValueError("bin_seconds must be > 0")
+    n_edges = len(store.edges)
+    time_col = store.column("time")
+    t_begin = float(time_col[0]) if store.rows else 0.0
+    t_end = float(time_col[-1]) if store.rows else 0.0
+    n_bins = int((t_end - t_begin) // bin_seconds) + 1
+    if n_edges * n_bins > _MAX_CUBE_CELLS:
+        raise ValueError(
+            f"bin_seconds {bin_seconds:g} gives {n_edges} edges x {n_bins} bins, more than "
+            f"{_MAX_CUBE_CELLS} cells; use larger bins"
+        )
+
+    count = np.zeros(n_edges * n_bins, dtype=np.int64)
+    speed_sum = np.zeros(n_edges * n_bins, dtype=np.float64)
+    edge_col = store.column("edge")
+    speed_col = store.column("speed")
+    for start in range(0, store.rows, _CHUNK_ROWS):
+        stop = start + _CHUNK_ROWS
+        speed = np.asarray(speed_col[start:stop])
+        mask = np.isfinite(speed)
+        bins = ((np.asarray(time_col[start:stop])[mask] - t_begin) // bin_seconds).astype(np.int64)
+        flat = np.asarray(edge_col[start:stop], dtype=np.int64)[mask] * n_bins + bins
+        count += np.bincount(flat, minlength=count.size)
+        speed_sum += np.bincount(flat, weights=speed[mask], minlength=speed_sum.size)
+
+    lengths = edge_lengths or {}
+    return EdgeTimeCube(
+        edges=np.array(store.edges, dtype=object),
+        t_begin=t_begin,
+        bin_seconds=float(bin_seconds),
+        step_length=_infer_step_length(store),
+        count=count.reshape(n_edges, n_bins),
+        speed_sum=speed_sum.reshape(n_edges, n_bins),
+        edge_length=np.array([lengths.get(e, np.nan) for e in store.edges], dtype=np.float64),
+    )
+
+
+def _cube_path(fcd_file: str, bin_seconds: float) -> str:
+    return default_store_path(fcd_file, f".cube-{bin_seconds:g}s.npz")
+
+
+def _save_cube(path: str, cube: EdgeTimeCube, key: Dict[str, object], net_file: Optional[str]) -> None:
+    meta = dict(key)
+    meta.update({"version": FCD_CUBE_VERSION, "net_file": os.path.abspath(net_file) if net_file else None})
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        meta=np.array(json.dumps(meta)),
+        edges=cube.edges.astype(str),
+        scalars=np.array([cube.t_begin, cube.bin_seconds, cube.step_length]),
+        count=cube.count,
+        speed_sum=cube.speed_sum,
+        edge_length=cube.edge_length,
+    )
+    os.replace(tmp_path, path)
+
+
+def _load_cube(path: str, key: Dict[str, object], net_file: Optional[str]) -> Optional[EdgeTimeCube]:
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            expected_net = os.path.abspath(net_file) if net_file else None
+            if meta.get("version") != FCD_CUBE_VERSION:
+                return None
+            # A cube without edge lengths cannot answer density queries; any cube serves the rest.
+            if expected_net is not None and meta.get("net_file") != expected_net:
+                return None
+            if any(meta.get(k) != v for k, v in key.items()):
+                return None
+            t_begin, bin_seconds, step_length = (float(v) for v in data["scalars"])
+            return EdgeTimeCube(
+                edges=data["edges"].astype(object),
+                t_begin=t_begin,
+                bin_seconds=bin_seconds,
+                step_length=step_length,
+                count=data["count"],
+                speed_sum=data["speed_sum"],
+                edge_length=data["edge_length"],
+            )
+    except (OSError, ValueError, KeyError) as exc:
+        logger.debug("Ignoring unreadable FCD cube %s: %s", path, exc)
+        return None
+
+
+def load_edge_time_cube(
+    fcd_file: str,
+    bin_seconds: float = DEFAULT_BIN_SECONDS,
+    net_file: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> EdgeTimeCube:
+    """Return the cached cube for `fcd_file`, building store and cube on first use or when stale."""
+    if bin_seconds <= 0:
+        raise ValueError("bin_seconds must be > 0")
+    key = fcd_source_key(fcd_file)
+    path = _cube_path(fcd_file, bin_seconds)
+    if os.path.exists(path):
+        cube = _load_cube(path, key, net_file)
+        if cube is not None:
+            return cube
+
+    store = load_fcd_store(fcd_file, workers=workers)
+    lengths = read_edge_lengths(net_file) if net_file else None
+    cube = build_edge_time_cube(store, bin_seconds, lengths)
+    try:
+        _save_cube(path, cube, key, net_file)
+    except OSError as exc:
+        logger.warning("Could not cache FCD cube at %s: %s", path, exc)
+    return cube
+
+
+def build_grid_heatmap(
+    store: FCDStore,
+    cell_size: float,
+    t0: Optional[float] = None,
+    t1: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, int, float, float]:
+    """
+    Aggregate FCD records onto a regular x/y grid, keeping only the non-empty cells.
+
+    Cells are accumulated sparsely, so memory follows the number of occupied cells
+    rather than the grid extent (a fine grid over a large network stays cheap).
+    Records without a position or a finite speed are skipped.
+
+    Returns:
+        (cells, count, speed_sum, nx, ny, x_origin, y_origin) where `cells` are the sorted
+        flat indices (iy * nx + ix) of the non-empty cells and `count`/`speed_sum` align with them.
+    """
+    if cell_size <= 0:
+        raise ValueError("cell_size must be > 0")
+    x_col, y_col = store.column("x"), store.column("y")
+    time_col, speed_col = store.column("time"), store.column("speed")
+    empty = np.zeros(0, dtype=np.int64)
+    if store.rows == 0:
+        return empty, empty, np.zeros(0), 0, 0, 0.0, 0.0
+
+    x0, x1 = float(np.nanmin(x_col)), float(np.nanmax(x_col))
+    y0, y1 = float(np.nanmin(y_col)), float(np.nanmax(y_col))
+    nx = int((x1 - x0) // cell_size) + 1
+    ny = int((y1 - y0) // cell_size) + 1
+    if nx * ny > _MAX_GRID_CELLS:
+        raise ValueError(
+            f"cell_size {cell_size:g} m is too small for a {x1 - x0:.0f} x {y1 - y0:.0f} m extent "
+            f"({nx * ny} cells, at most {_MAX_GRID_CELLS})"
+        )
+
+    cells: np.ndarray = empty
+    count: np.ndarray = empty
+    speed_sum: np.ndarray = np.zeros(0)
+    for start in range(0, store.rows, _CHUNK_ROWS):
+        stop = start + _CHUNK_ROWS
+        x = np.asarray(x_col[start:stop])
+        y = np.asarray(y_col[start:stop])
+        speed = np.asarray(speed_col[start:stop])
+        mask = ~(np.isnan(x) | np.isnan(y)) & np.isfinite(speed)
+        if t0 is not None or t1 is not None:
+            t = np.asarray(time_col[start:stop])
+            if t0 is not None:
+                mask &= t >= t0
+            if t1 is not None:
+                mask &= t <= t1
+        ix = ((x[mask] - x0) // cell_size).astype(np.int64)
+        iy = ((y[mask] - y0) // cell_size).astype(np.int64)
+        flat = np.concatenate([cells, iy * nx + ix])
+        weights = np.concatenate([speed_sum, speed[mask]])
+        counts = np.concatenate([count, np.ones(ix.size, dtype=np.int64)])
+        # Merge this chunk into the running per-cell totals.
+        cells, inverse = np.unique(flat, return_inverse=True)
+        count = np.bincount(inverse, weights=counts, minlength=cells.size).astype(np.int64)
+        speed_sum = np.bincount(inverse, weights=weights, minlength=cells.size)
+
+    return cells, count, speed_sum, nx, ny, x0, y0
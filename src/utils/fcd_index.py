@@ -0,0 +1,322 @@
+"""
+Sidecar byte-offset index over FCD output.
+
+The index maps every `<timestep>` to its byte offset in the FCD file and every
+vehicle id to the runs of timestep indices in which it appears. Time-window and
+per-vehicle queries then seek straight to the relevant byte ranges instead of
+scanning the whole file.
+
+Layout of `<fcd_file>.fcdindex/`:
+    meta.json       source key (path, size, mtime) and timestep count
+    times.npy       float64 time of each timestep
+    offsets.npy     int64 byte offset of each timestep, plus the end offset
+    vehicles.json   {vehicle_id: [[first_step, last_step], ...]}
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import xml.parsers.expat
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.fcd import (
+    FCD_READ_CHUNK_BYTES,
+    FCDVisitor,
+    detect_fcd_format,
+    map_fcd_ranges,
+    resolve_fcd_workers,
+    scan_fcd_range,
+)
+from utils.fcd_store import default_store_path, fcd_source_key
+from utils.stats import RunningStats
+
+FCD_INDEX_VERSION = 1
+FCD_INDEX_SUFFIX = ".fcdindex"
+
+_RANGE_ROOT = b"<fcd-range>"
+
+# Opened indexes by index path, least recently used first, with the FCD file each belongs to.
+FCD_INDEX_CACHE_SIZE = int(os.environ.get("SUMO_MCP_FCD_INDEX_CACHE_SIZE", "16"))
+_cache_lock = threading.Lock()
+_cache: "OrderedDict[str, Tuple[str, FCDIndex]]" = OrderedDict()
+
+
+class _IndexBuilder:
+    """Expat handlers recording timestep offsets and per-vehicle timestep runs."""
+
+    def __init__(self, parser: Any, base_offset: int) -> None:
+        self.parser = parser
+        self.base_offset = base_offset
+        self.times = array("d")
+        self.offsets = array("q")
+        self.runs: Dict[str, List[List[int]]] = {}
+        self.end_offset: Optional[int] = None
+        self._step = -1
+
+    def start(self, name: str, attrs: Dict[str, str]) -> None:
+        if name == "vehicle":
+            vehicle_id = attrs.get("id", "")
+            runs = self.runs.get(vehicle_id)
+            if runs is None:
+                self.runs[vehicle_id] = [[self._step, self._step]]
+            elif runs[-1][1] >= self._step - 1:
+                runs[-1][1] = self._step
+            else:
+                runs.append([self._step, self._step])
+        elif name == "timestep":
+            self._step += 1
+            self.times.append(float(attrs.get("time", 0.0)))
+            self.offsets.append(self.base_offset + self.parser.CurrentByteIndex)
+
+    def end(self, name: str) -> None:
+        if name == "fcd-export":
+            self.end_offset = self.base_offset + self.parser.CurrentByteIndex
+
+
+def _index_stream(fcd_file: str, start: int, end: Optional[int]) -> _IndexBuilder:
+    parser = xml.parsers.expat.ParserCreate()
+    wrapped = end is not None
+    builder = _IndexBuilder(parser, start - len(_RANGE_ROOT) if wrapped else 0)
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+
+    if wrapped:
+        parser.Parse(_RANGE_ROOT, False)
+    with open(fcd_file, "rb") as f:
+        f.seek(start)
+        remaining = (end - start) if end is not None else None
+        while remaining is None or remaining > 0:
+            size = FCD_READ_CHUNK_BYTES if remaining is None else min(FCD_READ_CHUNK_BYTES, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            parser.Parse(data, False)
+    parser.Parse(b"</fcd-range>" if wrapped else b"", True)
+
+    if wrapped:
+        builder.end_offset = end
+    return builder
+
+
+_IndexPart = Tuple["array[float]", "array[int]", Dict[str, List[List[int]]], int]
+
+
+def _index_range(fcd_file: str, start: int, end: int, index: int) -> _IndexPart:
+    """Process-pool worker: index one timestep range."""
+    builder = _index_stream(fcd_file, start, end)
+    return builder.times, builder.offsets, builder.runs, end
+
+
+class FCDIndex:
+    """Loaded sidecar index (arrays are memory-mapped)."""
+
+    def __init__(self, path: str, meta: Dict[str, Any]) -> None:
+        self.path = path
+        self.meta = meta
+        self.times: np.ndarray = np.load(os.path.join(path, "times.npy"), mmap_mode="r")
+        self.offsets: np.ndarray = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._vehicles: Optional[Dict[str, List[List[int]]]] = None
+
+    @classmethod
+    def open(cls, path: str) -> "FCDIndex":
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(path, meta)
+
+    @property
+    def vehicles(self) -> Dict[str, List[List[int]]]:
+        if self._vehicles is None:
+            with open(os.path.join(self.path, "vehicles.json"), "r", encoding="utf-8") as f:
+                self._vehicles = json.load(f)
+        return self._vehicles
+
+    @property
+    def timesteps(self) -> int:
+        return int(self.times.shape[0])
+
+    def matches(self, fcd_file: str) -> bool:
+        try:
+            key = fcd_source_key(fcd_file)
+        except OSError:
+            return False
+        return self.meta.get("version") == FCD_INDEX_VERSION and all(self.meta.get(k) == v for k, v in key.items())
+
+    def steps_between(self, t0: float, t1: float) -> Tuple[int, int]:
+        """Return the half-open timestep index range whose times fall in [t0, t1]."""
+        lo = int(np.searchsorted(self.times, t0, side="left"))
+        hi = int(np.searchsorted(self.times, t1, side="right"))
+        return lo, hi
+
+    def byte_range(self, first_step: int, stop_step: int) -> Tuple[int, int]:
+        """Return the byte range covering timesteps [first_step, stop_step)."""
+        return int(self.offsets[first_step]), int(self.offsets[stop_step])
+
+    def vehicle_runs(self, vehicle_id: str) -> List[Tuple[int, int]]:
+        """Return the half-open timestep ranges in which `vehicle_id` appears."""
+        return [(first, last + 1) for first, last in self.vehicles.get(vehicle_id, [])]
+
+
+def build_fcd_index(fcd_file: str, index_path: Optional[str] = None, workers: Optional[int] = None) -> FCDIndex:
+    """Index `fcd_file` (in parallel for large files) and atomically write the sidecar."""
+    fmt = detect_fcd_format(fcd_file)
+    if fmt != "xml":
+        raise ValueError(f"Byte-offset index requires plain XML FCD output, got {fmt!r}")
+    path = index_path or default_store_path(fcd_file, FCD_INDEX_SUFFIX)
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    key = fcd_source_key(fcd_file)
+
+    parts = None
+    resolved = resolve_fcd_workers(fcd_file, workers)
+    if resolved > 1:
+        parts = map_fcd_ranges(fcd_file, _index_range, resolved)
+    if parts is None:
+        builder = _index_stream(fcd_file, 0, None)
+        end_offset = builder.end_offset if builder.end_offset is not None else key["size"]
+        parts = [(builder.times, builder.offsets, builder.runs, end_offset)]
+
+    times = array("d")
+    offsets = array("q")
+    runs: Dict[str, List[List[int]]] = {}
+    for part_times, part_offsets, part_runs, _ in parts:
+        shift = len(times)
+        for vehicle_id, vehicle_runs in part_runs.items():
+            merged = runs.setdefault(vehicle_id, [])
+            for first, last in vehicle_runs:
+                if merged and merged[-1][1] == first + shift - 1:
+                    merged[-1][1] = last + shift
+                else:
+                    merged.append([first + shift, last + shift])
+        times.extend(part_times)
+        offsets.extend(part_offsets)
+    offsets.append(parts[-1][3])
+
+    tmp_dir = tempfile.mkdtemp(prefix=".fcdindex-", dir=parent)
+    try:
+        np.save(os.path.join(tmp_dir, "times.npy"), np.frombuffer(times, dtype=np.float64))
+        np.save(os.path.join(tmp_dir, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+        with open(os.path.join(tmp_dir, "vehicles.json"), "w", encoding="utf-8") as f:
+            json.dump(runs, f)
+        meta = dict(key)
+        meta.update({"version": FCD_INDEX_VERSION, "timesteps": len(times), "vehicles": len(runs)})
+        # meta.json is written last: an index without it is never considered valid.
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_dir, path)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return FCDIndex.open(path)
+
+
+def load_fcd_index(fcd_file: str, rebuild: bool = False, workers: Optional[int] = None) -> FCDIndex:
+    """Return a valid index for `fcd_file` (cached in-process), building it when missing or stale."""
+    path = default_store_path(fcd_file, FCD_INDEX_SUFFIX)
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None:
+            _cache.move_to_end(path)
+    cached = entry[1] if entry is not None else None
+    if cached is not None and not rebuild and cached.matches(fcd_file):
+        return cached
+
+    index: Optional[FCDIndex] = None
+    if not rebuild and os.path.isdir(path):
+        try:
+            index = FCDIndex.open(path)
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is not None and not index.matches(fcd_file):
+            index = None
+    if index is None:
+        index = build_fcd_index(fcd_file, path, workers=workers)
+
+    with _cache_lock:
+        _cache[path] = (fcd_file, index)
+        _cache.move_to_end(path)
+        for key, (source, _) in list(_cache.items()):
+            if not os.path.exists(source):
+                del _cache[key]
+        while len(_cache) > max(1, FCD_INDEX_CACHE_SIZE):
+            _cache.popitem(last=False)
+    return index
+
+
+class RecordCollector:
+    """Visitor keeping the first `limit` matching records and summarizing all of them."""
+
+    def __init__(self, vehicle_id: Optional[str], limit: int) -> None:
+        self.vehicle_id = vehicle_id
+        self.limit = limit
+        self.records: List[Tuple[float, Dict[str, str]]] = []
+        self.speed = RunningStats()
+        self.vehicle_ids: set[str] = set()
+        self.timesteps = 0
+        self.first_time: Optional[float] = None
+        self.last_time: Optional[float] = None
+
+    @property
+    def matched(self) -> int:
+        return self.speed.count
+
+    def on_timestep(self, time: float) -> None:
+        self.timesteps += 1
+
+    def on_vehicle(self, time: float, attrs: Dict[str, str]) -> None:
+        vehicle_id = attrs.get("id", "")
+        if self.vehicle_id is not None and vehicle_id != self.vehicle_id:
+            return
+        self.speed.add(float(attrs.get("speed", 0.0)))
+        self.vehicle_ids.add(vehicle_id)
+        if self.first_time is None:
+            self.first_time = time
+        self.last_time = time
+        if len(self.records) < self.limit:
+            self.records.append((time, attrs))
+
+
+def iter_indexed_ranges(
+    fcd_file: str,
+    index: FCDIndex,
+    step_ranges: List[Tuple[int, int]],
+    visitor: FCDVisitor,
+) -> Iterator[int]:
+    """Parse only the byte ranges of the given timestep ranges; yields bytes read per range."""
+    for first, stop in step_ranges:
+        if stop <= first:
+            continue
+        start, end = index.byte_range(first, stop)
+        yield scan_fcd_range(fcd_file, visitor, start, end)
+
+
+def query_records(
+    fcd_file: str,
+    step_ranges: List[Tuple[int, int]],
+    vehicle_id: Optional[str] = None,
+    limit: int = 1000,
+    index: Optional[FCDIndex] = None,
+) -> Tuple[RecordCollector, int]:
+    """
+    Collect `<vehicle>` records within the given timestep ranges via the index.
+
+    Returns:
+        (collector, bytes_read)
+    """
+    index = index or load_fcd_index(fcd_file)
+    collector = RecordCollector(vehicle_id, limit)
+    bytes_read = sum(iter_indexed_ranges(fcd_file, index, step_ranges, collector))
+    return collector, bytes_read
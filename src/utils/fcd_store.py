@@ -0,0 +1,400 @@
+"""
+Columnar on-disk store for FCD output.
+
+An FCD file is converted once into one raw binary file per column (loaded as
+read-only `numpy.memmap`) plus a JSON string dictionary for vehicle/lane/edge
+ids. The store remembers the source path, size and mtime; any change to the
+source invalidates it automatically and the next access rebuilds it.
+
+Layout of `<store>/`:
+    meta.json       source key, row count, column dtypes
+    strings.json    {"vehicle": [...], "lane": [...], "edge": [...]}
+    <column>.bin    raw little-endian column data
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from array import array
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import numpy as np
+
+from utils.fcd import FCDSpeedSummary, FCDVisitor, map_fcd_ranges, resolve_fcd_workers, scan_fcd, scan_fcd_range
+
+logger = logging.getLogger(__name__)
+
+FCD_STORE_VERSION = 1
+FCD_STORE_SUFFIX = ".fcdstore"
+# Optional central cache directory; by default the store lives next to the FCD file.
+FCD_CACHE_DIR = os.environ.get("SUMO_MCP_FCD_CACHE_DIR", "")
+
+COLUMN_DTYPES: Dict[str, str] = {
+    "time": "<f8",
+    "vehicle": "<i4",
+    "x": "<f8",
+    "y": "<f8",
+    "speed": "<f8",
+    "lane": "<i4",
+    "edge": "<i4",
+}
+# `array.array` typecodes matching COLUMN_DTYPES (used while streaming).
+_ARRAY_TYPECODES: Dict[str, str] = {
+    "time": "d",
+    "vehicle": "i",
+    "x": "d",
+    "y": "d",
+    "speed": "d",
+    "lane": "i",
+    "edge": "i",
+}
+_STRING_KINDS = ("vehicle", "lane", "edge")
+_FLUSH_ROWS = 1 << 16
+_SUMMARY_CHUNK_ROWS = 1 << 22
+
+
+def fcd_source_key(fcd_file: str) -> Dict[str, Any]:
+    """Return the cache key (absolute path, size, mtime) of an FCD file."""
+    st = os.stat(fcd_file)
+    return {"source": os.path.abspath(fcd_file), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def default_store_path(fcd_file: str, suffix: str = FCD_STORE_SUFFIX) -> str:
+    """Return the sidecar path for `fcd_file` (next to it, or under `SUMO_MCP_FCD_CACHE_DIR`)."""
+    abs_path = os.path.abspath(fcd_file)
+    if FCD_CACHE_DIR:
+        digest = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(FCD_CACHE_DIR, f"{os.path.basename(abs_path)}-{digest}{suffix}")
+    return abs_path + suffix
+
+
+def edge_of_lane(lane_id: str) -> str:
+    """Derive the edge id from a SUMO lane id (`<edge>_<index>`)."""
+    edge, sep, index = lane_id.rpartition("_")
+    return edge if sep and index.isdigit() else lane_id
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class _StoreWriter:
+    """FCD visitor that appends rows to per-column binary files in bounded memory."""
+
+    def __init__(self, directory: str) -> None:
+        self.files: Dict[str, BinaryIO] = {
+            name: open(os.path.join(directory, f"{name}.bin"), "wb") for name in COLUMN_DTYPES
+        }
+        self.buffers: Dict[str, "array[Any]"] = {name: array(code) for name, code in _ARRAY_TYPECODES.items()}
+        self.vehicles = _StringTable()
+        self.lanes = _StringTable()
+        self.edges = _StringTable()
+        self.rows = 0
+        self.timesteps = 0
+        self._pending = 0
+
+    def on_timestep(self, time: float) -> None:
+        self.timesteps += 1
+
+    def on_vehicle(self, time: float, attrs: Dict[str, str]) -> None:
+        lane = attrs.get("lane", "")
+        edge = attrs.get("edge") or edge_of_lane(lane)
+        b = self.buffers
+        b["time"].append(time)
+        b["vehicle"].append(self.vehicles.code(attrs.get("id", "")))
+        b["x"].append(float(attrs.get("x", "nan")))
+        b["y"].append(float(attrs.get("y", "nan")))
+        b["speed"].append(float(attrs.get("speed", "nan")))
+        b["lane"].append(self.lanes.code(lane))
+        b["edge"].append(self.edges.code(edge))
+        self.rows += 1
+        self._pending += 1
+        if self._pending >= _FLUSH_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        for name, buf in self.buffers.items():
+            if buf:
+                buf.tofile(self.files[name])
+                del buf[:]
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def string_values(self) -> Dict[str, List[str]]:
+        return {"vehicle": self.vehicles.values, "lane": self.lanes.values, "edge": self.edges.values}
+
+
+class FCDStore:
+    """Read-only view over a built columnar FCD store."""
+
+    def __init__(self, path: str, meta: Dict[str, Any], strings: Dict[str, List[str]]) -> None:
+        self.path = path
+        self.meta = meta
+        self.strings = strings
+        self.rows: int = int(meta["rows"])
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, path: str) -> "FCDStore":
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "strings.json"), "r", encoding="utf-8") as f:
+            strings = json.load(f)
+        return cls(path, meta, strings)
+
+    def column(self, name: str) -> np.ndarray:
+        """Return a column as a read-only memory-mapped array."""
+        col = self._columns.get(name)
+        if col is None:
+            dtype = np.dtype(self.meta["columns"][name])
+            if self.rows == 0:
+                col = np.empty(0, dtype=dtype)
+            else:
+                col = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode="r", shape=(self.rows,))
+            self._columns[name] = col
+        return col
+
+    @property
+    def vehicles(self) -> List[str]:
+        return self.strings["vehicle"]
+
+    @property
+    def lanes(self) -> List[str]:
+        return self.strings["lane"]
+
+    @property
+    def edges(self) -> List[str]:
+        return self.strings["edge"]
+
+    def matches(self, fcd_file: str) -> bool:
+        """True if this store was built from the current version of `fcd_file`."""
+        try:
+            key = fcd_source_key(fcd_file)
+        except OSError:
+            return False
+        return self.meta.get("version") == FCD_STORE_VERSION and all(self.meta.get(k) == v for k, v in key.items())
+
+
+def open_fcd_store(fcd_file: str, store_path: Optional[str] = None) -> Optional[FCDStore]:
+    """Open the store for `fcd_file` if one exists and is still valid, else None."""
+    path = store_path or default_store_path(fcd_file)
+    if not os.path.isdir(path):
+        return None
+    try:
+        store = FCDStore.open(path)
+    except (OSError, ValueError, KeyError) as exc:
+        logger.debug("Ignoring unreadable FCD store %s: %s", path, exc)
+        return None
+    return store if store.matches(fcd_file) else None
+
+
+def _write_store_part(fcd_file: str, start: int, end: int, index: int, tmp_dir: str) -> Dict[str, Any]:
+    """Process-pool worker: write the columns of one timestep range with local string codes."""
+    part_dir = os.path.join(tmp_dir, f"part-{index:05d}")
+    os.mkdir(part_dir)
+    writer = _StoreWriter(part_dir)
+    try:
+        bytes_read = scan_fcd_range(fcd_file, writer, start, end)
+    finally:
+        writer.close()
+    return {
+        "dir": part_dir,
+        "rows": writer.rows,
+        "timesteps": writer.timesteps,
+        "bytes": bytes_read,
+        "strings": writer.string_values(),
+    }
+
+
+def _merge_store_parts(tmp_dir: str, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Concatenate part columns in file order, remapping local string codes to global ones."""
+    tables = {kind: _StringTable() for kind in _STRING_KINDS}
+    outputs = {name: open(os.path.join(tmp_dir, f"{name}.bin"), "wb") for name in COLUMN_DTYPES}
+    try:
+        for part in parts:
+            mappings = {
+                kind: np.array([tables[kind].code(v) for v in part["strings"][kind]], dtype=COLUMN_DTYPES[kind])
+                for kind in _STRING_KINDS
+            }
+            for name, dtype in COLUMN_DTYPES.items():
+                src = os.path.join(part["dir"], f"{name}.bin")
+                if part["rows"]:
+                    data = np.memmap(src, dtype=np.dtype(dtype), mode="r", shape=(part["rows"],))
+                    for start in range(0, part["rows"], _SUMMARY_CHUNK_ROWS):
+                        chunk = data[start:start + _SUMMARY_CHUNK_ROWS]
+                        if name in mappings:
+                            chunk = mappings[name][chunk]
+                        np.asarray(chunk).tofile(outputs[name])
+                    del data
+                os.remove(src)
+            os.rmdir(part["dir"])
+    finally:
+        for f in outputs.values():
+            f.close()
+
+    return {
+        "rows": sum(p["rows"] for p in parts),
+        "timesteps": sum(p["timesteps"] for p in parts),
+        "bytes": sum(p["bytes"] for p in parts),
+        "strings": {kind: tables[kind].values for kind in _STRING_KINDS},
+    }
+
+
+def build_fcd_store(fcd_file: str, store_path: Optional[str] = None, workers: Optional[int] = None) -> FCDStore:
+    """
+    Convert `fcd_file` into a columnar store (atomically replacing any stale one).
+
+    Large files are parsed by a process pool over `<timestep>` ranges (see
+    `utils.fcd.resolve_fcd_workers`); small files are converted serially.
+    """
+    path = store_path or default_store_path(fcd_file)
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+
+    key = fcd_source_key(fcd_file)
+    tmp_dir = tempfile.mkdtemp(prefix=".fcdstore-", dir=parent)
+    try:
+        result = None
+        resolved = resolve_fcd_workers(fcd_file, workers)
+        if resolved > 1:
+            parts = map_fcd_ranges(fcd_file, _write_store_part, resolved, extra_args=(tmp_dir,))
+            if parts is not None:
+                result = _merge_store_parts(tmp_dir, parts)
+
+        if result is None:
+            writer = _StoreWriter(tmp_dir)
+            try:
+                bytes_read = scan_fcd(fcd_file, writer)
+            finally:
+                writer.close()
+            result = {
+                "rows": writer.rows,
+                "timesteps": writer.timesteps,
+                "bytes": bytes_read,
+                "strings": writer.string_values(),
+            }
+
+        meta = dict(key)
+        meta.update(
+            {
+                "version": FCD_STORE_VERSION,
+                "rows": result["rows"],
+                "timesteps": result["timesteps"],
+                "bytes": result["bytes"],
+                "columns": COLUMN_DTYPES,
+            }
+        )
+        strings = result["strings"]
+        with open(os.path.join(tmp_dir, "strings.json"), "w", encoding="utf-8") as f:
+            json.dump(strings, f)
+        # meta.json is written last: a store without it is never considered valid.
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_dir, path)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return FCDStore(path, meta, strings)
+
+
+def load_fcd_store(
+    fcd_file: str,
+    store_path: Optional[str] = None,
+    rebuild: bool = False,
+    workers: Optional[int] = None,
+) -> FCDStore:
+    """Return a valid store for `fcd_file`, building it on first use or when stale."""
+    if not rebuild:
+        store = open_fcd_store(fcd_file, store_path)
+        if store is not None:
+            return store
+    return build_fcd_store(fcd_file, store_path, workers=workers)
+
+
+def summarize_store_speeds(store: FCDStore) -> FCDSpeedSummary:
+    """Compute the same speed summary as a streaming pass, vectorized over the store."""
+    summary = FCDSpeedSummary()
+    speed = store.column("speed")
+    for start in range(0, store.rows, _SUMMARY_CHUNK_ROWS):
+        chunk = np.asarray(speed[start:start + _SUMMARY_CHUNK_ROWS], dtype=np.float64)
+        chunk = chunk[~np.isnan(chunk)]
+        summary.speed.add_array(chunk)
+        summary.sketch.add_array(chunk)
+
+    summary.timesteps = int(store.meta.get("timesteps", 0))
+    if store.rows:
+        time_col = store.column("time")
+        summary.first_time = float(time_col[0])
+        summary.last_time = float(time_col[-1])
+    return summary
+
+
+def visit_store_rows(
+    store: FCDStore,
+    visitor: FCDVisitor,
+    vehicle_id: Optional[str] = None,
+    t0: Optional[float] = None,
+    t1: Optional[float] = None,
+) -> None:
+    """
+    Replay store rows (optionally one vehicle and/or time window) as FCD visitor calls.
+
+    Used for inputs that have no byte-offset index (compressed or tabular FCD).
+    """
+    time_col = store.column("time")
+    lo = int(np.searchsorted(time_col, t0, side="left")) if t0 is not None else 0
+    hi = int(np.searchsorted(time_col, t1, side="right")) if t1 is not None else store.rows
+
+    code: Optional[int] = None
+    if vehicle_id is not None:
+        try:
+            code = store.vehicles.index(vehicle_id)
+        except ValueError:
+            return
+
+    vehicle_col = store.column("vehicle")
+    columns = {name: store.column(name) for name in ("x", "y", "speed", "lane")}
+    current_time: Optional[float] = None
+    for start in range(lo, hi, _SUMMARY_CHUNK_ROWS):
+        stop = min(hi, start + _SUMMARY_CHUNK_ROWS)
+        vehicles = np.asarray(vehicle_col[start:stop])
+        rows = np.nonzero(vehicles == code)[0] if code is not None else np.arange(stop - start)
+        for row in rows.tolist():
+            i = start + row
+            t = float(time_col[i])
+            if t != current_time:
+                current_time = t
+                visitor.on_timestep(t)
+            visitor.on_vehicle(
+                t,
+                {
+                    "id": store.vehicles[int(vehicles[row])],
+                    "x": f"{columns['x'][i]:.2f}",
+                    "y": f"{columns['y'][i]:.2f}",
+                    "speed": f"{columns['speed'][i]:.2f}",
+                    "lane": store.lanes[int(columns["lane"][i])],
+                },
+            )
@@ -0,0 +1,328 @@
+"""
+Background jobs for long-running tool calls (workflows, RL training, simulations).
+
+`JobManager.submit` queues a tool body on a bounded thread pool and returns a
+job id at once, so a client-side timeout no longer loses the work. Each job
+runs under its own `CancelToken` (`utils.cancellation`): cancelling a running
+job kills its SUMO subprocesses and stops stepping/training loops exactly
+like a cancelled request. Progress messages and heartbeats reported through
+`report_progress` feed a `HeartbeatTimeoutExecutor`, whose liveness check
+tells a job that is still working from one that stalled.
+
+Every job persists to `<SUMO_MCP_JOB_DIR>/<job id>/`: `job.json` (status and
+timing), `log.txt` (progress messages, traceback on failure) and `result.txt`.
+Each record names the server process that owns it (host and PID). Records
+are reloaded on start, except those of another server that is still running
+on this host and sharing the directory; jobs that were queued or running when
+their owning process ended are marked "interrupted". A job belongs to the
+MCP client that submitted it (`utils.connection.client_scope`); other clients
+of a shared HTTP server can neither see nor cancel it.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.cancellation import CancelToken, run_with_token
+from utils.connection import current_client
+from utils.timeout import TIMEOUT_CONFIGS, HeartbeatTimeoutExecutor, TimeoutConfig
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR = os.environ.get("SUMO_MCP_JOB_DIR") or os.path.join(tempfile.gettempdir(), "sumo-mcp-jobs")
+# Jobs running at once; further submissions wait in the queue.
+JOB_WORKERS = int(os.environ.get("SUMO_MCP_JOB_WORKERS", "2"))
+# Queued + running jobs accepted before submit is refused.
+JOB_QUEUE_LIMIT = int(os.environ.get("SUMO_MCP_JOB_QUEUE_LIMIT", "100"))
+
+JOB_STATES = ("queued", "running", "finished", "failed", "cancelled", "interrupted")
+_ACTIVE = ("queued", "running")
+_LOG_FILE = "log.txt"
+_RESULT_FILE = "result.txt"
+_RECORD_FILE = "job.json"
+_HOST = socket.gethostname()
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION; STILL_ACTIVE exit code.
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class Job:
+    """One submitted tool call and its lifecycle."""
+
+    def __init__(
+        self,
+        job_id: str,
+        tool: str,
+        args: Dict[str, Any],
+        operation: Optional[str] = None,
+        client: Optional[str] = None,
+    ) -> None:
+        self.job_id = job_id
+        self.tool = tool
+        self.args = args
+        self.client = client
+        self.owner_host: Optional[str] = _HOST
+        self.owner_pid: Optional[int] = os.getpid()
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.progress: Optional[str] = None
+        self.error: Optional[str] = None
+        self.directory = os.path.join(JOB_DIR, job_id)
+        self.operation = operation
+        # Liveness uses the heartbeat interval configured for the operation (e.g. rl_training).
+        self.heartbeat = HeartbeatTimeoutExecutor(TIMEOUT_CONFIGS.get(operation or "", TimeoutConfig()))
+        self.token = CancelToken(progress=self._on_progress)
+        self.future: Optional[Future[None]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.directory, _LOG_FILE)
+
+    @property
+    def result_path(self) -> str:
+        return os.path.join(self.directory, _RESULT_FILE)
+
+    def _on_progress(self, message: Optional[str]) -> None:
+        self.heartbeat.heartbeat()
+        if message:
+            self.progress = message
+            self.log(message)
+
+    def log(self, message: str) -> None:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(f"{stamp} {message}\n")
+
+    def save(self) -> None:
+        record = {
+            "job_id": self.job_id,
+            "tool": self.tool,
+            "operation": self.operation,
+            "client": self.client,
+            "owner_host": self.owner_host,
+            "owner_pid": self.owner_pid,
+            "args": self.args,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "error": self.error,
+        }
+        path = os.path.join(self.directory, _RECORD_FILE)
+        tmp = path + ".tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f, default=str)
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: str) -> "Job":
+        with open(os.path.join(directory, _RECORD_FILE), "r", encoding="utf-8") as f:
+            record = json.load(f)
+        job = cls(
+            record["job_id"], record["tool"], record.get("args") or {}, record.get("operation"), record.get("client")
+        )
+        job.directory = directory
+        job.owner_host = record.get("owner_host")
+        job.owner_pid = record.get("owner_pid")
+        job.status = record["status"]
+        job.created_at = record["created_at"]
+        job.started_at = record.get("started_at")
+        job.finished_at = record.get("finished_at")
+        job.progress = record.get("progress")
+        job.error = record.get("error")
+        return job
+
+    def describe(self) -> str:
+        now = time.time()
+        if self.status == "queued":
+            timing = f"queued {now - self.created_at:.0f}s"
+        elif self.status == "running":
+            timing = f"running {now - (self.started_at or now):.0f}s"
+            if self.operation in TIMEOUT_CONFIGS and not self.heartbeat.check_alive():
+                timing += ", no heartbeat recently (stalled?)"
+        elif self.started_at is not None and self.finished_at is not None:
+            timing = f"ran {self.finished_at - self.started_at:.1f}s"
+        else:
+            timing = "never started"
+        progress = f"; {self.progress}" if self.progress else ""
+        error = f"; {self.error}" if self.error else ""
+        return f"{self.job_id}: {self.tool} {self.status} ({timing}){progress}{error}"
+
+    def owned_by_other_server(self) -> bool:
+        """The record belongs to another server process that is still running on this host."""
+        if self.owner_host != _HOST or self.owner_pid is None or self.owner_pid == os.getpid():
+            return False
+        return _process_alive(self.owner_pid)
+
+
+class JobManager:
+    """Bounded pool running `Job`s, with their records kept in memory and on disk."""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT) -> None:
+        self.max_workers = max(1, max_workers)
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sumo-mcp:job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.isdir(JOB_DIR):
+            return
+        for name in os.listdir(JOB_DIR):
+            directory = os.path.join(JOB_DIR, name)
+            if not os.path.exists(os.path.join(directory, _RECORD_FILE)):
+                continue
+            try:
+                job = Job.load(directory)
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug("Skipping unreadable job record %s: %s", directory, e)
+                continue
+            if job.owned_by_other_server():
+                continue
+            if job.status in _ACTIVE:
+                job.status = "interrupted"
+                job.error = "server stopped before the job finished"
+                job.owner_host, job.owner_pid = _HOST, os.getpid()
+                job.save()
+            self._jobs[job.job_id] = job
+
+    def submit(
+        self, tool: str, args: Dict[str, Any], func: Callable[..., Any], operation: Optional[str] = None
+    ) -> Job:
+        """Queue `func(**args)`; `operation` selects the heartbeat settings (see utils.timeout)."""
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.status in _ACTIVE)
+            if active >= self.queue_limit:
+                raise RuntimeError(
+                    f"Job queue is full ({active} queued or running); wait or raise SUMO_MCP_JOB_QUEUE_LIMIT."
+                )
+            job = Job(uuid.uuid4().hex[:12], tool, args, operation, current_client())
+            os.makedirs(job.directory, exist_ok=True)
+            job.save()
+            job.log(f"submitted {tool}")
+            self._jobs[job.job_id] = job
+            # The job keeps the submitter's context, e.g. the MCP client its sessions belong to.
+            job.future = self._executor.submit(contextvars.copy_context().run, self._run, job, func)
+        return job
+
+    def _run(self, job: Job, func: Callable[..., Any]) -> None:
+        if job.token.cancelled:
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        job.heartbeat.heartbeat()
+        job.save()
+        job.log("started")
+        try:
+            result = run_with_token(job.token, lambda: func(**job.args))
+        except Exception as e:
+            job.status = "cancelled" if job.token.cancelled else "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            job.log(traceback.format_exc().rstrip())
+        else:
+            job.status = "cancelled" if job.token.cancelled else "finished"
+            with open(job.result_path, "w", encoding="utf-8") as f:
+                f.write(result if isinstance(result, str) else json.dumps(result, default=str))
+        job.finished_at = time.time()
+        job.save()
+        job.log(job.status)
+
+    def get(self, job_id: str) -> Job:
+        """The job `job_id` of the current client."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.client != current_client():
+            raise KeyError(f"No job '{job_id}'")
+        return job
+
+    def list(self, status: Optional[str] = None) -> List[Job]:
+        """Jobs of the current client, oldest first."""
+        client = current_client()
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.client == client]
+        if status:
+            jobs = [job for job in jobs if job.status == status]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    def cancel(self, job_id: str) -> Job:
+        """Drop a queued job, or signal a running one to stop (its status changes once it has stopped)."""
+        job = self.get(job_id)
+        if job.status not in _ACTIVE:
+            return job
+        job.token.cancel()
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            job.save()
+            job.log("cancelled while queued")
+        else:
+            job.log("cancellation requested")
+        return job
+
+    def result(self, job_id: str) -> Optional[str]:
+        """The stored result text, or None while the job has none."""
+        job = self.get(job_id)
+        if not os.path.exists(job.result_path):
+            return None
+        with open(job.result_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def log_tail(self, job_id: str, lines: int = 50) -> str:
+        job = self.get(job_id)
+        if not os.path.exists(job.log_path):
+            return ""
+        with open(job.log_path, "r", encoding="utf-8") as f:
+            return "".join(f.readlines()[-lines:])
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """The process-wide job manager, created (and prior records loaded) on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
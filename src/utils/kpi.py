@@ -0,0 +1,223 @@
+"""
+Trip KPIs from SUMO `tripinfo` and `summary` output.
+
+Both outputs are orders of magnitude smaller than FCD and carry the KPIs that
+matter for signal timing directly: travel time, waiting time, time loss,
+throughput and teleports. Files are streamed with expat; per-vehicle values go
+into flat numpy arrays so that the baseline/optimized join and the bootstrap
+confidence intervals are vectorized.
+"""
+
+from __future__ import annotations
+
+import xml.parsers.expat
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.fcd import FCD_READ_CHUNK_BYTES
+
+# Per-vehicle tripinfo attributes kept as float64 columns.
+TRIP_METRICS = ("duration", "waitingTime", "timeLoss", "departDelay", "routeLength")
+DEFAULT_BOOTSTRAP_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+# Upper bound on resample x sample elements drawn at once.
+_BOOTSTRAP_BLOCK = 1 << 22
+
+
+def _parse_stream(path: str, start: Callable[[str, Dict[str, str]], None]) -> None:
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(FCD_READ_CHUNK_BYTES)
+            if not data:
+                break
+            parser.Parse(data, False)
+    parser.Parse(b"", True)
+
+
+@dataclass
+class TripTable:
+    """Columnar tripinfo records of one run."""
+
+    ids: np.ndarray                          # (N,) vehicle ids (str)
+    depart: np.ndarray                       # (N,) departure times
+    arrival: np.ndarray                      # (N,) arrival times
+    metrics: Dict[str, np.ndarray]           # TRIP_METRICS -> (N,) float64
+    vaporized: int = 0                       # trips ended by removal/teleport-vaporization
+
+    @property
+    def count(self) -> int:
+        return int(self.ids.shape[0])
+
+
+def read_tripinfo(path: str) -> TripTable:
+    """Stream a tripinfo file into a `TripTable` (person/container trips are ignored)."""
+    ids: List[str] = []
+    depart = array("d")
+    arrival = array("d")
+    columns = {name: array("d") for name in TRIP_METRICS}
+    vaporized = 0
+
+    def _start(name: str, attrs: Dict[str, str]) -> None:
+        nonlocal vaporized
+        if name != "tripinfo":
+            return
+        ids.append(attrs.get("id", ""))
+        depart.append(float(attrs.get("depart", "nan")))
+        arrival.append(float(attrs.get("arrival", "nan")))
+        for metric, column in columns.items():
+            column.append(float(attrs.get(metric, "nan")))
+        if attrs.get("vaporized"):
+            vaporized += 1
+
+    _parse_stream(path, _start)
+    return TripTable(
+        ids=np.array(ids, dtype=str),
+        depart=np.frombuffer(depart, dtype=np.float64),
+        arrival=np.frombuffer(arrival, dtype=np.float64),
+        metrics={name: np.frombuffer(column, dtype=np.float64) for name, column in columns.items()},
+        vaporized=vaporized,
+    )
+
+
+@dataclass
+class SummaryStats:
+    """Network-level figures from a summary output (cumulative counters taken at the last step)."""
+
+    begin: float = 0.0
+    end: float = 0.0
+    steps: int = 0
+    inserted: int = 0
+    arrived: int = 0
+    teleports: int = 0
+    collisions: int = 0
+    max_running: int = 0
+    max_halting: int = 0
+    last: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def throughput_per_hour(self) -> float:
+        span = self.end - self.begin
+        return self.arrived / span * 3600.0 if span > 0 else float("nan")
+
+
+def read_summary(path: str) -> SummaryStats:
+    """Stream a summary output keeping only the last step and a few running maxima."""
+    stats = SummaryStats()
+
+    def _start(name: str, attrs: Dict[str, str]) -> None:
+        if name != "step":
+            return
+        t = float(attrs.get("time", 0.0))
+        if stats.steps == 0:
+            stats.begin = t
+        stats.steps += 1
+        stats.end = t
+        stats.max_running = max(stats.max_running, int(attrs.get("running", 0)))
+        stats.max_halting = max(stats.max_halting, int(attrs.get("halting", 0)))
+        stats.last = attrs
+
+    _parse_stream(path, _start)
+    last = stats.last
+    stats.inserted = int(last.get("inserted", 0))
+    stats.arrived = int(last.get("arrived", 0))
+    stats.teleports = int(last.get("teleports", 0))
+    stats.collisions = int(last.get("collisions", 0))
+    return stats
+
+
+def bootstrap_ci(
+    values: np.ndarray,
+    n_resamples: int = DEFAULT_BOOTSTRAP_RESAMPLES,
+    confidence: float = DEFAULT_CONFIDENCE,
+    seed: Optional[int] = 0,
+) -> Tuple[float, float]:
+    """Percentile bootstrap confidence interval of the mean of `values`."""
+    if n_resamples < 1:
+        raise ValueError(f"n_resamples must be >= 1, got {n_resamples}")
+    if not 0.0 < confidence < 1.0:
+        raise ValueError(f"confidence must be between 0 and 1 (exclusive), got {confidence}")
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = values.size
+    if n == 0:
+        return float("nan"), float("nan")
+    if n == 1:
+        return float(values[0]), float(values[0])
+
+    rng = np.random.default_rng(seed)
+    means = np.empty(n_resamples, dtype=np.float64)
+    block = max(1, _BOOTSTRAP_BLOCK // n)
+    for start in range(0, n_resamples, block):
+        stop = min(n_resamples, start + block)
+        idx = rng.integers(0, n, size=(stop - start, n))
+        means[start:stop] = values[idx].mean(axis=1)
+    alpha = (1.0 - confidence) / 2.0
+    lo, hi = np.quantile(means, [alpha, 1.0 - alpha])
+    return float(lo), float(hi)
+
+
+@dataclass
+class MetricSummary:
+    name: str
+    mean: float
+    ci: Tuple[float, float]
+    total: float
+
+
+def summarize_trips(
+    trips: TripTable,
+    n_resamples: int = DEFAULT_BOOTSTRAP_RESAMPLES,
+    confidence: float = DEFAULT_CONFIDENCE,
+) -> List[MetricSummary]:
+    """Mean, bootstrap CI and total of every trip metric."""
+    result = []
+    for name in TRIP_METRICS:
+        values = trips.metrics[name]
+        mean = float(np.nanmean(values)) if trips.count else float("nan")
+        result.append(
+            MetricSummary(name, mean, bootstrap_ci(values, n_resamples, confidence), float(np.nansum(values)))
+        )
+    return result
+
+
+@dataclass
+class PairedComparison:
+    """Per-vehicle optimized - baseline differences over vehicles that completed both runs."""
+
+    matched: int
+    baseline_only: int
+    optimized_only: int
+    metrics: List[MetricSummary]     # mean/CI/total of the paired differences
+
+
+def join_trips(baseline: TripTable, optimized: TripTable) -> Tuple[np.ndarray, np.ndarray]:
+    """Return row indices into `baseline` and `optimized` of vehicles present in both."""
+    _, base_idx, opt_idx = np.intersect1d(baseline.ids, optimized.ids, assume_unique=False, return_indices=True)
+    return base_idx, opt_idx
+
+
+def compare_trips(
+    baseline: TripTable,
+    optimized: TripTable,
+    n_resamples: int = DEFAULT_BOOTSTRAP_RESAMPLES,
+    confidence: float = DEFAULT_CONFIDENCE,
+) -> PairedComparison:
+    """Vectorized per-vehicle join and paired bootstrap of the metric differences."""
+    base_idx, opt_idx = join_trips(baseline, optimized)
+    metrics = []
+    for name in TRIP_METRICS:
+        diff = optimized.metrics[name][opt_idx] - baseline.metrics[name][base_idx]
+        mean = float(np.nanmean(diff)) if diff.size else float("nan")
+        metrics.append(MetricSummary(name, mean, bootstrap_ci(diff, n_resamples, confidence), float(np.nansum(diff))))
+    matched = int(base_idx.size)
+    return PairedComparison(
+        matched=matched,
+        baseline_only=baseline.count - matched,
+        optimized_only=optimized.count - matched,
+        metrics=metrics,
+    )
@@ -0,0 +1,136 @@
+"""
+Online KPI collection over TraCI subscriptions.
+
+Instead of writing FCD and parsing it afterwards, the collector subscribes once
+and folds every step's subscription results into fixed-size accumulators:
+
+    speed      per-vehicle speeds via one junction context subscription whose
+               radius covers the whole network (mean/std/min/max, vehicle-steps)
+    halting    vehicles below `HALTING_SPEED` per step (mean/max)
+    edges      per-edge occupancy, vehicle count and halting via edge subscriptions
+    arrivals   departed/arrived/teleport counts via a simulation subscription
+
+Memory use depends on the number of edges only, never on the number of steps.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Iterable, List, Optional, Sequence
+
+import numpy as np
+import traci.constants as tc
+
+from utils.stats import RunningStats
+
+ONLINE_KPIS = ("speed", "halting", "edges", "arrivals")
+# SUMO counts a vehicle as halting below 0.1 m/s.
+HALTING_SPEED = 0.1
+
+_EDGE_VARS = (tc.LAST_STEP_OCCUPANCY, tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_VEHICLE_HALTING_NUMBER)
+_SIM_VARS = (
+    tc.VAR_DEPARTED_VEHICLES_NUMBER,
+    tc.VAR_ARRIVED_VEHICLES_NUMBER,
+    tc.VAR_TELEPORT_STARTING_VEHICLES_NUMBER,
+)
+
+
+def parse_kpis(kpis: Optional[Iterable[str] | str]) -> List[str]:
+    """Normalize a KPI selection (list or comma-separated string); None selects all."""
+    if kpis is None:
+        return list(ONLINE_KPIS)
+    if isinstance(kpis, str):
+        kpis = [k.strip() for k in kpis.split(",")]
+    selected = [k for k in kpis if k]
+    unknown = [k for k in selected if k not in ONLINE_KPIS]
+    if unknown:
+        raise ValueError(f"Unknown KPI(s) {', '.join(unknown)}. Available: {', '.join(ONLINE_KPIS)}")
+    return selected
+
+
+class OnlineKPICollector:
+    """Accumulate KPIs from TraCI subscription results while a simulation is stepped."""
+
+    def __init__(self, kpis: Optional[Sequence[str]] = None, top_k: int = 5) -> None:
+        self.kpis = parse_kpis(kpis)
+        self.top_k = top_k
+        self.steps = 0
+        self.speed = RunningStats()          # all vehicle-step speeds
+        self.halting = RunningStats()        # halting vehicles per step
+        self.departed = 0
+        self.arrived = 0
+        self.teleports = 0
+        self.edges: List[str] = []
+        self._occupancy = np.zeros(0)
+        self._edge_vehicles = np.zeros(0)
+        self._edge_halting = np.zeros(0)
+        self._anchor: Optional[str] = None
+
+    def subscribe(self, conn: Any) -> None:
+        """Create the subscriptions on `conn` (the `traci` module or a TraCI connection)."""
+        conn.simulation.subscribe(_SIM_VARS)
+        if "speed" in self.kpis or "halting" in self.kpis:
+            junctions = [j for j in conn.junction.getIDList() if not j.startswith(":")]
+            if junctions:
+                (x0, y0), (x1, y1) = conn.simulation.getNetBoundary()
+                self._anchor = junctions[0]
+                # Any radius >= the boundary diagonal covers every vehicle from any anchor inside it.
+                radius = math.hypot(x1 - x0, y1 - y0) + 1.0
+                conn.junction.subscribeContext(self._anchor, tc.CMD_GET_VEHICLE_VARIABLE, radius, [tc.VAR_SPEED])
+        if "edges" in self.kpis:
+            self.edges = [e for e in conn.edge.getIDList() if not e.startswith(":")]
+            for edge in self.edges:
+                conn.edge.subscribe(edge, _EDGE_VARS)
+            self._occupancy = np.zeros(len(self.edges))
+            self._edge_vehicles = np.zeros(len(self.edges))
+            self._edge_halting = np.zeros(len(self.edges))
+
+    def collect(self, conn: Any) -> None:
+        """Fold the subscription results of the step that just finished."""
+        self.steps += 1
+        sim = conn.simulation.getSubscriptionResults()
+        self.departed += int(sim.get(tc.VAR_DEPARTED_VEHICLES_NUMBER, 0))
+        self.arrived += int(sim.get(tc.VAR_ARRIVED_VEHICLES_NUMBER, 0))
+        self.teleports += int(sim.get(tc.VAR_TELEPORT_STARTING_VEHICLES_NUMBER, 0))
+
+        if self._anchor is not None:
+            context = conn.junction.getContextSubscriptionResults(self._anchor) or {}
+            speeds = np.fromiter((v[tc.VAR_SPEED] for v in context.values()), dtype=np.float64, count=len(context))
+            if "speed" in self.kpis:
+                self.speed.add_array(speeds)
+            if "halting" in self.kpis:
+                self.halting.add(float(np.count_nonzero(speeds < HALTING_SPEED)))
+
+        if self.edges:
+            results = conn.edge.getAllSubscriptionResults()
+            values = np.array(
+                [[results[e][var] for var in _EDGE_VARS] for e in self.edges], dtype=np.float64
+            ).reshape(len(self.edges), len(_EDGE_VARS))
+            self._occupancy += values[:, 0]
+            self._edge_vehicles += values[:, 1]
+            self._edge_halting += values[:, 2]
+
+    def format(self) -> str:
+        """Render the collected KPIs as text lines."""
+        lines = ["Online KPIs:"]
+        if "arrivals" in self.kpis:
+            lines.append(f"Departed: {self.departed}, Arrived: {self.arrived}, Teleports: {self.teleports}")
+        if "speed" in self.kpis and self.speed.count:
+            lines.append(
+                f"Mean speed: {self.speed.mean:.2f} m/s (std {self.speed.std:.2f}, "
+                f"max {self.speed.max:.2f}) over {self.speed.count} vehicle-steps"
+            )
+        if "halting" in self.kpis and self.halting.count:
+            lines.append(f"Halting vehicles: mean {self.halting.mean:.2f}, max {self.halting.max:.0f}")
+        if self.edges and self.steps:
+            # TraCI reports occupancy as a fraction of the edge length.
+            occupancy = self._occupancy / self.steps * 100.0
+            order = np.argsort(-occupancy, kind="stable")[: self.top_k]
+            lines.append(f"Busiest edges by mean occupancy (of {len(self.edges)}):")
+            lines.append(f"{'edge':<20}{'occupancy%':>12}{'vehicles':>10}{'halting':>10}")
+            for i in order:
+                lines.append(
+                    f"{self.edges[i]:<20}{occupancy[i]:>12.2f}"
+                    f"{self._edge_vehicles[i] / self.steps:>10.2f}{self._edge_halting[i] / self.steps:>10.2f}"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,168 @@
+"""
+Output-volume profiles for generated SUMO configurations.
+
+Full per-step, per-vehicle FCD output is usually the largest I/O cost of a
+workflow run. A profile decides which outputs a generated `.sumocfg` enables:
+
+    full        FCD for every vehicle and step (previous behaviour)
+    sampled     FCD every `fcd_period` seconds, optionally restricted to edges
+                and/or vehicles (explicit ids or an equipped fraction)
+    aggregate   no FCD; edgeData intervals, summary and tripinfo only
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.fcd import FCD_OUTPUT_FORMATS, fcd_output_path
+
+OUTPUT_PROFILES = ("full", "sampled", "aggregate")
+
+DEFAULT_FCD_PERIOD = 10.0
+DEFAULT_AGGREGATION_PERIOD = 300.0
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return [str(v) for v in value]
+
+
+@dataclass
+class OutputProfile:
+    """Which SUMO outputs a generated configuration writes."""
+
+    name: str = "full"
+    fcd_format: str = "xml"
+    fcd_period: float = DEFAULT_FCD_PERIOD
+    fcd_edges: List[str] = field(default_factory=list)
+    fcd_vehicles: List[str] = field(default_factory=list)
+    fcd_probability: Optional[float] = None
+    aggregation_period: float = DEFAULT_AGGREGATION_PERIOD
+
+    def __post_init__(self) -> None:
+        if self.name not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile '{self.name}'. Available: {', '.join(OUTPUT_PROFILES)}")
+        if self.fcd_format not in FCD_OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unknown output_format '{self.fcd_format}'. Available: {', '.join(FCD_OUTPUT_FORMATS)}"
+            )
+        if self.fcd_period <= 0:
+            raise ValueError("fcd_period must be > 0")
+        if self.aggregation_period <= 0:
+            raise ValueError("aggregation_period must be > 0")
+        if self.fcd_probability is not None and not 0.0 < self.fcd_probability <= 1.0:
+            raise ValueError("fcd_probability must be in (0, 1]")
+
+    @classmethod
+    def from_options(
+        cls, name: str = "full", fcd_format: str = "xml", options: Optional[Dict[str, Any]] = None
+    ) -> "OutputProfile":
+        """Build a profile from loosely typed tool parameters."""
+        options = options or {}
+        probability = options.get("fcd_probability")
+        return cls(
+            name=name,
+            fcd_format=fcd_format,
+            fcd_period=float(options.get("fcd_period", DEFAULT_FCD_PERIOD)),
+            fcd_edges=_as_list(options.get("fcd_edges")),
+            fcd_vehicles=_as_list(options.get("fcd_vehicles")),
+            fcd_probability=float(probability) if probability is not None else None,
+            aggregation_period=float(options.get("aggregation_period", DEFAULT_AGGREGATION_PERIOD)),
+        )
+
+    @property
+    def writes_fcd(self) -> bool:
+        return self.name != "aggregate"
+
+    def describe(self) -> str:
+        if self.name == "full":
+            return "full (FCD every step, all vehicles)"
+        if self.name == "aggregate":
+            return f"aggregate (edgeData every {self.aggregation_period:g}s, summary, tripinfo; no FCD)"
+        filters = [f"every {self.fcd_period:g}s"]
+        if self.fcd_edges:
+            filters.append(f"{len(self.fcd_edges)} edge(s)")
+        if self.fcd_vehicles:
+            filters.append(f"{len(self.fcd_vehicles)} vehicle(s)")
+        if self.fcd_probability is not None:
+            filters.append(f"{self.fcd_probability:.0%} of vehicles")
+        return f"sampled (FCD {', '.join(filters)})"
+
+
+@dataclass
+class OutputFiles:
+    """Output (and helper input) files produced by one profile for one run."""
+
+    fcd: Optional[str] = None
+    edgedata: Optional[str] = None
+    summary: Optional[str] = None
+    tripinfo: Optional[str] = None
+    fcd_edge_filter: Optional[str] = None
+    additional: List[str] = field(default_factory=list)
+
+
+def prepare_outputs(profile: OutputProfile, output_dir: str, stem: str, trip_outputs: bool = False) -> OutputFiles:
+    """
+    Decide the output paths of a run named `stem` and write the helper files the profile needs.
+
+    Files are named `<stem>_fcd.xml`, `<stem>_edgedata.xml`, ... (`fcd.xml`, ... for an empty stem).
+
+    Helper files are an edge selection for sampled FCD and an additional file declaring the
+    edgeData intervals for the aggregate profile. `trip_outputs` adds summary and tripinfo
+    output (always on for `aggregate`) for trip KPI analysis.
+    """
+    files = OutputFiles()
+    prefix = f"{stem}_" if stem else ""
+    if trip_outputs or not profile.writes_fcd:
+        files.summary = os.path.join(output_dir, f"{prefix}summary.xml")
+        files.tripinfo = os.path.join(output_dir, f"{prefix}tripinfo.xml")
+    if profile.writes_fcd:
+        files.fcd = fcd_output_path(output_dir, f"{prefix}fcd", profile.fcd_format)
+        if profile.name == "sampled" and profile.fcd_edges:
+            files.fcd_edge_filter = os.path.join(output_dir, f"{prefix}fcd_edges.txt")
+            with open(files.fcd_edge_filter, "w", encoding="utf-8") as f:
+                f.write("".join(f"edge:{edge}\n" for edge in profile.fcd_edges))
+        return files
+
+    files.edgedata = os.path.join(output_dir, f"{prefix}edgedata.xml")
+    additional = os.path.join(output_dir, f"{prefix}outputs.add.xml")
+    data_id = stem or "edgedata"
+    # edgeData paths inside an additional file are resolved relative to that file.
+    with open(additional, "w", encoding="utf-8") as f:
+        f.write(
+            "<additional>\n"
+            f'    <edgeData id="{data_id}" file="{os.path.basename(files.edgedata)}" '
+            f'period="{profile.aggregation_period:g}"/>\n'
+            "</additional>\n"
+        )
+    files.additional.append(additional)
+    return files
+
+
+def output_config_xml(profile: OutputProfile, files: OutputFiles, as_cfg_path: Callable[[str], str]) -> str:
+    """Return the `<output>`/device option elements for a `.sumocfg` (`as_cfg_path` relativizes paths)."""
+    lines: List[str] = ["<output>"]
+    if files.fcd:
+        lines.append(f'    <fcd-output value="{as_cfg_path(files.fcd)}"/>')
+        if files.fcd_edge_filter:
+            lines.append(f'    <fcd-output.filter-edges.input-file value="{as_cfg_path(files.fcd_edge_filter)}"/>')
+    if files.summary:
+        lines.append(f'    <summary-output value="{as_cfg_path(files.summary)}"/>')
+    if files.tripinfo:
+        lines.append(f'    <tripinfo-output value="{as_cfg_path(files.tripinfo)}"/>')
+    lines.append("</output>")
+
+    if profile.name == "sampled":
+        lines.append("<fcd_device>")
+        lines.append(f'    <device.fcd.period value="{profile.fcd_period:g}"/>')
+        if profile.fcd_vehicles:
+            lines.append(f'    <device.fcd.explicit value="{",".join(profile.fcd_vehicles)}"/>')
+        if profile.fcd_probability is not None:
+            lines.append(f'    <device.fcd.probability value="{profile.fcd_probability:g}"/>')
+        lines.append("</fcd_device>")
+    return "\n    ".join(lines)
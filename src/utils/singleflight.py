@@ -0,0 +1,173 @@
+"""
+Single-flight coalescing of identical concurrent tool calls.
+
+Agents often issue the same expensive call again before the first one has
+finished (`run_analysis` on the same FCD, `manage_network` generate with the
+same params). `SingleFlight.run` gives such calls one shared execution: the
+first caller runs it, later callers with the same key wait for it and all
+get its result. Nothing is cached; once the execution ends the next call
+with that key runs again.
+
+`call_key` normalizes the arguments (dict order, None entries, 1 vs 1.0) and
+adds the path, size and modification time of the tool's input files, so
+calls only coalesce while their inputs are unchanged. Only the arguments the
+caller names as inputs are fingerprinted; output paths are keyed by their
+plain string, since the running execution itself rewrites them. If the
+running execution is cancelled by its own caller, the callers still waiting
+start a new one instead of inheriting the cancellation; a waiter whose own
+call is cancelled stops waiting with `OperationCancelled`.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, cast
+
+from utils.cancellation import CancelToken, OperationCancelled, current_token
+
+T = TypeVar("T")
+
+# How often a waiting caller checks its own cancel token.
+_WAIT_SLICE_S = 0.2
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return value if isinstance(value, str) else repr(value)
+
+
+def _lookup(arguments: Dict[str, Any], name: str) -> Any:
+    # "params.net_file" reaches into a dict argument.
+    value: Any = arguments
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _fingerprint(value: Any) -> Any:
+    if not isinstance(value, str) or not value:
+        return None
+    files = []
+    # SUMO tools take comma-separated file lists.
+    for path in value.split(","):
+        path = path.strip()
+        if os.path.isfile(path):
+            st = os.stat(path)
+            files.append([os.path.realpath(path), st.st_size, st.st_mtime_ns])
+        else:
+            files.append([path, None, None])
+    return files
+
+
+def call_key(tool: str, arguments: Dict[str, Any], inputs: Iterable[str] = ()) -> str:
+    """Key of a call: tool name, normalized arguments and the state of its `inputs` files.
+
+    `inputs` names the arguments that are read as files, either top-level
+    ("net_file") or inside a dict argument ("params.net_file").
+    """
+    files = {name: _fingerprint(_lookup(arguments, name)) for name in inputs}
+    return json.dumps([tool, _normalize(arguments), files], sort_keys=True, default=str)
+
+
+class _Flight:
+    def __init__(self, token: Optional[CancelToken]) -> None:
+        self.token = token
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class FlightStats:
+    """Per-tool counters: calls received, executions run, calls served by another call's execution."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def describe(self) -> str:
+        return f"{self.calls} calls, {self.executions} executions, {self.coalesced} coalesced"
+
+
+class SingleFlight:
+    """In-flight executions by key; thread-safe."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._stats: Dict[str, FlightStats] = {}
+
+    def run(self, tool: str, key: str, func: Callable[[], T]) -> T:
+        """`func()`, or the result of the running execution with the same `key`."""
+        token = current_token()
+        with self._lock:
+            stats = self._stats.setdefault(tool, FlightStats())
+            stats.calls += 1
+        while True:
+            flight: Optional[_Flight]
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight(token)
+                    stats.executions += 1
+                    leader = True
+                else:
+                    flight.waiters += 1
+                    stats.coalesced += 1
+                    leader = False
+            if leader:
+                return self._lead(key, flight, func)
+            while not flight.done.wait(_WAIT_SLICE_S):
+                if token is not None and token.cancelled:
+                    with self._lock:
+                        flight.waiters -= 1
+                    raise OperationCancelled("Request cancelled by the client.")
+            if flight.token is not None and flight.token.cancelled and not (token is not None and token.cancelled):
+                # The leader's own caller cancelled; this caller still wants the result.
+                with self._lock:
+                    stats.coalesced -= 1
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return cast(T, flight.value)
+
+    def _lead(self, key: str, flight: _Flight, func: Callable[[], T]) -> T:
+        try:
+            value = func()
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def describe(self) -> List[str]:
+        with self._lock:
+            items: List[Tuple[str, FlightStats]] = sorted(self._stats.items())
+            return [f"{tool}: {stats.describe()}" for tool, stats in items]
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
@@ -0,0 +1,65 @@
+"""
+Per-step snapshot cache of simulation queries.
+
+Between two steps the simulation state does not change, so repeated queries
+(vehicle list, simulation info, vehicle variables) are answered from memory.
+Entries belong to one step generation and are dropped when the session steps.
+Values are stored by the session worker right after they were read, so an
+entry can never mix data from two different steps.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class StepSnapshotCache:
+    """Query results of the current simulation step, with hit/miss counters."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: Dict[Hashable, Any] = {}
+        self.generation = 0
+        self.time: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value), counting a hit or a miss."""
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return True, self._values[key]
+            self.misses += 1
+            return False, None
+
+    def peek(self, key: Hashable) -> Tuple[bool, Any]:
+        """Like `lookup` without touching the counters."""
+        with self._lock:
+            if key in self._values:
+                return True, self._values[key]
+            return False, None
+
+    def store(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def invalidate(self, time: Optional[float] = None) -> None:
+        """Drop all entries; `time` is the simulation time of the new step when known."""
+        with self._lock:
+            self._values.clear()
+            self.generation += 1
+            self.time = time
+            self.invalidations += 1
+
+    def describe(self) -> str:
+        with self._lock:
+            lookups = self.hits + self.misses
+            rate = f"{self.hits / lookups * 100.0:.1f}%" if lookups else "n/a"
+            time = "unknown" if self.time is None else f"{self.time:g}"
+            return (
+                f"t={time}, {len(self._values)} entries, {self.hits} hits / {self.misses} misses "
+                f"(hit rate {rate}), {self.invalidations} invalidations"
+            )
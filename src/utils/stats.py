@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class RunningStats:
+    """
+    Constant-memory running count/mean/variance/min/max (Welford).
+
+    Instances are mergeable (Chan et al. parallel update), so partial aggregates
+    computed over independent chunks of a stream can be combined exactly.
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def extend(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def add_array(self, values: np.ndarray) -> None:
+        """Fold a whole NumPy array into the aggregate (vectorized)."""
+        if values.size == 0:
+            return
+        chunk = RunningStats()
+        chunk.count = int(values.size)
+        chunk.mean = float(values.mean(dtype=np.float64))
+        chunk.m2 = float(np.square(values - chunk.mean, dtype=np.float64).sum())
+        chunk.min = float(values.min())
+        chunk.max = float(values.max())
+        self.merge(chunk)
+
+    def merge(self, other: "RunningStats") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1), matching `pandas.Series.describe()`."""
+        if self.count < 2:
+            return math.nan
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self) -> float:
+        var = self.variance
+        return math.sqrt(var) if not math.isnan(var) else math.nan
+
+    def __getstate__(self) -> Tuple[int, float, float, float, float]:
+        return (self.count, self.mean, self.m2, self.min, self.max)
+
+    def __setstate__(self, state: Tuple[int, float, float, float, float]) -> None:
+        self.count, self.mean, self.m2, self.min, self.max = state
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch with a relative-error guarantee.
+
+    Values are counted in logarithmically sized buckets (DDSketch): any quantile
+    is returned within `relative_accuracy` of the true value. The number of
+    buckets grows with log(max/min) only and is additionally capped by
+    `max_bins` (lowest buckets are collapsed first), so memory stays constant
+    regardless of stream length.
+    """
+
+    _MIN_INDEXABLE = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.005, max_bins: int = 2048) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive: Dict[int, int] = {}
+        self._negative: Dict[int, int] = {}
+        self._zero = 0
+        self.count = 0
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2.0 * self._gamma**key / (self._gamma + 1)
+
+    def add(self, value: float, weight: int = 1) -> None:
+        self.count += weight
+        if value > self._MIN_INDEXABLE:
+            bins = self._positive
+            key = self._key(value)
+        elif value < -self._MIN_INDEXABLE:
+            bins = self._negative
+            key = self._key(-value)
+        else:
+            self._zero += weight
+            return
+
+        bins[key] = bins.get(key, 0) + weight
+        if len(bins) > self.max_bins:
+            self._collapse(bins)
+
+    def add_array(self, values: np.ndarray) -> None:
+        """Add every element of a NumPy array (vectorized bucketing)."""
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        self.count += int(values.size)
+        positive = values[values > self._MIN_INDEXABLE]
+        negative = -values[values < -self._MIN_INDEXABLE]
+        self._zero += int(values.size - positive.size - negative.size)
+        for magnitudes, bins in ((positive, self._positive), (negative, self._negative)):
+            if magnitudes.size == 0:
+                continue
+            keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+            unique, counts = np.unique(keys, return_counts=True)
+            for key, weight in zip(unique.tolist(), counts.tolist()):
+                bins[key] = bins.get(key, 0) + weight
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+    def _collapse(self, bins: Dict[int, int]) -> None:
+        keys = sorted(bins)
+        overflow = len(keys) - self.max_bins
+        target = keys[overflow]
+        for key in keys[:overflow]:
+            bins[target] += bins.pop(key)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other._gamma != self._gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.count += other.count
+        self._zero += other._zero
+        for src, dst in ((other._positive, self._positive), (other._negative, self._negative)):
+            for key, weight in src.items():
+                dst[key] = dst.get(key, 0) + weight
+            if len(dst) > self.max_bins:
+                self._collapse(dst)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the approximate q-quantile (0 <= q <= 1), or None if empty."""
+        if self.count == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError("q must be in [0, 1]")
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self._zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self._positive)) if self._positive else 0.0
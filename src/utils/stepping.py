@@ -0,0 +1,159 @@
+"""
+Server-side stepping: stop conditions and per-interval aggregation.
+
+`StopConditions` decides when a run that advances the simulation without a
+client round trip per step should end; `IntervalAggregator` folds per-step
+observations into fixed simulation-time intervals so the answer size depends
+on the simulated span, not on the number of steps.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.online_kpi import HALTING_SPEED
+from utils.stats import RunningStats
+
+# Wall-clock cap applied when a run has no time, step or wall-clock target of its own.
+DEFAULT_MAX_WALL_S = float(os.environ.get("SUMO_MCP_RUN_UNTIL_MAX_WALL_S", "300"))
+DEFAULT_INTERVAL_S = 60.0
+
+
+def _optional_number(params: Dict[str, Any], *names: str, cast: Any = float) -> Optional[Any]:
+    for name in names:
+        value = params.get(name)
+        if value is not None:
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be a number, got {value!r}") from None
+    return None
+
+
+@dataclass
+class StopConditions:
+    """When to stop advancing; the first condition that holds wins."""
+
+    until_time: Optional[float] = None          # simulation time [s] to reach
+    max_steps: Optional[int] = None             # steps to run
+    no_vehicles: bool = False                   # nothing running and nothing left to insert
+    vehicles_at_least: Optional[int] = None     # running vehicles >= threshold
+    vehicles_at_most: Optional[int] = None      # running vehicles <= threshold
+    max_wall_s: Optional[float] = None          # wall-clock budget [s]
+
+    def __post_init__(self) -> None:
+        for name in ("max_steps", "vehicles_at_least", "vehicles_at_most", "max_wall_s"):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                raise ValueError(f"{name} must be >= 0, got {value}")
+        if self.until_time is None and self.max_steps is None and self.max_wall_s is None:
+            if not (self.no_vehicles or self.vehicles_at_least is not None or self.vehicles_at_most is not None):
+                raise ValueError(
+                    "No stop condition given; set until_time, steps, no_vehicles, "
+                    "vehicles_at_least, vehicles_at_most or max_wall_s"
+                )
+            # Vehicle conditions alone may never hold.
+            self.max_wall_s = DEFAULT_MAX_WALL_S
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any]) -> "StopConditions":
+        no_vehicles = params.get("no_vehicles", params.get("stop_when_empty", False))
+        if isinstance(no_vehicles, str):
+            no_vehicles = no_vehicles.strip().lower() in ("1", "true", "yes")
+        return cls(
+            until_time=_optional_number(params, "until_time", "time"),
+            max_steps=_optional_number(params, "steps", "max_steps", cast=int),
+            no_vehicles=bool(no_vehicles),
+            vehicles_at_least=_optional_number(params, "vehicles_at_least", cast=int),
+            vehicles_at_most=_optional_number(params, "vehicles_at_most", cast=int),
+            max_wall_s=_optional_number(params, "max_wall_s", "wall_s"),
+        )
+
+    @property
+    def needs_min_expected(self) -> bool:
+        return self.no_vehicles
+
+    def reached(
+        self, time: float, steps: int, vehicles: Optional[int], min_expected: Optional[int], wall_s: float
+    ) -> Optional[str]:
+        """Return the reason to stop, or None to keep stepping."""
+        if self.until_time is not None and time >= self.until_time - 1e-9:
+            return f"reached time {self.until_time:g}"
+        if self.max_steps is not None and steps >= self.max_steps:
+            return f"ran {self.max_steps} steps"
+        if self.no_vehicles and min_expected == 0:
+            return "no vehicles expected"
+        if self.vehicles_at_least is not None and vehicles is not None and vehicles >= self.vehicles_at_least:
+            return f"vehicle count {vehicles} >= {self.vehicles_at_least}"
+        if self.vehicles_at_most is not None and vehicles is not None and vehicles <= self.vehicles_at_most:
+            return f"vehicle count {vehicles} <= {self.vehicles_at_most}"
+        if self.max_wall_s is not None and wall_s >= self.max_wall_s:
+            return f"wall-clock budget {self.max_wall_s:g}s used"
+        return None
+
+
+class _Interval:
+    __slots__ = ("index", "steps", "vehicles", "speed", "halting", "departed", "arrived")
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.steps = 0
+        self.vehicles = RunningStats()
+        self.speed = RunningStats()
+        self.halting = RunningStats()
+        self.departed = 0
+        self.arrived = 0
+
+
+class IntervalAggregator:
+    """Per-interval vehicle count, speed, halting and departure/arrival totals."""
+
+    def __init__(self, interval_s: float = DEFAULT_INTERVAL_S) -> None:
+        if interval_s <= 0:
+            raise ValueError(f"interval_s must be > 0, got {interval_s}")
+        self.interval_s = interval_s
+        self.intervals: List[_Interval] = []
+
+    def add(
+        self,
+        time: float,
+        vehicles: int,
+        speeds: Optional[np.ndarray] = None,
+        departed: int = 0,
+        arrived: int = 0,
+    ) -> None:
+        """Fold one step that ended at simulation time `time`; steps ending on a boundary close the interval."""
+        index = max(0, math.ceil(time / self.interval_s - 1e-9) - 1)
+        if not self.intervals or self.intervals[-1].index != index:
+            self.intervals.append(_Interval(index))
+        current = self.intervals[-1]
+        current.steps += 1
+        current.vehicles.add(float(vehicles))
+        if speeds is not None:
+            current.speed.add_array(speeds)
+            current.halting.add(float(np.count_nonzero(speeds < HALTING_SPEED)))
+        current.departed += departed
+        current.arrived += arrived
+
+    def format(self) -> str:
+        if not self.intervals:
+            return "No steps run."
+        lines = [
+            f"Intervals ({self.interval_s:g}s):",
+            f"{'begin':>9}{'end':>9}{'steps':>7}{'veh_mean':>10}{'veh_max':>9}"
+            f"{'speed':>8}{'halting':>9}{'departed':>10}{'arrived':>9}",
+        ]
+        for iv in self.intervals:
+            begin = iv.index * self.interval_s
+            speed = f"{iv.speed.mean:.2f}" if iv.speed.count else "-"
+            halting = f"{iv.halting.mean:.2f}" if iv.halting.count else "-"
+            lines.append(
+                f"{begin:>9g}{begin + self.interval_s:>9g}{iv.steps:>7}{iv.vehicles.mean:>10.2f}"
+                f"{iv.vehicles.max:>9.0f}{speed:>8}{halting:>9}{iv.departed:>10}{iv.arrived:>9}"
+            )
+        return "\n".join(lines)
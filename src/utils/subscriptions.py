@@ -0,0 +1,150 @@
+"""
+Fleet-wide vehicle state through TraCI subscriptions that persist across steps.
+
+One junction context subscription with a radius covering the whole network
+returns the subscribed variables of every vehicle on the road network. SUMO
+pushes the results with every `simulationStep` reply, so reading a full-fleet
+snapshot needs no request of its own instead of one round trip per vehicle
+and variable. Simulation variables (e.g. the current time) ride along the same
+way. Vehicles that are teleporting are not on a lane and therefore not listed.
+
+`VehicleDeltaTracker` folds the per-step departed/arrived id lists of the
+simulation subscription, so vehicle list queries can answer with the change
+since the previous query instead of the whole fleet.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import traci.constants as tc
+
+VEHICLE_STATE_VARS = {
+    "speed": tc.VAR_SPEED,
+    "position": tc.VAR_POSITION,
+    "lane": tc.VAR_LANE_ID,
+    "acceleration": tc.VAR_ACCELERATION,
+    "route_index": tc.VAR_ROUTE_INDEX,
+    "edge": tc.VAR_ROAD_ID,
+    "angle": tc.VAR_ANGLE,
+}
+DEFAULT_VEHICLE_STATE_VARS = ("speed", "position", "lane", "acceleration", "route_index")
+
+
+def parse_state_variables(variables: Optional[Iterable[str] | str]) -> List[str]:
+    """Normalize a variable selection (list or comma-separated string); None selects the defaults."""
+    if variables is None:
+        return list(DEFAULT_VEHICLE_STATE_VARS)
+    if isinstance(variables, str):
+        variables = [v.strip() for v in variables.split(",")]
+    selected = list(dict.fromkeys(v for v in variables if v))
+    unknown = [v for v in selected if v not in VEHICLE_STATE_VARS]
+    if unknown:
+        raise ValueError(
+            f"Unknown vehicle variable(s) {', '.join(unknown)}. Available: {', '.join(VEHICLE_STATE_VARS)}"
+        )
+    return selected or list(DEFAULT_VEHICLE_STATE_VARS)
+
+
+class VehicleStateSubscription:
+    """Per-session subscription set; variables only grow, so earlier readers keep their columns."""
+
+    def __init__(self) -> None:
+        self.variables: List[str] = []
+        self.sim_variables: List[int] = []
+        self._anchor: Optional[str] = None
+        self._radius = 0.0
+
+    def ensure(self, conn: Any, variables: Sequence[str], sim_variables: Sequence[int] = (tc.VAR_TIME,)) -> None:
+        """Subscribe `variables` (names of VEHICLE_STATE_VARS) and `sim_variables`; no-op when already covered."""
+        missing = [v for v in variables if v not in self.variables]
+        if missing:
+            if self._anchor is None:
+                self._anchor, self._radius = self._pick_anchor(conn)
+            self.variables.extend(missing)
+            conn.junction.subscribeContext(
+                self._anchor,
+                tc.CMD_GET_VEHICLE_VARIABLE,
+                self._radius,
+                [VEHICLE_STATE_VARS[v] for v in self.variables],
+            )
+        missing_sim = [v for v in sim_variables if v not in self.sim_variables]
+        if missing_sim:
+            self.sim_variables.extend(missing_sim)
+            conn.simulation.subscribe(self.sim_variables)
+
+    @staticmethod
+    def _pick_anchor(conn: Any) -> tuple[str, float]:
+        junctions = [j for j in conn.junction.getIDList() if not j.startswith(":")]
+        if not junctions:
+            raise RuntimeError("The network has no junction to anchor the vehicle subscription.")
+        (x0, y0), (x1, y1) = conn.simulation.getNetBoundary()
+        # Any radius >= the boundary diagonal covers every vehicle from any anchor inside it.
+        return junctions[0], math.hypot(x1 - x0, y1 - y0) + 1.0
+
+    def time(self, conn: Any) -> float:
+        return float(conn.simulation.getSubscriptionResults().get(tc.VAR_TIME, math.nan))
+
+    def simulation_value(self, conn: Any, var: int, default: Any = None) -> Any:
+        return conn.simulation.getSubscriptionResults().get(var, default)
+
+    def read(
+        self, conn: Any, variables: Sequence[str], vehicle_ids: Optional[Iterable[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """Current `variables` of all (or the given) vehicles, from the last step's subscription results."""
+        if self._anchor is None:
+            return {}
+        results = conn.junction.getContextSubscriptionResults(self._anchor) or {}
+        codes = [(name, VEHICLE_STATE_VARS[name]) for name in variables]
+        if vehicle_ids is None:
+            items: Iterable[tuple[str, Dict[int, Any]]] = results.items()
+        else:
+            items = ((vid, results[vid]) for vid in vehicle_ids if vid in results)
+        return {vid: {name: values[code] for name, code in codes} for vid, values in items}
+
+
+_DELTA_SIM_VARS = (tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS)
+
+
+class VehicleDeltaTracker:
+    """
+    Departed/arrived vehicle ids accumulated over the steps since the last `drain()`.
+
+    Tracking starts with `start()`, which returns the current fleet as the baseline. A vehicle
+    that departs and arrives between two drains is reported in neither list.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self.since = math.nan
+        self._departed: Dict[str, None] = {}
+        self._arrived: Dict[str, None] = {}
+
+    def start(self, conn: Any, subscription: VehicleStateSubscription) -> List[str]:
+        subscription.ensure(conn, (), sim_variables=_DELTA_SIM_VARS)
+        self.active = True
+        self.since = subscription.time(conn)
+        self._departed.clear()
+        self._arrived.clear()
+        return list(conn.vehicle.getIDList())
+
+    def observe(self, conn: Any, subscription: VehicleStateSubscription) -> None:
+        """Fold the departures and arrivals of the step that just finished."""
+        if not self.active:
+            return
+        for vid in subscription.simulation_value(conn, tc.VAR_DEPARTED_VEHICLES_IDS, ()):
+            self._departed[vid] = None
+        for vid in subscription.simulation_value(conn, tc.VAR_ARRIVED_VEHICLES_IDS, ()):
+            if vid in self._departed:
+                del self._departed[vid]
+            else:
+                self._arrived[vid] = None
+
+    def drain(self, now: float) -> tuple[float, List[str], List[str]]:
+        """Return (since, departed, arrived) and start a new delta at `now`."""
+        since, departed, arrived = self.since, list(self._departed), list(self._arrived)
+        self._departed.clear()
+        self._arrived.clear()
+        self.since = now
+        return since, departed, arrived
@@ -0,0 +1,165 @@
+"""
+Tail-follow incremental analysis of SUMO output that is still being written.
+
+A `TailFollower` keeps, per output file, the byte offset parsed so far, a live
+expat parser (which buffers any element cut off at the current end of file)
+and the partial aggregates. Each `poll()` parses only the bytes appended since
+the previous call. Followers live in-process, keyed by absolute path. A file
+that shrinks, is replaced (new inode), is older than at the last poll, or whose
+first bytes changed (SUMO rewrote it in place; its header names the run's start
+time) starts over from the beginning, as does a follower whose parser failed.
+
+Supported outputs are plain-XML FCD (`FCDSpeedSummary`) and edgeData
+(`EdgeDataSummary`).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import xml.parsers.expat
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Union
+
+from utils.edgedata import EdgeDataSummary, make_edgedata_parser
+from utils.fcd import FCD_READ_CHUNK_BYTES, FCDSpeedSummary, detect_fcd_format, make_fcd_parser
+
+TAIL_KINDS = ("fcd", "edgedata")
+_SNIFF_BYTES = 4096
+# Leading bytes compared between polls to notice a rerun written into the same file.
+_FINGERPRINT_BYTES = 512
+
+# Followers kept at once, least recently polled first; a follower whose file is gone is dropped.
+TAIL_FOLLOWERS_MAX = int(os.environ.get("SUMO_MCP_TAIL_FOLLOWERS_MAX", "32"))
+_followers_lock = threading.Lock()
+_followers: "OrderedDict[str, TailFollower]" = OrderedDict()
+
+
+def detect_output_kind(path: str) -> str:
+    """Return "fcd" or "edgedata" from the root element of a plain-XML SUMO output."""
+    if detect_fcd_format(path) != "xml":
+        raise ValueError(f"Tail-follow needs plain XML output; {path} is compressed or tabular")
+    with open(path, "rb") as f:
+        head = f.read(_SNIFF_BYTES)
+    if b"<fcd-export" in head:
+        return "fcd"
+    if b"<meandata" in head or b"<edgeData" in head:
+        return "edgedata"
+    raise ValueError(f"Cannot tell the output type of {path}; pass kind='fcd' or kind='edgedata'")
+
+
+class TailFollower:
+    """Incremental parser state for one growing output file."""
+
+    def __init__(self, path: str, kind: str) -> None:
+        if kind not in TAIL_KINDS:
+            raise ValueError(f"Unknown output kind '{kind}'. Available: {', '.join(TAIL_KINDS)}")
+        self.path = path
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.polls = 0
+        self._reset(None)
+
+    def _reset(self, identity: Optional[Tuple[int, int]]) -> None:
+        self.offset = 0
+        self.identity = identity
+        self.mtime_ns = 0
+        self.head = b""
+        self.summary: Union[FCDSpeedSummary, EdgeDataSummary]
+        if self.kind == "fcd":
+            self.summary = FCDSpeedSummary()
+            self._parser: Any = make_fcd_parser(self.summary)
+        else:
+            self.summary = EdgeDataSummary()
+            self._parser = make_edgedata_parser(self.summary)
+
+    def poll(self) -> Tuple[int, bool]:
+        """
+        Parse the bytes appended since the last poll.
+
+        Returns:
+            (new_bytes, restarted) where `restarted` tells that the file was truncated or
+            replaced and the aggregates were rebuilt from the start.
+        """
+        with self.lock:
+            st = os.stat(self.path)
+            identity = (st.st_dev, st.st_ino)
+            restarted = False
+            if self.identity is None:
+                self.identity = identity
+            elif (
+                identity != self.identity
+                or st.st_size < self.offset
+                or st.st_mtime_ns < self.mtime_ns
+                or not self._same_head()
+            ):
+                self._reset(identity)
+                restarted = True
+
+            start = self.offset
+            try:
+                self._consume(st.st_size)
+            except xml.parsers.expat.ExpatError:
+                # The bytes parsed so far and the new ones do not belong together (or the parser state
+                # is unusable); rebuild from the start instead of staying broken.
+                self._reset(identity)
+                restarted, start = True, 0
+                try:
+                    self._consume(st.st_size)
+                except xml.parsers.expat.ExpatError as e:
+                    self._reset(identity)
+                    raise ValueError(f"{self.path} is not well-formed XML: {e}") from e
+            self.mtime_ns = st.st_mtime_ns
+            self.polls += 1
+            return self.offset - start, restarted
+
+    def _same_head(self) -> bool:
+        if not self.head:
+            return True
+        with open(self.path, "rb") as f:
+            return f.read(len(self.head)) == self.head
+
+    def _consume(self, size: int) -> None:
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = size - self.offset
+            while remaining > 0:
+                data = f.read(min(FCD_READ_CHUNK_BYTES, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                # isfinal=False: the writer may still be inside an element or before the root end tag.
+                self._parser.Parse(data, False)
+                if len(self.head) < _FINGERPRINT_BYTES:
+                    self.head += data[: _FINGERPRINT_BYTES - len(self.head)]
+                self.offset += len(data)
+
+
+def follow_output(path: str, kind: Optional[str] = None, reset: bool = False) -> Tuple[TailFollower, int, bool]:
+    """
+    Poll the follower for `path`, creating it on first use.
+
+    Returns:
+        (follower, new_bytes, restarted)
+    """
+    key = os.path.abspath(path)
+    with _followers_lock:
+        follower = None if reset else _followers.get(key)
+        if follower is not None and kind is not None and follower.kind != kind:
+            follower = None
+        if follower is None:
+            follower = TailFollower(path, kind or detect_output_kind(path))
+            _followers[key] = follower
+        _followers.move_to_end(key)
+        for other in [k for k in _followers if not os.path.exists(k)]:
+            del _followers[other]
+        while len(_followers) > max(1, TAIL_FOLLOWERS_MAX):
+            _followers.popitem(last=False)
+    new_bytes, restarted = follower.poll()
+    return follower, new_bytes, restarted
+
+
+def forget_output(path: str) -> bool:
+    """Drop the follower state of `path`; returns whether one existed."""
+    with _followers_lock:
+        return _followers.pop(os.path.abspath(path), None) is not None
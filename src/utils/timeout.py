@@ -15,7 +15,9 @@ import sys
 import threading
 import time
 from dataclasses import dataclass
-from typing import Any, Callable, Optional, TypeVar
+from typing import Any, Callable, List, Optional, TypeVar
+
+from utils.cancellation import bind_context, on_cancel, raise_if_cancelled, report_progress
 
 logger = logging.getLogger(__name__)
 
@@ -220,7 +222,10 @@ def run_with_adaptive_timeout(
         # 在后台线程中运行，主线程监控心跳
         result_container: dict = {"result": None, "error": None, "done": False}
 
-        heartbeat = executor.heartbeat
+        def heartbeat() -> None:
+            executor.heartbeat()
+            # Also keeps a background job running this operation marked as alive.
+            report_progress()
 
         def _call_func() -> T:
             try:
@@ -256,8 +261,11 @@ def run_with_adaptive_timeout(
             finally:
                 result_container["done"] = True
 
-        thread = threading.Thread(target=worker, daemon=True)
+        # bind_context: the thread sees the cancellation token of the calling request.
+        thread = threading.Thread(target=bind_context(worker), daemon=True)
         thread.start()
+        # A client cancelling the request stops training like a stall does.
+        on_cancel(request_cancel)
 
         start_time = time.time()
         poll_interval = min(1.0, max(0.1, config.heartbeat_interval / 10))
@@ -295,7 +303,8 @@ def run_with_adaptive_timeout(
             finally:
                 result_container["done"] = True
 
-        thread = threading.Thread(target=worker, daemon=True)
+        # bind_context: the thread sees the cancellation token of the calling request.
+        thread = threading.Thread(target=bind_context(worker), daemon=True)
         thread.start()
         thread.join(timeout=timeout)
 
@@ -351,7 +360,7 @@ def subprocess_run_with_timeout(
             kwargs.setdefault("creationflags", subprocess.CREATE_NO_WINDOW)
 
     try:
-        return subprocess.run(cmd, timeout=timeout, **kwargs)
+        return _run_cancellable(cmd, timeout, **kwargs)
     except subprocess.TimeoutExpired as e:
         logger.warning(
             "Command timed out after %.1fs: %s",
@@ -362,3 +371,35 @@ def subprocess_run_with_timeout(
             f"This may indicate a very large input or a hanging process. "
             f"Consider breaking down the operation or increasing timeout limits."
         ) from e
+
+
+def _run_cancellable(
+    cmd: List[str],
+    timeout: float,
+    check: bool = False,
+    capture_output: bool = False,
+    input: Any = None,
+    **kwargs: Any,
+) -> "subprocess.CompletedProcess[Any]":
+    """`subprocess.run` that also kills the process when the calling request is cancelled."""
+    raise_if_cancelled()
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    with subprocess.Popen(cmd, **kwargs) as process:
+        unregister = on_cancel(process.kill)
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            unregister()
+        returncode = process.wait()
+    raise_if_cancelled()
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, process.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
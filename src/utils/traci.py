@@ -1,9 +1,21 @@
 from __future__ import annotations
 
+import contextlib
 import inspect
+import os
 import subprocess
+import sys
 import threading
-from typing import Any, Callable, Optional
+from types import ModuleType
+from typing import Any, Callable, Optional, Tuple
+
+TRACI_BACKENDS = ("traci", "libsumo")
+DEFAULT_TRACI_BACKEND = os.environ.get("SUMO_MCP_TRACI_BACKEND", "traci")
+
+_libsumo: Optional[ModuleType] = None
+_libsumo_error: Optional[str] = None
+# libsumo embeds SUMO in this process and can run a single simulation at a time.
+_libsumo_lock = threading.Lock()
 
 
 def ensure_traci_start_stdout_suppressed() -> None:
@@ -55,10 +67,12 @@ def ensure_traci_start_stdout_suppressed() -> None:
     traci.start = _start  # type: ignore[attr-defined]
 
 
-def traci_close_best_effort(timeout_s: float = 5.0) -> bool:
+def traci_close_best_effort(timeout_s: float = 5.0, label: Optional[str] = None) -> bool:
     """
     Best-effort close TraCI without risking an indefinite hang.
 
+    Closes the connection registered under `label`, or the current default connection.
+
     Returns:
         True if `traci.close()` finished within timeout_s, else False.
     """
@@ -71,7 +85,10 @@ def traci_close_best_effort(timeout_s: float = 5.0) -> bool:
 
     def _close() -> None:
         try:
-            traci.close()
+            if label is None:
+                traci.close()
+            else:
+                traci.getConnection(label).close()
         except Exception:
             pass
         finally:
@@ -80,3 +97,66 @@ def traci_close_best_effort(timeout_s: float = 5.0) -> bool:
     thread = threading.Thread(target=_close, daemon=True, name="sumo-mcp:traci.close")
     thread.start()
     return done.wait(timeout_s)
+
+
+def load_libsumo() -> Optional[ModuleType]:
+    """
+    Import libsumo once; returns None when it is not installed.
+
+    The import banner is sent to stderr: stdout carries the MCP JSON-RPC stream.
+    """
+    global _libsumo, _libsumo_error
+    if _libsumo is None and _libsumo_error is None:
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                import libsumo
+            _libsumo = libsumo
+        except Exception as e:
+            _libsumo_error = f"{type(e).__name__}: {e}"
+    return _libsumo
+
+
+def require_libsumo() -> ModuleType:
+    """The libsumo module, for callers that hold the in-process slot from `acquire_backend`."""
+    libsumo = load_libsumo()
+    if libsumo is None:
+        raise RuntimeError(f"libsumo is not available ({_libsumo_error})")
+    return libsumo
+
+
+def acquire_backend(
+    requested: Optional[str], gui: bool = False, attach: bool = False
+) -> Tuple[str, Optional[str]]:
+    """
+    Resolve the requested TraCI backend, falling back to socket TraCI when libsumo cannot be used.
+
+    A successful "libsumo" result holds the in-process simulation slot until `release_libsumo()`.
+
+    Returns:
+        (backend, fallback_reason) where fallback_reason is None unless libsumo was requested but not used.
+    """
+    backend = (requested or DEFAULT_TRACI_BACKEND).strip().lower()
+    if backend not in TRACI_BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Available: {', '.join(TRACI_BACKENDS)}")
+    if backend == "traci":
+        return "traci", None
+    if gui:
+        return "traci", "libsumo has no GUI"
+    if attach:
+        return "traci", "libsumo cannot attach to a running SUMO"
+    if load_libsumo() is None:
+        return "traci", f"libsumo is not available ({_libsumo_error})"
+    if not _libsumo_lock.acquire(blocking=False):
+        return "traci", "libsumo is already running a simulation in this process"
+    return "libsumo", None
+
+
+def release_libsumo() -> None:
+    if _libsumo_lock.locked():
+        _libsumo_lock.release()
+
+
+def libsumo_status() -> str:
+    if load_libsumo() is None:
+        return f"not available ({_libsumo_error})"
+    return "in use" if _libsumo_lock.locked() else "available"
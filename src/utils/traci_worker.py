@@ -0,0 +1,197 @@
+"""
+Dedicated TraCI I/O worker (one per simulation session).
+
+A TraCI connection is a single blocking socket, so all requests for a session
+are executed in submission order by one long-lived thread fed from a queue.
+Callers wait on a `Future` with their own timeout:
+
+- a request that times out while still queued is cancelled and never runs;
+- a request that times out while running leaves the connection in an unknown
+  protocol state; the owner aborts the socket, which unblocks the worker.
+
+The worker thread ends after `stop()`, once the request it is running (if any)
+returns, so no thread outlives its session. Queue depth, queue wait and
+execution latency are kept in `WorkerStats`.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from utils.stats import RunningStats
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class WorkerStats:
+    """Request counters and latency aggregates of one worker (seconds)."""
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.max_depth = 0
+        self.wait = RunningStats()     # enqueue -> start
+        self.run = RunningStats()      # start -> finish
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "timeouts": self.timeouts,
+            "max_depth": self.max_depth,
+            "wait_mean_ms": self.wait.mean * 1000.0 if self.wait.count else 0.0,
+            "wait_max_ms": self.wait.max * 1000.0 if self.wait.count else 0.0,
+            "run_mean_ms": self.run.mean * 1000.0 if self.run.count else 0.0,
+            "run_max_ms": self.run.max * 1000.0 if self.run.count else 0.0,
+        }
+
+
+class _Request:
+    __slots__ = ("func", "description", "future", "enqueued_at")
+
+    def __init__(self, func: Callable[[], Any], description: str) -> None:
+        self.func = func
+        self.description = description
+        self.future: Future[Any] = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class TraCIWorker:
+    """Single thread executing queued TraCI requests in order."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.stats = WorkerStats()
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stopped = False
+        self.current: Optional[str] = None
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"sumo-mcp:traci:{name}")
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        """Requests waiting to run (excluding the running one)."""
+        return self._queue.qsize()
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(self, func: Callable[[], T], description: str) -> "Future[T]":
+        if self._stopped:
+            raise RuntimeError(f"TraCI worker '{self.name}' is stopped.")
+        request = _Request(func, description)
+        with self._stats_lock:
+            self.stats.submitted += 1
+            self._queue.put(request)
+            self.stats.max_depth = max(self.stats.max_depth, self._queue.qsize())
+        return request.future
+
+    def call(self, func: Callable[[], T], description: str, timeout_s: float) -> T:
+        """
+        Submit `func` and wait for its result.
+
+        Raises:
+            TimeoutError: the request did not finish within `timeout_s`. Its message tells whether
+                it was cancelled while queued or is still running on the connection.
+        """
+        return self.wait(self.submit(func, description), description, timeout_s)
+
+    def wait(self, future: "Future[T]", description: str, timeout_s: float) -> T:
+        """Wait for a submitted request; see `call`."""
+        try:
+            return future.result(timeout=timeout_s)
+        except FutureTimeoutError:
+            with self._stats_lock:
+                self.stats.timeouts += 1
+            if future.cancel():
+                with self._stats_lock:
+                    self.stats.cancelled += 1
+                raise TimeoutError(
+                    f"TimeoutError: {self.name}:{description} still queued after {timeout_s:.1f}s; request cancelled"
+                ) from None
+            raise TimeoutError(f"TimeoutError: {self.name}:{description} timed out after {timeout_s:.1f}s") from None
+        except CancelledError:
+            raise RuntimeError(f"{self.name}:{description} was cancelled before it ran.") from None
+
+    def cancel_pending(self) -> int:
+        """Cancel every queued request that has not started; returns how many were cancelled."""
+        cancelled = 0
+        kept = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and item.future.cancel():
+                cancelled += 1
+            elif item is _STOP:
+                kept.append(item)
+        for item in kept:
+            self._queue.put(item)
+        with self._stats_lock:
+            self.stats.cancelled += cancelled
+        return cancelled
+
+    def stop(self, cancel_pending: bool = True) -> None:
+        """Let the thread exit after the running request; queued requests are cancelled or drained first."""
+        if self._stopped:
+            return
+        self._stopped = True
+        if cancel_pending:
+            self.cancel_pending()
+        self._queue.put(_STOP)
+
+    def join(self, timeout_s: Optional[float] = None) -> bool:
+        self._thread.join(timeout_s)
+        return not self._thread.is_alive()
+
+    def _loop(self) -> None:
+        while True:
+            request = self._queue.get()
+            if request is _STOP:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            self.current = request.description
+            try:
+                result = request.func()
+            except BaseException as exc:
+                ok = False
+                request.future.set_exception(exc)
+            else:
+                ok = True
+                request.future.set_result(result)
+            finally:
+                self.current = None
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self.stats.wait.add(started - request.enqueued_at)
+                self.stats.run.add(finished - started)
+                if ok:
+                    self.stats.completed += 1
+                else:
+                    self.stats.failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats plus the live queue depth and running request."""
+        with self._stats_lock:
+            data = self.stats.as_dict()
+        data["depth"] = self.depth
+        data["running"] = self.current
+        data["alive"] = self.alive
+        return data
@@ -0,0 +1,426 @@
+"""
+Worker processes that own simulation sessions and run CPU-heavy tool bodies.
+
+In one process all TraCI decoding, pandas analysis and RL agent logic share a
+single GIL. With `SUMO_MCP_WORKER_PROCESSES` > 0 the MCP front end keeps only
+the transport and hands tool bodies to a pool of worker processes:
+
+- session calls go to the worker that owns the session (`route="session"`);
+  new sessions (`"open"`) go to the worker with the fewest sessions, and a
+  fork stays with the worker of its source;
+- stateless calls (`"any"`) go to the least busy worker;
+- calls that benefit from per-process caches (`"pinned"`, e.g. analysis of
+  one FCD file and its index) always go to the worker picked by their key;
+- calls about all sessions (`"all"`, e.g. listing them) go to every worker
+  and return one answer per worker, for the caller to merge.
+
+Every reply carries the worker's RSS and its open sessions, so the routing
+table follows connects, forks, disconnects and idle closes without extra
+requests. A worker retires after `SUMO_MCP_WORKER_MAX_JOBS` calls or once
+its RSS exceeds `SUMO_MCP_WORKER_MAX_RSS_MB`: it gets no new stateless work
+or sessions, and is replaced by a fresh process once its calls have finished
+and its sessions are closed (sessions are never moved). A worker that dies
+fails its in-flight calls and is replaced at once.
+
+Workers are not daemonic, so they may start their own process pools (the
+parallel FCD parsers); `shutdown` stops them and runs at interpreter exit.
+
+Cancellation and progress cross the process boundary: cancelling the waiting
+call cancels the call's `CancelToken` in the worker, and `report_progress`
+in the worker reaches the token of the waiting call (e.g. a background job).
+"""
+
+from __future__ import annotations
+
+import functools
+import importlib
+import inspect
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import threading
+import zlib
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.cancellation import CancelToken, current_token, on_cancel, run_with_token
+from utils.connection import DEFAULT_SESSION_ID, MAX_SESSIONS, client_scope, connection_manager, current_client
+
+logger = logging.getLogger(__name__)
+
+# 0 runs every tool body in the server process.
+WORKER_PROCESSES = int(os.environ.get("SUMO_MCP_WORKER_PROCESSES", "0"))
+# Calls served before a worker is recycled.
+WORKER_MAX_JOBS = int(os.environ.get("SUMO_MCP_WORKER_MAX_JOBS", "200"))
+# Resident memory [MiB] above which a worker is recycled (0 disables the check).
+WORKER_MAX_RSS_MB = float(os.environ.get("SUMO_MCP_WORKER_MAX_RSS_MB", "2048"))
+
+ROUTES = ("any", "session", "open", "all", "pinned")
+_SessionKey = Tuple[Optional[str], str]
+
+
+class WorkerPoolError(RuntimeError):
+    """The pool could not run a call (worker died, session limit reached)."""
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        # Peak instead of current RSS; KiB on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _resolve(target: Tuple[str, str]) -> Any:
+    module, name = target
+    # Tools are registered wrapped (thread offload, client scope, routing); run the plain body.
+    return inspect.unwrap(getattr(importlib.import_module(module), name))
+
+
+def _portable(exc: BaseException) -> BaseException:
+    """`exc` if it survives pickling, else a RuntimeError carrying its text."""
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+
+
+def _worker_status() -> Dict[str, Any]:
+    return {
+        "rss_mb": _rss_mb(),
+        "sessions": [(s.client, s.session_id) for s in connection_manager.list_sessions(all_clients=True)],
+    }
+
+
+def _worker_main(conn: Any, session_idle_s: float) -> None:
+    # The server's stdout may be the MCP stdio channel; keep this process and its SUMO children off it.
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    if session_idle_s > 0:
+        connection_manager.start_idle_reaper(session_idle_s)
+    send_lock = threading.Lock()
+    tokens: Dict[int, CancelToken] = {}
+
+    def send(message: Tuple[Any, ...]) -> None:
+        with send_lock:
+            conn.send(message)
+
+    def run(call_id: int, target: Tuple[str, str], args: Tuple[Any, ...], kwargs: Dict[str, Any],
+            client: Optional[str]) -> None:
+        try:
+            func = _resolve(target)
+            with client_scope(client):
+                value = run_with_token(tokens[call_id], functools.partial(func, *args, **kwargs))
+            ok = True
+        except BaseException as e:
+            ok, value = False, _portable(e)
+        tokens.pop(call_id, None)
+        send(("result", call_id, ok, value, _worker_status()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == "call":
+            _, call_id, target, args, kwargs, client = message
+            progress = functools.partial(lambda cid, text: send(("progress", cid, text)), call_id)
+            tokens[call_id] = CancelToken(progress=progress)
+            threading.Thread(
+                target=run, args=(call_id, target, args, kwargs, client), daemon=True, name=f"sumo-mcp:call-{call_id}"
+            ).start()
+        elif kind == "cancel":
+            token = tokens.get(message[1])
+            if token is not None:
+                token.cancel()
+        elif kind == "stop":
+            break
+
+    for session in connection_manager.list_sessions(all_clients=True):
+        try:
+            session.close()
+        except Exception as e:
+            logger.error(f"Error closing session {session.session_id} of a stopping worker: {e}")
+
+
+class _Worker:
+    """Parent-side handle of one worker process."""
+
+    def __init__(self, index: int, context: Any, session_idle_s: float) -> None:
+        self.index = index
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, session_idle_s), daemon=False, name=f"sumo-mcp:worker-{index}"
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.jobs = 0
+        self.rss_mb = 0.0
+        self.sessions: Set[_SessionKey] = set()
+        self.opening: Dict[int, _SessionKey] = {}
+        self.pending: Dict[int, Tuple[Future[Tuple[bool, Any]], Optional[CancelToken]]] = {}
+        self.retiring = False
+        self.stopping = False
+        self._send_lock = threading.Lock()
+
+    def send(self, message: Tuple[Any, ...]) -> None:
+        with self._send_lock:
+            self.conn.send(message)
+
+    def owned(self) -> Set[_SessionKey]:
+        return self.sessions | set(self.opening.values())
+
+    def describe(self) -> str:
+        state = "retiring" if self.retiring else "active"
+        return (
+            f"worker {self.index} (pid {self.process.pid}): {state}, {self.jobs} calls, "
+            f"{len(self.pending)} running, {self.rss_mb:.0f} MiB RSS, {len(self.sessions)} session(s)"
+        )
+
+
+class WorkerPool:
+    """Fixed number of worker processes plus the session routing table."""
+
+    def __init__(
+        self,
+        processes: int = WORKER_PROCESSES,
+        max_jobs: int = WORKER_MAX_JOBS,
+        max_rss_mb: float = WORKER_MAX_RSS_MB,
+        max_sessions: int = MAX_SESSIONS,
+        session_idle_s: float = 0.0,
+    ) -> None:
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.max_sessions = max_sessions
+        self.session_idle_s = session_idle_s
+        self.recycled = 0
+        self.crashed = 0
+        # Spawn, not fork: the parent runs an event loop and threads that must not be copied.
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._workers: List[_Worker] = [self._start(i) for i in range(max(1, processes))]
+
+    def _start(self, index: int) -> _Worker:
+        worker = _Worker(index, self._context, self.session_idle_s)
+        threading.Thread(
+            target=self._read, args=(worker,), daemon=True, name=f"sumo-mcp:worker-{index}:reader"
+        ).start()
+        logger.info("Started worker process %d (pid %s)", index, worker.process.pid)
+        return worker
+
+    # --- routing ---
+
+    def _least_busy(self, candidates: List[_Worker]) -> _Worker:
+        active = [w for w in candidates if not w.retiring] or candidates
+        return min(active, key=lambda w: (len(w.pending), len(w.owned())))
+
+    def _pick(self, route: str, client: Optional[str], session_id: Optional[str], call_id: int) -> List[_Worker]:
+        if route == "pinned":
+            return [self._workers[zlib.crc32((session_id or "").encode("utf-8")) % len(self._workers)]]
+        if route == "all":
+            return list(self._workers)
+        owners = {key: w for w in self._workers for key in w.owned()}
+        if route == "open":
+            key = (client, session_id or DEFAULT_SESSION_ID)
+            if key in owners:
+                return [owners[key]]
+            if len(owners) >= self.max_sessions:
+                raise WorkerPoolError(
+                    f"Session limit reached ({self.max_sessions}); disconnect a session or raise SUMO_MCP_MAX_SESSIONS."
+                )
+            worker = min(
+                [w for w in self._workers if not w.retiring] or self._workers,
+                key=lambda w: (len(w.owned()), len(w.pending)),
+            )
+            worker.opening[call_id] = key
+            return [worker]
+        if route == "session":
+            if session_id is not None:
+                key = (client, session_id)
+            else:
+                # Same implicit choice as the session manager: "default", else the only open session.
+                mine = [k for k in owners if k[0] == client]
+                key = (client, DEFAULT_SESSION_ID) if (client, DEFAULT_SESSION_ID) in owners else (
+                    mine[0] if len(mine) == 1 else (client, "")
+                )
+            if key in owners:
+                return [owners[key]]
+        # Unknown sessions land anywhere; the session manager there reports the error.
+        return [self._least_busy(self._workers)]
+
+    # --- calls ---
+
+    def call(
+        self,
+        target: Tuple[str, str],
+        args: Tuple[Any, ...] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        route: str = "any",
+        session_id: Optional[str] = None,
+    ) -> Any:
+        """
+        Run the tool body `target` (module, name) on a worker chosen by `route`; blocks for the result.
+
+        `session_id` is the session for "session"/"open" routes and the pin key for "pinned".
+        The "all" route returns the list of every worker's result.
+        """
+        if route not in ROUTES:
+            raise ValueError(f"route must be one of {', '.join(ROUTES)}, got {route!r}")
+        client = current_client()
+        token = current_token()
+        with self._lock:
+            if self._closed:
+                raise WorkerPoolError("Worker pool is shut down.")
+            base = next(self._ids)
+            workers = self._pick(route, client, session_id, base)
+            calls = []
+            for offset, worker in enumerate(workers):
+                call_id = base if offset == 0 else next(self._ids)
+                future: Future[Tuple[bool, Any]] = Future()
+                worker.pending[call_id] = (future, token)
+                calls.append((worker, call_id, future))
+        for worker, call_id, future in calls:
+            try:
+                worker.send(("call", call_id, target, args, kwargs or {}, client))
+            except (OSError, ValueError) as e:
+                self._finish(worker, call_id, False, WorkerPoolError(f"Worker {worker.index} is unavailable: {e}"))
+        values = [self._wait(worker, call_id, future) for worker, call_id, future in calls]
+        return values if route == "all" else values[0]
+
+    def _wait(self, worker: _Worker, call_id: int, future: Future[Tuple[bool, Any]]) -> Any:
+        def _cancel() -> None:
+            try:
+                worker.send(("cancel", call_id))
+            except (OSError, ValueError):
+                pass
+
+        unregister = on_cancel(_cancel)
+        try:
+            ok, value = future.result()
+        finally:
+            unregister()
+        if not ok:
+            raise value
+        return value
+
+    def _finish(self, worker: _Worker, call_id: int, ok: bool, value: Any) -> None:
+        with self._lock:
+            entry = worker.pending.pop(call_id, None)
+            worker.opening.pop(call_id, None)
+        if entry is not None:
+            entry[0].set_result((ok, value))
+
+    def _read(self, worker: _Worker) -> None:
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "progress":
+                _, call_id, text = message
+                entry = worker.pending.get(call_id)
+                if entry is not None and entry[1] is not None and entry[1].progress is not None:
+                    entry[1].progress(text)
+            elif message[0] == "result":
+                _, call_id, ok, value, status = message
+                with self._lock:
+                    worker.jobs += 1
+                    worker.rss_mb = status["rss_mb"]
+                    worker.sessions = {tuple(key) for key in status["sessions"]}
+                    if not worker.retiring and (
+                        worker.jobs >= self.max_jobs or (self.max_rss_mb > 0 and worker.rss_mb > self.max_rss_mb)
+                    ):
+                        worker.retiring = True
+                        logger.info("Retiring %s", worker.describe())
+                self._finish(worker, call_id, ok, value)
+                self._maybe_recycle(worker)
+        self._lost(worker)
+
+    def _maybe_recycle(self, worker: _Worker) -> None:
+        with self._lock:
+            if self._closed or not worker.retiring or worker.stopping or worker.pending or worker.owned():
+                return
+            worker.stopping = True
+            self._workers[self._workers.index(worker)] = self._start(worker.index)
+            self.recycled += 1
+        try:
+            worker.send(("stop",))
+        except (OSError, ValueError):
+            pass
+
+    def _lost(self, worker: _Worker) -> None:
+        worker.process.join(timeout=5)
+        with self._lock:
+            pending, worker.pending = worker.pending, {}
+            worker.opening.clear()
+            worker.sessions.clear()
+            replace = not worker.stopping and not self._closed and worker in self._workers
+            if replace:
+                self._workers[self._workers.index(worker)] = self._start(worker.index)
+                self.crashed += 1
+        if replace:
+            logger.error("Worker process %d exited with code %s; replaced.", worker.index, worker.process.exitcode)
+        error = WorkerPoolError(
+            f"Worker process {worker.index} exited (code {worker.process.exitcode}); its sessions are lost."
+        )
+        for future, _ in pending.values():
+            future.set_result((False, error))
+
+    def describe(self) -> List[str]:
+        with self._lock:
+            workers = list(self._workers)
+            recycled, crashed = self.recycled, self.crashed
+        lines = [
+            f"Worker pool: {len(workers)} process(es), recycled {recycled}, crashed {crashed} "
+            f"(max {self.max_jobs} calls, {self.max_rss_mb:g} MiB RSS)"
+        ]
+        lines.extend(w.describe() for w in workers)
+        return lines
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+            for worker in workers:
+                worker.stopping = True
+        for worker in workers:
+            try:
+                worker.send(("stop",))
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+
+_pool: Optional[WorkerPool] = None
+
+
+def start_worker_pool(processes: int = WORKER_PROCESSES, session_idle_s: float = 0.0) -> Optional[WorkerPool]:
+    """Start the process-wide pool (no-op for `processes` <= 0); call from the server's main block only."""
+    global _pool
+    if _pool is None and processes > 0:
+        _pool = WorkerPool(processes, session_idle_s=session_idle_s)
+        atexit.register(_pool.shutdown)
+    return _pool
+
+
+def get_worker_pool() -> Optional[WorkerPool]:
+    """The running pool; None when tool bodies run in this process (always so inside a worker)."""
+    return _pool
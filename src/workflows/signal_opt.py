@@ -3,11 +3,13 @@ import shutil
 import warnings
 import logging
 from filecmp import cmp
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from mcp_tools.simulation import run_simple_simulation
 from mcp_tools.signal import tls_cycle_adaptation, tls_coordinator
-from mcp_tools.analysis import analyze_fcd
+from mcp_tools.analysis import analyze_run_outputs, compare_trip_kpis
+from utils.cancellation import report_progress
+from utils.output_profiles import OutputFiles, OutputProfile, output_config_xml, prepare_outputs
 
 logger = logging.getLogger(__name__)
 
@@ -39,19 +41,39 @@ def signal_opt_workflow(
     route_file: str, 
     output_dir: str, 
     steps: int = 3600,
-    use_coordinator: bool = False
+    use_coordinator: bool = False,
+    output_format: str = "xml",
+    output_profile: str = "full",
+    profile_options: Optional[Dict[str, Any]] = None,
+    use_kpi: bool = True,
 ) -> str:
     """
     Signal Optimization Workflow.
     1. Run Baseline Simulation
     2. Optimize Signals (Cycle Adaptation or Coordinator)
     3. Run Optimized Simulation
-    4. Compare Results
+    4. Compare Results (trip KPIs from tripinfo/summary output when `use_kpi`)
 
     Note:
         To keep generated `.sumocfg` files portable (especially on Windows across drives),
         `net_file` and `route_file` will be copied into `output_dir` when needed.
+
+        `output_format` selects the FCD file format ("xml", "xml.gz", "csv", "csv.gz"
+        or "parquet"); compact formats cut the output size and are analyzed the same way.
+
+        `output_profile` ("full", "sampled" or "aggregate", see `utils.output_profiles`)
+        controls the output volume; `profile_options` carries its settings
+        (fcd_period, fcd_edges, fcd_vehicles, fcd_probability, aggregation_period).
+
+        With `use_kpi` (default) both runs also write tripinfo and summary output and are
+        compared on travel time, waiting time, time loss, throughput and teleports with
+        bootstrap confidence intervals (see `utils.kpi`).
     """
+    try:
+        profile = OutputProfile.from_options(output_profile, output_format, profile_options)
+    except (TypeError, ValueError) as e:
+        return f"Error: {e}"
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -60,22 +82,25 @@ def signal_opt_workflow(
         
     # Baseline paths
     baseline_cfg = os.path.join(output_dir, "baseline.sumocfg")
-    baseline_fcd = os.path.join(output_dir, "baseline_fcd.xml")
+    baseline_outputs = prepare_outputs(profile, output_dir, "baseline", trip_outputs=use_kpi)
     
     # Optimized paths
     opt_net_file = os.path.join(output_dir, "optimized.net.xml")
     opt_cfg = os.path.join(output_dir, "optimized.sumocfg")
-    opt_fcd = os.path.join(output_dir, "optimized_fcd.xml")
+    opt_outputs = prepare_outputs(profile, output_dir, "optimized", trip_outputs=use_kpi)
     
     # 1. Run Baseline
-    _create_config(baseline_cfg, local_net_file, local_route_file, baseline_fcd, steps)
+    report_progress("Step 1/4: baseline simulation")
+    _create_config(baseline_cfg, local_net_file, local_route_file, profile, baseline_outputs, steps)
     res_baseline = run_simple_simulation(baseline_cfg, steps)
     if "error" in res_baseline.lower():
         return f"Baseline Simulation Failed: {res_baseline}"
         
-    analysis_baseline = analyze_fcd(baseline_fcd)
+    analysis_baseline = analyze_run_outputs(profile, baseline_outputs)
     
     # 2. Optimize
+    report_progress("Step 2/4: optimizing signals")
+
     def _is_failure(result: str) -> bool:
         lowered = result.lower()
         return "failed" in lowered or "error" in lowered
@@ -118,30 +143,44 @@ def signal_opt_workflow(
         is_additional = _is_additional_file(opt_net_file)
     
     # 3. Run Optimized
+    report_progress("Step 3/4: optimized simulation")
     if is_additional:
         # Use original net + additional file
         _create_config(
             opt_cfg,
             local_net_file,
             local_route_file,
-            opt_fcd,
+            profile,
+            opt_outputs,
             steps,
             additional_files=[opt_net_file],
         )
     else:
         # Use new net file (or baseline net if optimization was skipped)
-        _create_config(opt_cfg, optimized_net_input, local_route_file, opt_fcd, steps)
+        _create_config(opt_cfg, optimized_net_input, local_route_file, profile, opt_outputs, steps)
         
     res_optimized = run_simple_simulation(opt_cfg, steps)
     if "error" in res_optimized.lower():
         return f"Optimized Simulation Failed: {res_optimized}"
         
-    analysis_optimized = analyze_fcd(opt_fcd)
-    
+    analysis_optimized = analyze_run_outputs(profile, opt_outputs)
+
+    report_progress("Step 4/4: comparing results")
+    comparison = ""
+    if use_kpi and baseline_outputs.tripinfo and opt_outputs.tripinfo:
+        kpis = compare_trip_kpis(
+            baseline_outputs.tripinfo,
+            opt_outputs.tripinfo,
+            baseline_outputs.summary,
+            opt_outputs.summary,
+        )
+        comparison = f"\n\n--- KPI Comparison ---\n{kpis}"
+
     return (f"Signal Optimization Workflow Completed.\n\n"
             f"--- Baseline Results ---\n{res_baseline}\n{analysis_baseline}\n\n"
             f"--- Optimization Step ---\n{res_opt}\n\n"
-            f"--- Optimized Results ---\n{res_optimized}\n{analysis_optimized}")
+            f"--- Optimized Results ---\n{res_optimized}\n{analysis_optimized}"
+            f"{comparison}")
 
 
 def _is_additional_file(file_path: str) -> bool:
@@ -155,7 +194,15 @@ def _is_additional_file(file_path: str) -> bool:
         return False
 
 
-def _create_config(cfg_path: str, net_file: str, route_file: str, fcd_file: str, steps: int, additional_files: Optional[List[str]] = None) -> None:
+def _create_config(
+    cfg_path: str,
+    net_file: str,
+    route_file: str,
+    profile: OutputProfile,
+    outputs: OutputFiles,
+    steps: int,
+    additional_files: Optional[List[str]] = None,
+) -> None:
     cfg_dir = os.path.dirname(os.path.abspath(cfg_path))
 
     def _as_cfg_path(file_path: str) -> str:
@@ -185,13 +232,14 @@ def _create_config(cfg_path: str, net_file: str, route_file: str, fcd_file: str,
         return rel_path
 
     additional_str = ""
+    additional_files = list(additional_files or []) + outputs.additional
     if additional_files:
         val = ",".join([_as_cfg_path(f) for f in additional_files])
         additional_str = f'<additional-files value="{val}"/>'
 
     net_value = _as_cfg_path(net_file)
     route_value = _as_cfg_path(route_file)
-    fcd_value = _as_cfg_path(fcd_file)
+    output_str = output_config_xml(profile, outputs, _as_cfg_path)
 
     with open(cfg_path, "w", encoding="utf-8") as f:
         f.write(f"""<configuration>
@@ -204,7 +252,5 @@ def _create_config(cfg_path: str, net_file: str, route_file: str, fcd_file: str,
         <begin value="0"/>
         <end value="{steps}"/>
     </time>
-    <output>
-        <fcd-output value="{fcd_value}"/>
-    </output>
+    {output_str}
 </configuration>""")
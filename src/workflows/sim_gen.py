@@ -1,10 +1,21 @@
 import os
+from typing import Any, Dict, Optional
+
 from mcp_tools.network import netgenerate
 from mcp_tools.route import random_trips, duarouter
 from mcp_tools.simulation import run_simple_simulation
-from mcp_tools.analysis import analyze_fcd
+from mcp_tools.analysis import analyze_run_outputs
+from utils.cancellation import report_progress
+from utils.output_profiles import OutputProfile, output_config_xml, prepare_outputs
 
-def sim_gen_workflow(output_dir: str, grid_number: int = 3, steps: int = 100) -> str:
+def sim_gen_workflow(
+    output_dir: str,
+    grid_number: int = 3,
+    steps: int = 100,
+    output_format: str = "xml",
+    output_profile: str = "full",
+    profile_options: Optional[Dict[str, Any]] = None,
+) -> str:
     """
     Executes the Simulation Generation & Evaluation workflow:
     1. Generate Grid Network
@@ -13,7 +24,15 @@ def sim_gen_workflow(output_dir: str, grid_number: int = 3, steps: int = 100) ->
     4. Create Config
     5. Run Simulation
     6. Analyze Results
+
+    `output_format` selects the FCD file format ("xml", "xml.gz", "csv", "csv.gz" or "parquet");
+    `output_profile` ("full", "sampled", "aggregate") and `profile_options` control the output volume.
     """
+    try:
+        profile = OutputProfile.from_options(output_profile, output_format, profile_options)
+    except (TypeError, ValueError) as e:
+        return f"Error: {e}"
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
@@ -21,17 +40,19 @@ def sim_gen_workflow(output_dir: str, grid_number: int = 3, steps: int = 100) ->
     trips_file = os.path.join(output_dir, "trips.xml")
     route_file = os.path.join(output_dir, "routes.xml")
     sumocfg_file = os.path.join(output_dir, "sim.sumocfg")
-    fcd_file = os.path.join(output_dir, "fcd.xml")
     
     # 1. Generate Net
+    report_progress("Step 1/6: generating network")
     res = netgenerate(net_file, grid=True, grid_number=grid_number)
     if "failed" in res.lower(): return f"Step 1 Failed: {res}"
     
     # 2. Generate Trips
+    report_progress("Step 2/6: generating trips")
     res = random_trips(net_file, trips_file, end_time=steps)
     if "failed" in res.lower(): return f"Step 2 Failed: {res}"
     
     # 3. Generate Routes
+    report_progress("Step 3/6: computing routes")
     res = duarouter(net_file, trips_file, route_file)
     if "failed" in res.lower(): return f"Step 3 Failed: {res}"
     
@@ -39,32 +60,40 @@ def sim_gen_workflow(output_dir: str, grid_number: int = 3, steps: int = 100) ->
     # We use absolute paths for safety or relative if SUMO expects it. 
     # Usually relative to config file is best.
     try:
+        outputs = prepare_outputs(profile, output_dir, "")
+        additional_str = ""
+        if outputs.additional:
+            val = ",".join(os.path.basename(p) for p in outputs.additional)
+            additional_str = f'<additional-files value="{val}"/>'
+        output_str = output_config_xml(profile, outputs, os.path.basename)
         with open(sumocfg_file, "w") as f:
             f.write(f"""<configuration>
     <input>
         <net-file value="{os.path.basename(net_file)}"/>
         <route-files value="{os.path.basename(route_file)}"/>
+        {additional_str}
     </input>
     <time>
         <begin value="0"/>
         <end value="{steps}"/>
     </time>
-    <output>
-        <fcd-output value="{os.path.basename(fcd_file)}"/>
-    </output>
+    {output_str}
 </configuration>""")
     except Exception as e:
         return f"Step 4 Failed: Could not write config file. {e}"
     
     # 5. Run Sim
+    report_progress("Step 5/6: running simulation")
     res = run_simple_simulation(sumocfg_file, steps)
     if "error" in res.lower(): return f"Step 5 Failed: {res}"
     
     # 6. Analyze
-    # FCD file should exist after sim
-    if not os.path.exists(fcd_file):
-        return "Step 6 Failed: FCD file not generated."
-        
-    res_analysis = analyze_fcd(fcd_file)
+    report_progress("Step 6/6: analyzing outputs")
+    # The primary output of the chosen profile (FCD or edgeData) should exist after sim
+    primary_output = outputs.fcd or outputs.edgedata
+    if primary_output and not os.path.exists(primary_output):
+        return f"Step 6 Failed: {os.path.basename(primary_output)} not generated."
+
+    res_analysis = analyze_run_outputs(profile, outputs)
     
-    return f"Workflow Completed Successfully.\n\nSimulation Output:\n{res}\n\nAnalysis Result:\n{res_analysis}"
+    return f"Workflow Completed Successfully.\n\nSimulation Output:\n{res}\n\n{res_analysis}"
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules import each other as top-level packages (`utils.x`, `mcp_tools.x`), as when server.py runs.
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
@@ -0,0 +1,80 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pytest
+
+import utils.fcd
+from utils.fcd import split_fcd_ranges
+from utils.fcd_index import build_fcd_index
+from utils.fcd_store import build_fcd_store
+
+STEPS = 120
+EMPTY_TAIL = 15
+
+
+@pytest.fixture
+def fcd_file(tmp_path: Path) -> str:
+    lines: List[str] = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        "",
+        '<fcd-export xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">',
+    ]
+    for step in range(STEPS):
+        lines.append(f'    <timestep time="{step:.2f}">')
+        for veh in range(step % 7):
+            lane = f"E{veh % 3}_0"
+            lines.append(
+                f'        <vehicle id="v{(step // 10 + veh) % 12}" x="{step * 1.5 + veh:.2f}" y="{veh * 3.2:.2f}" '
+                f'angle="90.00" type="DEFAULT_VEHTYPE" speed="{(step + veh) % 14:.2f}" pos="{step:.2f}" '
+                f'lane="{lane}" slope="0.00"/>'
+            )
+        lines.append("    </timestep>")
+    # SUMO ends the output with self-closing timesteps once every vehicle has arrived.
+    for step in range(STEPS, STEPS + EMPTY_TAIL):
+        lines.append(f'    <timestep time="{step:.2f}"/>')
+    lines.append("</fcd-export>")
+    path = tmp_path / "fcd.xml"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def split_small_files(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(utils.fcd, "FCD_PARALLEL_MIN_BYTES", 0)
+
+
+def test_split_ranges_cover_every_timestep(fcd_file: str) -> None:
+    data = Path(fcd_file).read_bytes()
+    ranges = split_fcd_ranges(fcd_file, 4)
+    assert len(ranges) > 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    first, last = ranges[0][0], ranges[-1][1]
+    assert data[first:].startswith(b"<timestep")
+    assert data[last:].startswith(b"</fcd-export>")
+    assert sum(data[s:e].count(b"<timestep") for s, e in ranges) == STEPS + EMPTY_TAIL
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_index_equals_serial(fcd_file: str, tmp_path: Path, workers: int) -> None:
+    serial = build_fcd_index(fcd_file, str(tmp_path / "serial.fcdindex"), workers=1)
+    parallel = build_fcd_index(fcd_file, str(tmp_path / "parallel.fcdindex"), workers=workers)
+    assert serial.timesteps == STEPS + EMPTY_TAIL
+    np.testing.assert_array_equal(parallel.times, serial.times)
+    np.testing.assert_array_equal(parallel.offsets, serial.offsets)
+    assert parallel.vehicles == serial.vehicles
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_store_equals_serial(fcd_file: str, tmp_path: Path, workers: int) -> None:
+    serial = build_fcd_store(fcd_file, str(tmp_path / "serial.fcdstore"), workers=1)
+    parallel = build_fcd_store(fcd_file, str(tmp_path / "parallel.fcdstore"), workers=workers)
+    assert parallel.rows == serial.rows == sum(step % 7 for step in range(STEPS))
+    for name in ("time", "x", "y", "speed"):
+        np.testing.assert_array_equal(parallel.column(name), serial.column(name))
+    # Parts intern strings independently, so compare the decoded values.
+    for name in ("vehicle", "lane", "edge"):
+        decoded_serial = [serial.strings[name][code] for code in serial.column(name)]
+        decoded_parallel = [parallel.strings[name][code] for code in parallel.column(name)]
+        assert decoded_parallel == decoded_serial
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+import utils.jobs
+from utils.jobs import JobManager
+
+
+@pytest.fixture
+def job_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(utils.jobs, "JOB_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def live_pid() -> Iterator[int]:
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        yield process.pid
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.fixture
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def write_record(job_dir: Path, job_id: str, status: str, **owner: Any) -> None:
+    directory = job_dir / job_id
+    directory.mkdir()
+    record = {"job_id": job_id, "tool": "run_simple_simulation", "args": {}, "status": status, "created_at": 1.0}
+    record.update(owner)
+    (directory / "job.json").write_text(json.dumps(record), encoding="utf-8")
+
+
+def status_on_disk(job_dir: Path, job_id: str) -> str:
+    path = job_dir / job_id / "job.json"
+    return str(json.loads(path.read_text(encoding="utf-8"))["status"])
+
+
+def test_jobs_of_a_live_server_are_left_alone(job_dir: Path, live_pid: int) -> None:
+    write_record(job_dir, "other", "running", owner_host=utils.jobs._HOST, owner_pid=live_pid)
+    manager = JobManager(max_workers=1)
+    assert manager.list() == []
+    assert status_on_disk(job_dir, "other") == "running"
+
+
+@pytest.mark.parametrize("owner", [{"owner_pid": None}, {"owner_pid": "dead"}, {"owner_host": "elsewhere"}])
+def test_active_jobs_without_a_live_owner_are_interrupted(job_dir: Path, dead_pid: int, owner: Any) -> None:
+    fields = {"owner_host": utils.jobs._HOST, **owner}
+    if fields.get("owner_pid") == "dead":
+        fields["owner_pid"] = dead_pid
+    write_record(job_dir, "stale", "queued", **fields)
+    manager = JobManager(max_workers=1)
+    job = manager.get("stale")
+    assert job.status == "interrupted"
+    assert (job.owner_host, job.owner_pid) == (utils.jobs._HOST, os.getpid())
+    assert status_on_disk(job_dir, "stale") == "interrupted"
+
+
+def test_finished_and_unreadable_records(job_dir: Path, dead_pid: int) -> None:
+    write_record(job_dir, "done", "finished", owner_host=utils.jobs._HOST, owner_pid=dead_pid)
+    (job_dir / "broken").mkdir()
+    (job_dir / "broken" / "job.json").write_text("{not json", encoding="utf-8")
+    (job_dir / "empty").mkdir()
+    manager = JobManager(max_workers=1)
+    assert [job.job_id for job in manager.list()] == ["done"]
+    assert manager.get("done").status == "finished"
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+import pytest
+
+from utils.kpi import bootstrap_ci
+
+
+def test_empty_and_all_nan_give_nan() -> None:
+    for values in (np.array([]), np.array([np.nan, np.nan])):
+        lo, hi = bootstrap_ci(values)
+        assert math.isnan(lo) and math.isnan(hi)
+
+
+def test_single_value_and_constant_values() -> None:
+    assert bootstrap_ci(np.array([4.5])) == (4.5, 4.5)
+    assert bootstrap_ci(np.array([np.nan, 4.5])) == (4.5, 4.5)
+    lo, hi = bootstrap_ci(np.full(50, 2.0), n_resamples=200)
+    assert lo == pytest.approx(2.0) and hi == pytest.approx(2.0)
+
+
+def test_interval_brackets_mean_and_is_reproducible() -> None:
+    values = np.random.default_rng(3).normal(10.0, 2.0, size=500)
+    lo, hi = bootstrap_ci(values, n_resamples=500, seed=1)
+    assert lo < values.mean() < hi
+    assert bootstrap_ci(values, n_resamples=500, seed=1) == (lo, hi)
+    wide_lo, wide_hi = bootstrap_ci(values, n_resamples=500, confidence=0.99, seed=1)
+    assert wide_lo <= lo and wide_hi >= hi
+
+
+def test_single_resample_is_allowed() -> None:
+    lo, hi = bootstrap_ci(np.array([1.0, 2.0, 3.0]), n_resamples=1)
+    assert lo == hi
+
+
+@pytest.mark.parametrize("n_resamples", [0, -5])
+def test_rejects_non_positive_resamples(n_resamples: int) -> None:
+    with pytest.raises(ValueError, match="n_resamples"):
+        bootstrap_ci(np.array([1.0, 2.0]), n_resamples=n_resamples)
+
+
+@pytest.mark.parametrize("confidence", [0.0, 1.0, -0.5, 95.0])
+def test_rejects_confidence_outside_unit_interval(confidence: float) -> None:
+    with pytest.raises(ValueError, match="confidence"):
+        bootstrap_ci(np.array([1.0, 2.0]), confidence=confidence)
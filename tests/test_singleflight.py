@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from utils.cancellation import CancelToken, OperationCancelled, run_with_token
+from utils.singleflight import SingleFlight, call_key
+
+
+def test_argument_order_none_and_numeric_type_do_not_change_key() -> None:
+    a = call_key("tool", {"action": "run", "params": {"steps": 10, "seed": 1, "label": None}})
+    b = call_key("tool", {"params": {"seed": 1.0, "steps": 10.0}, "action": "run"})
+    assert a == b
+    assert a != call_key("tool", {"action": "run", "params": {"steps": 11, "seed": 1}})
+    assert a != call_key("other", {"action": "run", "params": {"steps": 10, "seed": 1}})
+
+
+def test_key_follows_input_files_only(tmp_path: Path) -> None:
+    net = tmp_path / "a.net.xml"
+    routes = tmp_path / "b.rou.xml"
+    output = tmp_path / "out.xml"
+    for path in (net, routes, output):
+        path.write_text("<x/>", encoding="utf-8")
+    args = {"net_file": str(net), "params": {"route_files": f"{routes}, {net}"}, "output_file": str(output)}
+    inputs = ("net_file", "params.route_files")
+    key = call_key("tool", args, inputs)
+
+    # Rewriting an output between calls must not split otherwise identical calls.
+    os.utime(output, ns=(0, 0))
+    assert call_key("tool", args, inputs) == key
+
+    # Changing any file of a comma-separated input list must.
+    stat = routes.stat()
+    os.utime(routes, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert call_key("tool", args, inputs) != key
+
+
+def test_missing_input_file_is_keyed_by_path(tmp_path: Path) -> None:
+    missing = str(tmp_path / "missing.xml")
+    key = call_key("tool", {"net_file": missing}, ("net_file", "params.osm_file"))
+    assert missing in key
+    assert key == call_key("tool", {"net_file": missing}, ("net_file", "params.osm_file"))
+
+
+def test_concurrent_calls_share_one_execution() -> None:
+    flight = SingleFlight()
+    release = threading.Event()
+    calls: List[int] = []
+    results: List[int] = []
+
+    def work() -> int:
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    threads = [threading.Thread(target=lambda: results.append(flight.run("t", "k", work))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.describe() != ["t: 4 calls, 1 executions, 3 coalesced"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [42] * 4
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
+
+
+def test_cancelled_waiter_returns_without_waiting_for_leader() -> None:
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def work() -> str:
+        started.set()
+        release.wait(5)
+        return "done"
+
+    leader = threading.Thread(target=flight.run, args=("t", "k", work))
+    leader.start()
+    started.wait(5)
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(OperationCancelled):
+        run_with_token(token, flight.run, "t", "k", work)
+    release.set()
+    leader.join(5)
+    assert flight.describe() == ["t: 2 calls, 1 executions, 1 coalesced"]
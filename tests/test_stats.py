@@ -0,0 +1,82 @@
+import math
+import pickle
+
+import numpy as np
+import pytest
+
+from utils.stats import QuantileSketch, RunningStats
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    return np.random.default_rng(7).lognormal(mean=2.0, sigma=0.8, size=20_000)
+
+
+def test_running_stats_matches_numpy(values: np.ndarray) -> None:
+    stats = RunningStats()
+    stats.extend(values.tolist())
+    assert stats.count == values.size
+    assert stats.mean == pytest.approx(values.mean(), rel=1e-12)
+    assert stats.variance == pytest.approx(values.var(ddof=1), rel=1e-9)
+    assert (stats.min, stats.max) == (values.min(), values.max())
+
+
+def test_running_stats_merge_and_add_array_equal_one_pass(values: np.ndarray) -> None:
+    one_pass = RunningStats()
+    one_pass.extend(values.tolist())
+    merged = RunningStats()
+    for chunk in np.array_split(values, 7):
+        part = RunningStats()
+        part.add_array(chunk)
+        merged.merge(part)
+    assert merged.count == one_pass.count
+    assert merged.mean == pytest.approx(one_pass.mean, rel=1e-12)
+    assert merged.variance == pytest.approx(one_pass.variance, rel=1e-9)
+
+
+def test_running_stats_empty_and_pickle() -> None:
+    empty = RunningStats()
+    assert math.isnan(empty.variance)
+    empty.add_array(np.array([]))
+    assert empty.count == 0
+    stats = RunningStats()
+    stats.extend([1.0, 2.0, 4.0])
+    restored = pickle.loads(pickle.dumps(stats))
+    assert (restored.count, restored.mean, restored.m2, restored.min, restored.max) == (
+        stats.count, stats.mean, stats.m2, stats.min, stats.max
+    )
+
+
+@pytest.mark.parametrize("q", [0.0, 0.1, 0.5, 0.9, 0.99, 1.0])
+def test_quantile_sketch_relative_accuracy(values: np.ndarray, q: float) -> None:
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    sketch.add_array(values)
+    exact = float(np.quantile(values, q, method="lower"))
+    assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+
+
+def test_quantile_sketch_merge_equals_single_sketch(values: np.ndarray) -> None:
+    single = QuantileSketch()
+    single.add_array(values)
+    merged = QuantileSketch()
+    for chunk in np.array_split(values, 5):
+        part = QuantileSketch()
+        for value in chunk.tolist():
+            part.add(value)
+        merged.merge(part)
+    assert merged.count == single.count
+    for q in (0.05, 0.5, 0.95):
+        assert merged.quantile(q) == single.quantile(q)
+
+
+def test_quantile_sketch_signs_and_errors() -> None:
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    sketch.add_array(np.array([-3.0, 0.0, 0.0, 5.0]))
+    assert sketch.quantile(0.0) == pytest.approx(-3.0, rel=0.005)
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(5.0, rel=0.005)
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
+    with pytest.raises(ValueError):
+        sketch.merge(QuantileSketch(relative_accuracy=0.02))